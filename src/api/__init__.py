@@ -23,16 +23,18 @@ class APIController:
     Class to initialize and control the Flask API.
     """
 
-    def __init__(self, queues, stop_event):
+    def __init__(self, queues, stop_event, status=None):
         """
         Initialize the APIController class.
 
         Args:
             queues (dict): Dictionary of queues used for inter-thread communication.
             stop_event (threading.Event): Event to signal the thread to stop.
+            status (RealtimeStatus, optional): The shared status of the print-loop.
         """
         self.queues = queues
         self.stopped = stop_event
+        self.status = status
 
         # Blueprints mapping
         self.blueprints = {
@@ -54,7 +56,7 @@ class APIController:
         Register all the blueprints to the Flask app.
         """
         for blueprint in self.blueprints:
-            blueprint_instance = self.blueprints[blueprint](self.queues, self.stopped)
+            blueprint_instance = self.blueprints[blueprint](self.queues, self.stopped, self.status)
             self.app.register_blueprint(blueprint_instance.blueprint)
 
     def run(self, debug=False):
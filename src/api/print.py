@@ -23,16 +23,18 @@ class APIPrintEndpoints:
     """
     Class to define API endpoints related to print operations like start, stop, level, and upload.
     """
-    def __init__(self, queues, stopped_event):
+    def __init__(self, queues, stopped_event, status=None):
         """
         Initialize the APIPrintEndpoints class.
 
         Args:
             queues (dict): Dictionary of queues used for inter-thread communication.
+            status (RealtimeStatus, optional): The shared status of the print-loop.
         """
         self.blueprint = Blueprint('print', __name__)
         self.queues = queues
         self.stopped = stopped_event
+        self.status = status
 
         # Register routes
         self.blueprint.add_url_rule('/start', 'start', self.start, methods=['GET'])
@@ -53,11 +55,13 @@ class APIPrintEndpoints:
     def stop(self):
         """
         Endpoint to stop the printing process.
+        The stop signal is set right here instead of through the command queue, so the UV light
+        and the motor are turned off before the response is sent.
 
         Returns:
             tuple: JSON response and HTTP status code.
         """
-        self.queues['cmd'].put(["stop", {}])
+        self.stopped.set('api')
         return jsonify({"message": "Print stopped"}), 200
 
     def level(self):
@@ -7,20 +7,24 @@ class APISystemEndpoints:
     """
     Class to define API endpoints related to system operations like exit and reboot.
     """
-    def __init__(self, queues, stopped_event):
+    def __init__(self, queues, stopped_event, status=None):
         """
         Initialize the APISystemEndpoints class.
 
         Args:
             queues (dict): Dictionary of queues used for inter-thread communication.
+            status (RealtimeStatus, optional): The shared status of the print-loop.
         """
         self.blueprint = Blueprint('system', __name__)
         self.queues = queues
         self.stopped = stopped_event
+        self.status = status
 
         # Register routes
         self.blueprint.add_url_rule('/exit', 'exit', self.exit, methods=['GET'])
         self.blueprint.add_url_rule('/reboot', 'reboot', self.reboot, methods=['GET'])
+        self.blueprint.add_url_rule('/latency', 'latency', self.latency, methods=['GET'])
+        self.blueprint.add_url_rule('/status', 'status', self.state, methods=['GET'])
 
     def exit(self):
         """
@@ -41,3 +45,25 @@ class APISystemEndpoints:
         """
         self.queues['cmd'].put(["reboot", {}])
         return jsonify({"message": "Rebooting..."}), 200
+
+    def latency(self):
+        """
+        Endpoint returning the latency from sending a command or job to the thread acting on it.
+
+        Returns:
+            tuple: JSON response with the statistics per queue (ns) and HTTP status code.
+        """
+        return jsonify({name: q.stats for name, q in self.queues.items() if hasattr(q, 'stats')}), 200
+
+    def state(self):
+        """
+        Endpoint returning the state of the print-loop (also if it runs in the print process) and the stop signal.
+
+        Returns:
+            tuple: JSON response and HTTP status code.
+        """
+        return jsonify({
+            "printer": self.status.read() if self.status is not None else None,
+            "stopped": self.stopped.is_set(),
+            "reason": self.stopped.reason
+        }), 200
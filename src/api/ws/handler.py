@@ -28,8 +28,11 @@ class WebSocketConsoleHandler:
                     if i + 1 < len(tokens):
                         arguments[tokens[i]] = tokens[i + 1]
 
-                # Execute corresponding command
-                await self.queues['cmd'].put([command, arguments])
+                # Stop right away, everything else is executed by the manager
+                if command == 'stop':
+                    self.stopped.set('websocket')
+                else:
+                    self.queues['cmd'].put([command, arguments])
 
         # Handle connection errors
         except websockets.ConnectionClosedError as e:
@@ -0,0 +1,94 @@
+import sys
+import time
+import logging
+import argparse
+import threading
+
+from lib.gpio import gpio_dict  # loads the fake GPIO backend when not running on a Raspberry Pi
+from lib.thread import StopSignal
+from lib.exposure import ExposureController
+from lib.stepper import StepperDriver
+from lib.timing import percentile
+
+import RPi.GPIO as GPIO
+
+"""
+Benchmark of the emergency-stop path with the fake GPIO backend.
+
+A stop request is sent from a second thread while the print path is exposing, stepping or waiting,
+and the time until the UV light and the motor are off (stop handlers) and until the print path has
+returned is measured. Fails if any latency exceeds the bound.
+
+Usage (from the repository root): PYTHONPATH=src python -m bench.estop [--bound 0.1] [--runs 10]
+"""
+
+
+def measure(signal, action, delay):
+    """
+    Run an action of the print path in a thread and set the stop signal after a delay.
+
+    Parameters:
+        signal (StopSignal): The stop signal used by the action.
+        action (callable): The action, must return when the signal is set.
+        delay (float): The time in seconds after which the stop is requested.
+
+    Returns:
+        tuple: The latency of the stop handlers and of the action returning, in ns.
+    """
+    signal.clear()
+    returned = []
+    thread = threading.Thread(target=lambda: (action(), returned.append(time.perf_counter_ns())))
+    thread.start()
+    time.sleep(delay)
+    signal.set('benchmark')
+    thread.join()
+    return signal.handled_at - signal.set_at, returned[0] - signal.set_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the emergency-stop latency of the print path.")
+    parser.add_argument('--bound', type=float, default=0.1, help="maximal latency in seconds")
+    parser.add_argument('--runs', type=int, default=10, help="stop requests per action")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # the fake GPIO reads random input levels and prints every call, keep the limit switch released
+    if 'fake_rpi' in sys.modules:
+        sys.modules['fake_rpi'].toggle_print(False)
+    if hasattr(GPIO, 'set_input'):
+        GPIO.set_input(gpio_dict['limit_switch'], GPIO.HIGH)
+
+    signal = StopSignal()
+    exposure = ExposureController(signal)
+    stepper = StepperDriver(signal)
+    signal.on_set(exposure.halt)
+    signal.on_set(stepper.disable)
+
+    actions = {
+        'exposure': lambda: exposure.expose(60),
+        'move': lambda: stepper.up(stepper.planner.steps(100)),
+        'settling': lambda: signal.wait(60)
+    }
+
+    failed = False
+    for name, action in actions.items():
+        handlers, returns = [], []
+        for _ in range(args.runs):
+            handled, returned = measure(signal, action, 0.05)
+            handlers.append(handled)
+            returns.append(returned)
+        handlers.sort()
+        returns.sort()
+        worst = max(handlers[-1], returns[-1]) / 1e9
+        failed |= worst > args.bound
+        print(
+            f"{name:10s} handlers p50 {percentile(handlers, 0.5) / 1e6:8.3f}ms max {handlers[-1] / 1e6:8.3f}ms | "
+            f"returned p50 {percentile(returns, 0.5) / 1e6:8.3f}ms max {returns[-1] / 1e6:8.3f}ms "
+            f"[{'FAIL' if worst > args.bound else 'ok'}]"
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,72 @@
 import RPi.GPIO as GPIO
 
 from lib.gpio import gpio_dict
+from settings import settings_dict
 
 """
 This module provides a convenient way to manage GPIO components on a Raspberry Pi.
 It uses the RPi.GPIO library for GPIO operations and a custom gpio_dict for pin mappings.
+For hot paths (e.g. step pulses), Component.handle binds a pin once, optionally to the
+memory-mapped GPIO registers (see lib.gpiomem).
 """
 
+# Pin handles by component name, and the mapped GPIO registers if the gpiomem backend is used
+_handles = {}
+_gpio_memory = None
+
+
+class GpioPinHandle:
+    """
+    Handle of a single pin using RPi.GPIO, with the pin number bound once.
+    """
+    __slots__ = ('pin',)
+
+    def __init__(self, pin):
+        """
+        Initialize the GpioPinHandle instance.
+
+        Parameters:
+            pin (int): The BCM pin number.
+        """
+        self.pin = pin
+
+    def set(self):
+        """
+        Set the pin high.
+        """
+        GPIO.output(self.pin, GPIO.HIGH)
+
+    def clear(self):
+        """
+        Set the pin low.
+        """
+        GPIO.output(self.pin, GPIO.LOW)
+
+    def level(self):
+        """
+        Read the level of the pin.
+
+        Returns:
+            bool: True if the pin is high.
+        """
+        return GPIO.input(self.pin) == GPIO.HIGH
+
+
+class NullPinHandle:
+    """
+    Handle of a component without a pin (e.g. disabled in the settings), does nothing.
+    """
+    __slots__ = ()
+
+    def set(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def level(self):
+        return False
+
 
 class Component:
     """
@@ -58,6 +118,34 @@ class Component:
             return True
         return False
 
+    @staticmethod
+    def handle(pin):
+        """
+        Get the handle of a GPIO pin for repeated use. The handle is created once per pin,
+        for the backend configured in system.gpio (rpigpio or gpiomem).
+
+        Parameters:
+            pin (int or str): The pin identifier as defined in gpio_dict.
+
+        Returns:
+            GpioPinHandle, PinHandle or NullPinHandle: The handle with set, clear and level methods.
+        """
+        global _gpio_memory
+
+        handle = _handles.get(pin)
+        if handle is None:
+            if not gpio_dict[pin]:
+                handle = NullPinHandle()
+            elif settings_dict['system']['gpio']['backend'] == 'gpiomem':
+                if _gpio_memory is None:
+                    from lib.gpiomem import GpioMemory
+                    _gpio_memory = GpioMemory(settings_dict['system']['gpio']['device'])
+                handle = _gpio_memory.pin(gpio_dict[pin])
+            else:
+                handle = GpioPinHandle(gpio_dict[pin])
+            _handles[pin] = handle
+        return handle
+
     @staticmethod
     def status(self):
         """
@@ -0,0 +1,323 @@
+import io
+import os
+import mmap
+import struct
+import logging
+
+import numpy as np
+from PIL import Image
+
+from lib.source import LayerSource, LayerSourceError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the compiled job container. An uploaded job is compiled once into a single
+binary file holding a table with the area, bounding box and offset of every layer, followed by the
+layers cropped to their bounding box and encoded bit-packed or run-length encoded. At print time the
+container is memory-mapped and a layer is unpacked straight into a display buffer.
+"""
+
+CONTAINER_EXTENSION = ".rpyc"
+CONTAINER_MAGIC = b'RPYC'
+CONTAINER_VERSION = 1
+
+# Header: magic, version, reserved, width, height, layer count, number of the first layer
+HEADER = struct.Struct('<4sHHIIIi')
+
+# Layer table entry: payload offset, payload length, encoding, lit value, area, bounding box (x0, y0, x1, y1)
+LAYER_TABLE = np.dtype([
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('encoding', 'u1'),
+    ('value', 'u1'),
+    ('reserved', '<u2'),
+    ('area', '<u4'),
+    ('x0', '<u2'),
+    ('y0', '<u2'),
+    ('x1', '<u2'),
+    ('y1', '<u2')
+])
+
+# Layer encodings
+ENCODING_EMPTY = 0  # no lit pixel, no payload
+ENCODING_BITPACK = 1  # one bit per pixel of the bounding box, all lit pixels have the same value
+ENCODING_RLE = 2  # run count (u32), run values (u8) and run lengths (u32) of the bounding box
+
+
+class ContainerError(LayerSourceError):
+    """
+    Custom exception for job container errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def rle_encode(pixels):
+    """
+    Run-length encode a flat array of pixels.
+
+    Parameters:
+        pixels (numpy.ndarray): The pixels (uint8, one dimension).
+
+    Returns:
+        tuple: The values (uint8) and lengths (uint32) of the runs.
+    """
+    starts = np.concatenate(([0], np.flatnonzero(pixels[1:] != pixels[:-1]) + 1))
+    lengths = np.diff(np.append(starts, pixels.size)).astype('<u4')
+    return pixels[starts], lengths
+
+
+def rle_decode(values, lengths, out=None):
+    """
+    Expand runs into a flat array of pixels.
+
+    Parameters:
+        values (numpy.ndarray): The values of the runs.
+        lengths (numpy.ndarray): The lengths of the runs.
+        out (numpy.ndarray, optional): A flat array receiving the pixels.
+
+    Returns:
+        numpy.ndarray: The pixels.
+    """
+    pixels = np.repeat(values, lengths)
+    if out is None:
+        return pixels
+    out[:] = pixels
+    return out
+
+
+def encode_layer(frame):
+    """
+    Encode a layer into the smaller of the possible encodings.
+
+    Parameters:
+        frame (numpy.ndarray): The layer at native resolution (uint8, height x width).
+
+    Returns:
+        tuple: (encoding, lit value, area, bounding box, payload)
+    """
+    lit = frame > 0
+    area = int(np.count_nonzero(lit))
+    if area == 0:
+        return ENCODING_EMPTY, 0, 0, (0, 0, 0, 0), b''
+
+    rows = np.flatnonzero(lit.any(axis=1))
+    cols = np.flatnonzero(lit.any(axis=0))
+    x0, y0, x1, y1 = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    crop = frame[y0:y1, x0:x1]
+
+    values, lengths = rle_encode(crop.ravel())
+    payload = struct.pack('<I', values.size) + values.tobytes() + lengths.tobytes()
+    encoding, value = ENCODING_RLE, 0
+
+    # binary layers (all lit pixels have the same value) can be bit-packed
+    lit_values = crop[lit[y0:y1, x0:x1]]
+    if lit_values.min() == lit_values.max():
+        packed = np.packbits(crop > 0, axis=1).tobytes()
+        if len(packed) < len(payload):
+            encoding, value, payload = ENCODING_BITPACK, int(lit_values[0]), packed
+
+    return encoding, value, area, (x0, y0, x1, y1), payload
+
+
+def compile_container(source, filepath):
+    """
+    Compile all layers of a layer source into a job container.
+    The container is written to a temporary file first and renamed when complete.
+
+    Parameters:
+        source (LayerSource): The layer source of the job.
+        filepath (str): The path of the container to write.
+
+    Raises:
+        ContainerError: If the layers cannot be compiled or the container cannot be written.
+    """
+    layers = list(source)
+    if not layers:
+        raise ContainerError("Cannot compile a job without layers")
+
+    directory, filename = os.path.split(filepath)
+    os.makedirs(directory, exist_ok=True)
+    temp_filepath = os.path.join(directory, f".{filename}.tmp")
+
+    table = np.zeros(len(layers), dtype=LAYER_TABLE)
+    offset = HEADER.size + table.nbytes
+    width = height = None
+
+    try:
+        with open(temp_filepath, 'wb') as f:
+            f.seek(offset)
+            for i, layer in enumerate(layers):
+                frame = source.frame(layer)
+                if width is None:
+                    height, width = frame.shape
+                elif frame.shape != (height, width):
+                    raise ContainerError(f"Layer {layer} has a different resolution")
+
+                encoding, value, area, (x0, y0, x1, y1), payload = encode_layer(frame)
+                table[i] = (offset, len(payload), encoding, value, 0, area, x0, y0, x1, y1)
+                f.write(payload)
+                offset += len(payload)
+
+            f.seek(0)
+            f.write(HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, 0, width, height, len(layers), layers[0]))
+            f.write(table.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filepath, filepath)
+    except OSError as e:
+        raise ContainerError(f"Could not write container '{filepath}'. Reason: {e}")
+    finally:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+
+    logger.info(f"Compiled {len(layers)} layers into '{filepath}' ({offset} bytes)")
+
+
+class ContainerLayerSource(LayerSource):
+    """
+    Layer source reading layers from a memory-mapped job container.
+    """
+
+    def __init__(self, filepath):
+        """
+        Initialize the ContainerLayerSource instance, map the container and read its layer table.
+
+        Parameters:
+            filepath (str): The path to the container.
+
+        Raises:
+            ContainerError: If the container cannot be read.
+        """
+        super().__init__(filepath)
+        self.table = None
+        self.__file = None
+        self.__map = None
+
+        try:
+            self.__file = open(self.filepath, 'rb')
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, _, self.width, self.height, count, first = HEADER.unpack_from(self.__map, 0)
+        except (OSError, ValueError, struct.error) as e:
+            self.close()
+            raise ContainerError(f"Could not read container '{self.filepath}'. Reason: {e}")
+
+        if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION:
+            self.close()
+            raise ContainerError(f"'{self.filepath}' is not a job container of version {CONTAINER_VERSION}")
+
+        self.table = np.frombuffer(self.__map, dtype=LAYER_TABLE, count=count, offset=HEADER.size)
+        self.layers = {first + i: i for i in range(count)}
+
+    def entry(self, layer):
+        """
+        Get the table entry of a layer.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            numpy.void: The table entry.
+        """
+        if layer not in self.layers:
+            raise ContainerError(f"Layer {layer} not found in '{self.filepath}'")
+        return self.table[self.layers[layer]]
+
+    def info(self, layer):
+        """
+        Get the lit area and bounding box of a layer.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            dict: The area in pixels and the bounding box (x0, y0, x1, y1), empty layers have an empty box.
+        """
+        entry = self.entry(layer)
+        return {
+            'area': int(entry['area']),
+            'bbox': (int(entry['x0']), int(entry['y0']), int(entry['x1']), int(entry['y1']))
+        }
+
+    def payload(self, layer):
+        """
+        Get the encoded payload of a layer (zero-copy view into the container).
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            numpy.ndarray: The payload bytes.
+        """
+        entry = self.entry(layer)
+        return np.frombuffer(self.__map, dtype=np.uint8, count=int(entry['length']), offset=int(entry['offset']))
+
+    def frame(self, layer, out=None):
+        """
+        Unpack a layer into a display buffer at native resolution.
+
+        Parameters:
+            layer (int): The layer number.
+            out (numpy.ndarray, optional): The buffer (uint8, height x width) to unpack into.
+
+        Returns:
+            numpy.ndarray: The layer.
+        """
+        entry = self.entry(layer)
+        if out is None:
+            out = np.zeros((self.height, self.width), dtype=np.uint8)
+        else:
+            out.fill(0)
+
+        encoding = entry['encoding']
+        if encoding == ENCODING_EMPTY:
+            return out
+
+        x0, y0, x1, y1 = int(entry['x0']), int(entry['y0']), int(entry['x1']), int(entry['y1'])
+        region = out[y0:y1, x0:x1]
+        payload = self.payload(layer)
+
+        if encoding == ENCODING_BITPACK:
+            bits = np.unpackbits(payload.reshape(y1 - y0, -1), axis=1, count=x1 - x0)
+            np.multiply(bits, entry['value'], out=region)
+        elif encoding == ENCODING_RLE:
+            count = int(payload[:4].view('<u4')[0])
+            values = payload[4:4 + count]
+            lengths = payload[4 + count:4 + 5 * count].view('<u4')
+            region[...] = rle_decode(values, lengths).reshape(y1 - y0, x1 - x0)
+        else:
+            raise ContainerError(f"Unknown encoding {encoding} of layer {layer}")
+        return out
+
+    def read(self, layer):
+        """
+        Encode a layer as PNG (e.g. for previews).
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The PNG image.
+        """
+        image = io.BytesIO()
+        Image.fromarray(self.frame(layer)).save(image, format='PNG')
+        return image.getvalue()
+
+    def close(self):
+        """
+        Unmap and close the container.
+        """
+        self.table = None
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # a view of a layer is still in use, the map is released with it
+                pass
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
@@ -0,0 +1,131 @@
+import time
+import logging
+from collections import namedtuple
+
+from lib.component import Component
+from lib.timing import wait_until, percentile
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the exposure controller. The UV light is switched off against an absolute
+perf_counter_ns() deadline, ahead of time by the measured latency of the GPIO write, and the actual
+on-time and the delay between the display update and UV on are recorded for every layer.
+For greyscale exposure, the masks of a layer are flipped while the UV light is on, each against
+its own deadline, and the lateness and duration of every flip are recorded.
+"""
+
+# One exposure: the layer number, the planned and actual on-time and the delay from the display update to UV on (ns).
+# The delay is -1 if the layer was not displayed right before (e.g. a duplicate layer).
+ExposureRecord = namedtuple('ExposureRecord', ['layer', 'planned', 'actual', 'flip_delay'])
+
+# One mask flip during a greyscale exposure: the layer, the index of the mask, the lateness of the flip
+# against its deadline and the time the display update took (ns).
+FlipRecord = namedtuple('FlipRecord', ['layer', 'mask', 'lateness', 'duration'])
+
+# Weight of a new measurement in the GPIO latency estimate
+LATENCY_WEIGHT = 0.2
+
+
+class ExposureController:
+    """
+    Class for exposing layers with precise UV on-times.
+    """
+
+    def __init__(self, stopped_event=None):
+        """
+        Initialize the ExposureController instance.
+
+        Parameters:
+            stopped_event (threading.Event, optional): Event ending an exposure early when set.
+        """
+        self.stopped = stopped_event
+        self.__uv_pin = Component.handle('uv_enabled')
+        self.__spin_threshold_ns = int(settings_dict['machine']['timing']['spin_threshold'] * 1e9)
+        self.__latency_off = 0
+        self.records = []
+        self.flips = []
+
+    def reset(self):
+        """
+        Drop the records of the previous job. The latency estimate is kept.
+        """
+        self.records = []
+        self.flips = []
+
+    def expose(self, exposure_time, layer=None, displayed_at=None, sequence=None):
+        """
+        Turn on the UV light source and turn it off when the exposure time has passed or the printer is stopped.
+
+        Parameters:
+            exposure_time (float): The time for UV exposure in seconds.
+            layer (int, optional): The layer number for the record.
+            displayed_at (int, optional): The perf_counter_ns() value at which the layer was displayed.
+            sequence (list, optional): The (start as fraction of the exposure time, flip) of the masks
+                following the displayed one, flip is a function displaying the mask.
+
+        Returns:
+            ExposureRecord: The record of the exposure, None if the printer is stopped.
+        """
+        planned = int(exposure_time * 1e9)
+        if self.stopped is not None and self.stopped.is_set():
+            return None
+        try:
+            self.__uv_pin.set()
+            on = time.perf_counter_ns()
+
+            for mask, (start, flip) in enumerate(sequence or (), 1):
+                deadline = on + int(start * planned)
+                flipped = wait_until(deadline, self.__spin_threshold_ns, self.stopped)
+                if self.stopped is not None and self.stopped.is_set():
+                    break
+                flip()
+                self.flips.append(FlipRecord(layer, mask, flipped - deadline, time.perf_counter_ns() - flipped))
+
+            # the light goes off when the write returns, start it earlier by the write latency
+            wait_until(on + planned - self.__latency_off, self.__spin_threshold_ns, self.stopped)
+        finally:
+            before = time.perf_counter_ns()
+            self.__uv_pin.clear()
+            off = time.perf_counter_ns()
+
+        self.__latency_off += int(LATENCY_WEIGHT * ((off - before) - self.__latency_off))
+        record = ExposureRecord(layer, planned, off - on, on - displayed_at if displayed_at else -1)
+        self.records.append(record)
+        logger.debug(f"Exposed layer {layer} for {record.actual}ns (planned {planned}ns, display to UV on {record.flip_delay}ns)")
+        return record
+
+    def halt(self):
+        """
+        Turn off the UV light source immediately (e.g. from the stop signal).
+        """
+        self.__uv_pin.clear()
+
+    @property
+    def stats(self):
+        """
+        Get the statistics of the recorded exposures.
+
+        Returns:
+            dict: Number of exposures, p50, p99 and max of the absolute on-time error,
+                p50 and max of the delay from the display update to UV on and, for greyscale exposures,
+                the number of mask flips, p50, p99 and max of their lateness and the max of their duration, all in ns.
+        """
+        errors = sorted(abs(record.actual - record.planned) for record in self.records)
+        delays = sorted(record.flip_delay for record in self.records if record.flip_delay >= 0)
+        lateness = sorted(flip.lateness for flip in self.flips)
+        return {
+            'exposures': len(errors),
+            'error_p50': percentile(errors, 0.50),
+            'error_p99': percentile(errors, 0.99),
+            'error_max': errors[-1] if errors else 0,
+            'flip_delay_p50': percentile(delays, 0.50),
+            'flip_delay_max': delays[-1] if delays else 0,
+            'flips': len(lateness),
+            'flip_late_p50': percentile(lateness, 0.50),
+            'flip_late_p99': percentile(lateness, 0.99),
+            'flip_late_max': lateness[-1] if lateness else 0,
+            'flip_time_max': max((flip.duration for flip in self.flips), default=0)
+        }
@@ -0,0 +1,357 @@
+import io
+import mmap
+import struct
+import logging
+
+import numpy as np
+from PIL import Image
+
+from lib.source import LayerSource, LayerSourceError, ZipLayerSource
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides layer sources for the run-length encoded resin formats of ChiTuBox compatible
+slicers (.ctb, .cbddlp, .photon). The layers are decoded straight into grayscale NumPy buffers,
+without a PNG step. Prusa .sl1 files are ZIP files with PNG layers and read by the ZIP source.
+"""
+
+ZIP_MAGIC = b'PK\x03\x04'
+CBDDLP_MAGIC = 0x12FD0019  # .cbddlp and .photon
+CTB_MAGIC = 0x12FD0086
+
+# File header: magic, version, bed size (x, y, z), 2 unknown, total height, layer height, exposure,
+# bottom exposure, light off delay, bottom layers, resolution (x, y), large preview offset, layer table
+# offset, layer count, small preview offset, print time, projection type, print parameters offset and
+# size, anti-aliasing level, light PWM, bottom light PWM, encryption key, slicer info offset and size
+HEADER = struct.Struct('<II3f2I5f12I2H3I')
+
+# Layer table entry: position z, exposure, light off delay, data offset, data size, 4 unknown
+LAYER = struct.Struct('<3f6I')
+
+# Print parameters: bottom lift height, bottom lift speed, lift height, lift speed, retract speed,
+# volume, weight, cost, bottom light off delay, light off delay, bottom layer count (speeds in mm/min)
+PRINT_PARAMETERS = struct.Struct('<10fI')
+
+
+class FormatError(LayerSourceError):
+    """
+    Custom exception for resin file format errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def decode_cbddlp(data):
+    """
+    Decode a 1-bit run-length encoded layer (.cbddlp and .photon).
+    Every byte is one run: bit 7 is the color, bits 0-6 the length.
+
+    Parameters:
+        data (bytes): The encoded layer.
+
+    Returns:
+        numpy.ndarray: The pixels (uint8, one dimension, 0 or 255).
+    """
+    runs = np.frombuffer(data, dtype=np.uint8)
+    values = np.where(runs & 0x80, np.uint8(255), np.uint8(0))
+    return np.repeat(values, runs & 0x7f)
+
+
+def decode_ctb(data):
+    """
+    Decode a 7-bit grayscale run-length encoded layer (.ctb).
+    Bits 0-6 of a code byte are the color, bit 7 marks a run whose length follows in 1 to 4 bytes.
+
+    The codes are parsed without a loop over the bytes. Only bytes with bit 7 set (candidates) can
+    start a run, but such a byte may also be a length byte of the run before. The length of a run is
+    read for every candidate as if it was a code. Candidates which no run of an earlier candidate
+    reaches into are codes, the runs following them are found by pointer doubling from candidate to
+    candidate. Every byte which is not a length byte of a run is a code.
+
+    Parameters:
+        data (bytes): The encoded layer.
+
+    Returns:
+        numpy.ndarray: The pixels (uint8, one dimension).
+
+    Raises:
+        FormatError: If the layer data is truncated or a run length has an invalid prefix.
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    size = raw.size
+    flags = raw >= 0x80
+    candidates = np.flatnonzero(flags)
+    count = candidates.size
+
+    # padded, so the length bytes following the last byte can be read
+    padded = np.zeros(size + 5, dtype=np.uint8)
+    padded[:size] = raw
+    first = padded[candidates + 1]
+    extra = np.select([first & 0x80 == 0, first & 0xC0 == 0x80, first & 0xE0 == 0xC0], [1, 2, 3], 4)
+    ends = candidates + 1 + extra
+
+    # the next candidate after the run of every candidate, the last index (no further candidate) points to itself
+    before = np.concatenate(([0], np.cumsum(flags, dtype=np.int32)))
+    jump = np.append(before[np.minimum(ends, size)], count).astype(np.int32)
+
+    runs = np.zeros(count + 1, dtype=bool)
+    runs[count] = True
+    if count:
+        runs[0] = True
+        runs[1:count] = np.maximum.accumulate(ends)[:-1] <= candidates[1:]
+    while True:
+        # every run found so far reaches the run 2^k runs further
+        reached = jump[np.flatnonzero(runs)]
+        reached = reached[~runs[reached]]
+        if reached.size == 0:
+            break
+        runs[reached] = True
+        jump = jump[jump]
+    runs = np.flatnonzero(runs[:count])
+
+    if runs.size and ends[runs[-1]] > size:
+        raise FormatError(f"Layer data truncated at byte {int(candidates[runs[-1]])} of {size}")
+    invalid = runs[first[runs] >= 0xF0]
+    if invalid.size:
+        raise FormatError(f"Invalid run length prefix at byte {int(candidates[invalid[0]]) + 1}")
+
+    # every byte which is not a length byte of a run is a code
+    starts = candidates[runs]
+    boundaries = np.zeros(size + 1, dtype=np.int8)
+    boundaries[starts + 1] = 1
+    boundaries[ends[runs]] = -1
+    codes = np.flatnonzero(np.cumsum(boundaries[:size]) == 0)
+
+    b0, b1, b2, b3 = (padded[starts + i].astype(np.int64) for i in range(1, 5))
+    extra = extra[runs]
+    lengths = np.ones(size, dtype=np.int64)
+    lengths[starts] = np.select(
+        [extra == 1, extra == 2, extra == 3],
+        [b0, ((b0 & 0x3F) << 8) | b1, ((b0 & 0x1F) << 16) | (b1 << 8) | b2],
+        ((b0 & 0x0F) << 24) | (b1 << 16) | (b2 << 8) | b3
+    )
+    # 7-bit to 8-bit color: 0 stays black, 0x7F becomes 0xFF
+    grey = raw[codes] & 0x7F
+    return np.repeat(np.where(grey > 0, (grey << 1) | 1, 0).astype(np.uint8), lengths[codes])
+
+
+def decrypt_ctb(data, key, index):
+    """
+    Decrypt an encrypted .ctb layer (XOR with a key stream derived from the file key and the layer index).
+
+    Parameters:
+        data (bytes): The encrypted layer.
+        key (int): The encryption key of the file.
+        index (int): The index of the layer.
+
+    Returns:
+        numpy.ndarray: The decrypted layer (uint8).
+    """
+    init = (key * 0x2D83CDAC + 0xD8A83423) & 0xFFFFFFFF
+    start = ((index * 0x1E1530CD + 0xEC3D47CD) * init) & 0xFFFFFFFF
+    words = (len(data) + 3) // 4
+    stream = ((start + np.arange(words, dtype=np.uint64) * init) & 0xFFFFFFFF).astype('<u4')
+    return np.frombuffer(data, dtype=np.uint8) ^ stream.view(np.uint8)[:len(data)]
+
+
+class ChituLayerSource(LayerSource):
+    """
+    Layer source reading the layers of a .ctb, .cbddlp or .photon file.
+    """
+
+    def __init__(self, filepath):
+        """
+        Initialize the ChituLayerSource instance, map the file and read its header and layer table.
+
+        Parameters:
+            filepath (str): The path to the file.
+
+        Raises:
+            FormatError: If the file cannot be read or is not supported.
+        """
+        super().__init__(filepath)
+        self.config = {}
+        self.__file = None
+        self.__map = None
+
+        try:
+            self.__file = open(self.filepath, 'rb')
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.header = HEADER.unpack_from(self.__map, 0)
+            self.read_table()
+        except (OSError, ValueError, struct.error) as e:
+            self.close()
+            raise FormatError(f"Could not read '{self.filepath}'. Reason: {e}")
+
+    def read_table(self):
+        """
+        Read the layer table and the print settings of the file.
+
+        Raises:
+            FormatError: If the format is not supported.
+        """
+        (magic, version, _, _, _, _, _, _, layer_height, exposure, bottom_exposure, light_off, bottom_layers,
+         self.width, self.height, _, table_offset, count, _, _, _, parameters_offset, parameters_size,
+         antialiasing, _, _, self.key, _, _) = self.header
+
+        if magic not in (CBDDLP_MAGIC, CTB_MAGIC):
+            raise FormatError(f"Unknown file format (magic {magic:#x})")
+        self.magic = magic
+        self.antialiasing = max(1, antialiasing) if magic == CBDDLP_MAGIC else 1
+
+        # .cbddlp files store one table per anti-aliasing level, each holding one 1-bit mask per layer
+        self.table = [
+            [LAYER.unpack_from(self.__map, table_offset + (level * count + i) * LAYER.size) for i in range(count)]
+            for level in range(self.antialiasing)
+        ]
+        self.layers = {i + 1: i for i in range(count)}
+
+        header = {
+            'height': layer_height,
+            'exposure': exposure,
+            'bottom_exposure': bottom_exposure,
+            'blackout': light_off,
+            'bottom_layers': int(bottom_layers)
+        }
+        if parameters_offset and parameters_size >= PRINT_PARAMETERS.size:
+            (bottom_lift, bottom_lift_speed, lift, lift_speed, retract_speed, _, _, _,
+             bottom_light_off, _, _) = PRINT_PARAMETERS.unpack_from(self.__map, parameters_offset)
+            header.update({
+                'bottom_lift': bottom_lift,
+                'bottom_lift_speed': bottom_lift_speed / 60,
+                'lift': lift,
+                'lift_speed': lift_speed / 60,
+                'retract_speed': retract_speed / 60,
+                'bottom_blackout': bottom_light_off
+            })
+
+        layers = [{'z': z, 'exposure': exposure, 'blackout': light_off} for z, exposure, light_off, *_ in self.table[0]]
+
+        # the values are stored as float32, round off the conversion error (e.g. 0.05000000074505806)
+        header = {key: value if isinstance(value, int) else round(value, 6) for key, value in header.items()}
+        layers = [{key: round(value, 6) for key, value in layer.items()} for layer in layers]
+        self.config = {'header': header, 'layers': layers}
+        logger.debug(f"Read {count} layers ({self.width}x{self.height}) from '{self.filepath}'")
+
+    def data(self, layer, level=0):
+        """
+        Get the encoded data of a layer.
+
+        Parameters:
+            layer (int): The layer number.
+            level (int, optional): The anti-aliasing level (.cbddlp only).
+
+        Returns:
+            memoryview: The encoded layer (zero-copy view into the file).
+        """
+        if layer not in self.layers:
+            raise FormatError(f"Layer {layer} not found in '{self.filepath}'")
+        _, _, _, offset, size, *_ = self.table[level][self.layers[layer]]
+        return memoryview(self.__map)[offset:offset + size]
+
+    def payload(self, layer):
+        """
+        Get the run-length encoded data of a layer, decrypted and with all anti-aliasing levels.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The encoded layer (bytes, memoryview or NumPy array).
+        """
+        if self.magic == CTB_MAGIC:
+            data = self.data(layer)
+            # the key stream depends on the layer index, equal layers are only equal decrypted
+            return decrypt_ctb(data, self.key, self.layers[layer]) if self.key else data
+        if self.antialiasing == 1:
+            return self.data(layer)
+        levels = [self.data(layer, level) for level in range(self.antialiasing)]
+        return b''.join(struct.pack('<I', len(data)) + bytes(data) for data in levels)
+
+    def frame(self, layer):
+        """
+        Decode a layer into a grayscale buffer at native resolution.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            numpy.ndarray: The layer (uint8, height x width).
+        """
+        pixels = self.width * self.height
+        if self.magic == CTB_MAGIC:
+            data = self.data(layer)
+            if self.key:
+                data = decrypt_ctb(data, self.key, self.layers[layer])
+            decoded = [decode_ctb(data)]
+        else:
+            decoded = [decode_cbddlp(self.data(layer, level)) for level in range(self.antialiasing)]
+
+        frame = np.zeros(pixels, dtype=np.uint16 if len(decoded) > 1 else np.uint8)
+        for level in decoded:
+            if level.size != pixels:
+                logger.warning(f"Layer {layer} decodes to {level.size} instead of {pixels} pixels")
+            size = min(level.size, pixels)
+            frame[:size] += level[:size]
+
+        if len(decoded) > 1:
+            frame = (frame // len(decoded)).astype(np.uint8)
+        return frame.reshape(self.height, self.width)
+
+    def read(self, layer):
+        """
+        Encode a layer as PNG (e.g. for previews).
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The PNG image.
+        """
+        image = io.BytesIO()
+        Image.fromarray(self.frame(layer)).save(image, format='PNG')
+        return image.getvalue()
+
+    def close(self):
+        """
+        Unmap and close the file.
+        """
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # a view of a layer is still in use, the map is released with it
+                pass
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+def open_source(filepath):
+    """
+    Open the layer source matching the format of a job file, detected from its first bytes.
+
+    Parameters:
+        filepath (str): The path to the job file.
+
+    Returns:
+        LayerSource: The layer source.
+
+    Raises:
+        LayerSourceError: If the format is not supported or the file cannot be read.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            magic = f.read(4)
+    except OSError as e:
+        raise LayerSourceError(f"Could not read '{filepath}'. Reason: {e}")
+
+    if magic == ZIP_MAGIC:
+        return ZipLayerSource(filepath)
+    if len(magic) == 4 and struct.unpack('<I', magic)[0] in (CBDDLP_MAGIC, CTB_MAGIC):
+        return ChituLayerSource(filepath)
+    raise FormatError(f"Unsupported file format of '{filepath}'")
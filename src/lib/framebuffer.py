@@ -0,0 +1,301 @@
+import os
+import mmap
+import fcntl
+import struct
+import logging
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from lib.mask import MaskError
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides a mask writing the layers straight into the Linux framebuffer (/dev/fbN).
+The framebuffer is memory-mapped and wrapped in a NumPy view, displaying a prepared layer is a
+single copy into the mapped memory. No pygame or SDL is needed, so the printer can run headless.
+"""
+
+SYSFS_GRAPHICS = "/sys/class/graphics"
+
+# ioctl reading struct fb_var_screeninfo (linux/fb.h), 40 32-bit fields starting with
+# xres, yres, xres_virtual, yres_virtual, xoffset, yoffset and bits_per_pixel
+FBIOGET_VSCREENINFO = 0x4600
+VSCREENINFO = struct.Struct('=40I')
+
+
+def grayscale_lut(bpp):
+    """
+    Build the lookup table converting gray values into the pixel format of the framebuffer.
+
+    Parameters:
+        bpp (int): The bits per pixel of the framebuffer (8, 16, 24 or 32).
+
+    Returns:
+        numpy.ndarray: The table, indexed by gray value (256 entries).
+
+    Raises:
+        MaskError: If the pixel format is not supported.
+    """
+    gray = np.arange(256, dtype=np.uint32)
+    if bpp == 8:
+        return gray.astype(np.uint8)
+    if bpp == 16:  # RGB565
+        return (((gray >> 3) << 11) | ((gray >> 2) << 5) | (gray >> 3)).astype('<u2')
+    if bpp == 24:  # three equal channels, the channel order does not matter for gray
+        return np.repeat(gray.astype(np.uint8)[:, None], 3, axis=1)
+    if bpp == 32:  # XRGB8888 with an opaque alpha channel
+        return (0xFF000000 | (gray << 16) | (gray << 8) | gray).astype('<u4')
+    raise MaskError(f"Unsupported framebuffer format: {bpp} bits per pixel")
+
+
+class Framebuffer:
+    """
+    Class for a memory-mapped framebuffer device (or a regular file standing in for it).
+    """
+
+    def __init__(self, device, width=0, height=0, bpp=0, stride=0):
+        """
+        Initialize the Framebuffer instance and map the device.
+        The geometry is read from the device (or from sysfs) unless given.
+
+        Parameters:
+            device (str): The framebuffer device (e.g. /dev/fb0) or a regular file.
+            width (int, optional): The visible width in pixels.
+            height (int, optional): The visible height in pixels.
+            bpp (int, optional): The bits per pixel.
+            stride (int, optional): The length of a line in bytes.
+
+        Raises:
+            MaskError: If the geometry is unknown or the device cannot be mapped.
+        """
+        self.device = device
+        self.__file = None
+        self.__map = None
+        try:
+            self.__file = open(self.device, 'r+b')
+        except OSError as e:
+            raise MaskError(f"Could not open framebuffer '{self.device}'. Reason: {e}")
+
+        # the visible resolution, the virtual resolution may be larger (e.g. for double buffering)
+        info = self.read_screeninfo()
+        self.width = width or info.get('xres') or self.read_sysfs('virtual_size', 0)
+        self.height = height or info.get('yres') or self.read_sysfs('virtual_size', 1)
+        self.bpp = bpp or info.get('bits_per_pixel') or self.read_sysfs('bits_per_pixel')
+        if not (self.width and self.height and self.bpp):
+            self.close()
+            raise MaskError(f"Unknown geometry of framebuffer '{self.device}'")
+        self.bytes_per_pixel = (self.bpp + 7) // 8
+        self.stride = (
+            stride or self.read_sysfs('stride') or info.get('xres_virtual', 0) * self.bytes_per_pixel
+            or self.width * self.bytes_per_pixel
+        )
+        xoffset, yoffset = info.get('xoffset', 0), info.get('yoffset', 0)
+        self.size = self.stride * (yoffset + self.height)
+
+        try:
+            if os.path.isfile(self.device) and os.path.getsize(self.device) < self.size:
+                self.__file.truncate(self.size)
+            self.__map = mmap.mmap(self.__file.fileno(), self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise MaskError(f"Could not map framebuffer '{self.device}'. Reason: {e}")
+
+        # the visible part of every line, in bytes
+        self.memory = np.ndarray((yoffset + self.height, self.stride), dtype=np.uint8, buffer=self.__map)
+        left = xoffset * self.bytes_per_pixel
+        self.pixels = self.memory[yoffset:, left:left + self.width * self.bytes_per_pixel]
+        logger.info(f"Mapped framebuffer '{self.device}' ({self.width}x{self.height}, {self.bpp} bpp)")
+
+    def read_screeninfo(self):
+        """
+        Read the variable screen information of the framebuffer device (FBIOGET_VSCREENINFO).
+
+        Returns:
+            dict: The resolution, the virtual resolution, the offsets of the visible area and the
+                bits per pixel, empty if the device does not support the ioctl (e.g. a regular file).
+        """
+        try:
+            values = VSCREENINFO.unpack(fcntl.ioctl(self.__file.fileno(), FBIOGET_VSCREENINFO, bytes(VSCREENINFO.size)))
+        except OSError:
+            return {}
+        keys = ('xres', 'yres', 'xres_virtual', 'yres_virtual', 'xoffset', 'yoffset', 'bits_per_pixel')
+        return dict(zip(keys, values))
+
+    def read_sysfs(self, attribute, index=0):
+        """
+        Read a geometry attribute of the framebuffer from sysfs.
+
+        Parameters:
+            attribute (str): The name of the attribute (e.g. bits_per_pixel).
+            index (int, optional): The index of the value for comma separated attributes.
+
+        Returns:
+            int: The value, 0 if it cannot be read.
+        """
+        path = os.path.join(SYSFS_GRAPHICS, os.path.basename(self.device), attribute)
+        try:
+            with open(path, 'r') as f:
+                return int(f.read().strip().split(',')[index])
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def write(self, pixels, rects=None):
+        """
+        Copy converted pixels into the framebuffer.
+
+        Parameters:
+            pixels (numpy.ndarray): The pixels in the framebuffer format (uint8, height x width * bytes per pixel).
+            rects (list, optional): Copy only these regions (x, y, width, height).
+        """
+        if rects is None:
+            self.pixels[...] = pixels
+            return
+        size = self.bytes_per_pixel
+        for x, y, w, h in rects:
+            self.pixels[y:y + h, x * size:(x + w) * size] = pixels[y:y + h, x * size:(x + w) * size]
+
+    def clear(self):
+        """
+        Set all pixels to black.
+        """
+        self.memory.fill(0)
+
+    def close(self):
+        """
+        Unmap and close the framebuffer.
+        """
+        self.memory = None
+        self.pixels = None
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # a view of the framebuffer is still in use, the map is released with it
+                pass
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class FramebufferMask:
+    """
+    Class for managing the mask through the Linux framebuffer.
+    """
+
+    def __init__(self):
+        """
+        Initialize the FramebufferMask instance and map the framebuffer of the configured HDMI port.
+
+        Raises:
+            MaskError: If the framebuffer cannot be mapped.
+        """
+        display = settings_dict['machine']['display']
+        device = display['device'] or f"/dev/fb{settings_dict['machine']['hdmi_port']}"
+
+        self.framebuffer = Framebuffer(device, display['width'], display['height'], display['bpp'])
+        self.screen_size = (self.framebuffer.width, self.framebuffer.height)
+        self.__lut = grayscale_lut(self.framebuffer.bpp)
+        self.__scale = {}
+        self.framebuffer.clear()
+
+    def __del__(self):
+        """
+        Destructor to clean up resources.
+        """
+        self.close()
+
+    def scale(self, frame):
+        """
+        Scale a layer to the screen size (nearest neighbor).
+
+        Parameters:
+            frame (numpy.ndarray): The layer (uint8, height x width).
+
+        Returns:
+            numpy.ndarray: The scaled layer.
+        """
+        width, height = self.screen_size
+        if frame.shape == (height, width):
+            return frame
+
+        # the row and column indices are computed once per source size
+        indices = self.__scale.get(frame.shape)
+        if indices is None:
+            rows = np.arange(height) * frame.shape[0] // height
+            cols = np.arange(width) * frame.shape[1] // width
+            indices = self.__scale[frame.shape] = (rows[:, None], cols[None, :])
+        return frame[indices]
+
+    def prepare(self, image):
+        """
+        Scale an image to the screen and convert it to the pixel format of the framebuffer,
+        so displaying it is a plain copy. Can be called from a background thread.
+
+        Parameters:
+            image (numpy.ndarray, str or file): A grayscale layer buffer, or the file path of the
+                image to be loaded or a file object.
+
+        Returns:
+            numpy.ndarray: The display-ready image (uint8, height x width * bytes per pixel).
+
+        Raises:
+            MaskError: If the image cannot be loaded.
+        """
+        if not isinstance(image, np.ndarray):
+            try:
+                with Image.open(image) as img:
+                    image = np.asarray(img.convert('L'))
+            except (OSError, UnidentifiedImageError) as e:
+                raise MaskError(f"Could not load image. Reason: {e}")
+
+        pixels = self.__lut[self.scale(image)]
+        return pixels.reshape(pixels.shape[0], -1).view(np.uint8)
+
+    @staticmethod
+    def sizeof(pixels):
+        """
+        Get the memory used by a prepared image.
+
+        Parameters:
+            pixels (numpy.ndarray): The prepared image.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return pixels.nbytes
+
+    def display(self, image, rects=None):
+        """
+        Display an image on the screen.
+
+        Parameters:
+            image (numpy.ndarray, str or file): A prepared image, a grayscale layer buffer,
+                or the file path of the image to be displayed or a file object.
+            rects (list, optional): Update only these regions (x, y, width, height) of the screen,
+                the rest of the screen already shows the image.
+
+        Returns:
+            int: The number of pixels written.
+        """
+        if not (isinstance(image, np.ndarray) and image.shape == self.framebuffer.pixels.shape):
+            image = self.prepare(image)
+        self.framebuffer.write(image, rects)
+        if rects is None:
+            return self.framebuffer.width * self.framebuffer.height
+        return sum(w * h for _, _, w, h in rects)
+
+    def close(self):
+        """
+        Blank the screen and unmap the framebuffer.
+        """
+        framebuffer = getattr(self, 'framebuffer', None)
+        if framebuffer is None:
+            return
+        if framebuffer.memory is not None:
+            framebuffer.clear()
+        framebuffer.close()
@@ -0,0 +1,102 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the cross-section statistics of a layer: the lit area, the perimeter and the
+number of islands. Everything is computed on the runs of lit pixels per row with NumPy, the islands
+are found by connecting overlapping runs of consecutive rows (4-connectivity) and propagating the
+smallest run index through the connections.
+"""
+
+# Statistics of a layer in pixels: lit pixels, boundary edges between lit and unlit pixels within a row
+# (vertical edges) and between rows (horizontal edges), the number of islands and the lit pixels of the largest one
+LayerGeometry = namedtuple('LayerGeometry', ['area', 'edges_x', 'edges_y', 'islands', 'largest'])
+
+
+def lit_runs(lit):
+    """
+    Find the runs of lit pixels of every row.
+
+    Parameters:
+        lit (numpy.ndarray): The lit pixels (bool, height x width).
+
+    Returns:
+        tuple: The row, start and end (exclusive) of every run, ordered by row and start.
+    """
+    height, width = lit.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = lit
+    changes = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(changes == 1)
+    _, ends = np.nonzero(changes == -1)
+    return rows, starts, ends
+
+
+def label_runs(rows, starts, ends, width):
+    """
+    Label the runs of lit pixels by island.
+
+    Parameters:
+        rows (numpy.ndarray): The row of every run.
+        starts (numpy.ndarray): The start of every run.
+        ends (numpy.ndarray): The end (exclusive) of every run.
+        width (int): The width of the layer.
+
+    Returns:
+        numpy.ndarray: The label of every run, the index of the first run of its island.
+    """
+    runs = len(rows)
+    if runs == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # runs of the previous row overlapping a run are a contiguous range of the (sorted) runs
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    first = np.searchsorted(end_keys, (rows - 1) * stride + starts, side='right')
+    last = np.searchsorted(start_keys, (rows - 1) * stride + ends, side='left')
+    counts = np.maximum(last - first, 0)
+    below = np.repeat(np.arange(runs), counts)
+    above = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    # every run takes the smallest label of its connections until nothing changes
+    labels = np.arange(runs)
+    while True:
+        smallest = np.minimum(labels[below], labels[above])
+        updated = labels.copy()
+        np.minimum.at(updated, below, smallest)
+        np.minimum.at(updated, above, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return labels
+
+
+def layer_geometry(frame):
+    """
+    Compute the cross-section statistics of a layer. Every pixel with a gray value above 0 is lit.
+
+    Parameters:
+        frame (numpy.ndarray): The layer (uint8, height x width).
+
+    Returns:
+        LayerGeometry: The statistics in pixels.
+    """
+    lit = frame > 0
+    rows, starts, ends = lit_runs(lit)
+    labels = label_runs(rows, starts, ends, lit.shape[1])
+    sizes = np.bincount(labels, weights=ends - starts) if len(labels) else np.zeros(0)
+    edges_y = int(np.count_nonzero(lit[1:] != lit[:-1]) + np.count_nonzero(lit[0]) + np.count_nonzero(lit[-1]))
+    return LayerGeometry(
+        area=int(np.count_nonzero(lit)),
+        edges_x=2 * len(rows),
+        edges_y=edges_y,
+        islands=int(np.count_nonzero(labels == np.arange(len(labels)))),
+        largest=int(sizes.max()) if sizes.size else 0
+    )
@@ -0,0 +1,134 @@
+import os
+import mmap
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides direct access to the GPIO registers of the BCM283x/BCM2711 through /dev/gpiomem.
+A pin handle precomputes the register offsets and the bit mask of its pin, so setting, clearing or
+reading a pin is a single write or read of the memory-mapped register block.
+"""
+
+GPIO_BLOCK_SIZE = 4096
+
+# Register offsets in bytes, the second bank holds the pins 32-53
+GPSET0 = 0x1C
+GPCLR0 = 0x28
+GPLEV0 = 0x34
+
+GPIO_PINS = 54
+
+
+class GpioMemoryError(Exception):
+    """
+    Custom exception for GPIO register access errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class GpioMemory:
+    """
+    Class for the memory-mapped GPIO register block (or a regular file standing in for it).
+    """
+
+    def __init__(self, device="/dev/gpiomem"):
+        """
+        Initialize the GpioMemory instance and map the register block.
+
+        Parameters:
+            device (str, optional): The GPIO memory device or a regular file (extended to the block size).
+
+        Raises:
+            GpioMemoryError: If the device cannot be mapped.
+        """
+        self.device = device
+        self.__file = None
+        self.__map = None
+        try:
+            self.__file = open(self.device, 'r+b')
+            if os.path.isfile(self.device) and os.path.getsize(self.device) < GPIO_BLOCK_SIZE:
+                self.__file.truncate(GPIO_BLOCK_SIZE)
+            self.__map = mmap.mmap(self.__file.fileno(), GPIO_BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except (OSError, ValueError) as e:
+            self.close()
+            raise GpioMemoryError(f"Could not map GPIO registers '{self.device}'. Reason: {e}")
+
+        # the registers as 32 bit words
+        self.registers = memoryview(self.__map).cast('I')
+        logger.info(f"Mapped GPIO registers '{self.device}'")
+
+    def pin(self, pin):
+        """
+        Create a handle for a pin.
+
+        Parameters:
+            pin (int): The BCM pin number.
+
+        Returns:
+            PinHandle: The handle.
+        """
+        if not 0 <= pin < GPIO_PINS:
+            raise GpioMemoryError(f"Invalid GPIO pin {pin}")
+        return PinHandle(self.registers, pin)
+
+    def close(self):
+        """
+        Unmap and close the register block.
+        """
+        if getattr(self, 'registers', None) is not None:
+            self.registers.release()
+            self.registers = None
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+class PinHandle:
+    """
+    Handle of a single pin writing the GPSET/GPCLR registers and reading the GPLEV register directly.
+    """
+    __slots__ = ('pin', '__registers', '__set', '__clear', '__level', '__mask')
+
+    def __init__(self, registers, pin):
+        """
+        Initialize the PinHandle instance.
+
+        Parameters:
+            registers (memoryview): The register block as 32 bit words.
+            pin (int): The BCM pin number.
+        """
+        bank, bit = divmod(pin, 32)
+        self.pin = pin
+        self.__registers = registers
+        self.__set = GPSET0 // 4 + bank
+        self.__clear = GPCLR0 // 4 + bank
+        self.__level = GPLEV0 // 4 + bank
+        self.__mask = 1 << bit
+
+    def set(self):
+        """
+        Set the pin high.
+        """
+        self.__registers[self.__set] = self.__mask
+
+    def clear(self):
+        """
+        Set the pin low.
+        """
+        self.__registers[self.__clear] = self.__mask
+
+    def level(self):
+        """
+        Read the level of the pin.
+
+        Returns:
+            bool: True if the pin is high.
+        """
+        return bool(self.__registers[self.__level] & self.__mask)
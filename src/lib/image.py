@@ -1,3 +1,4 @@
+import struct
 import logging
 from PIL import Image, UnidentifiedImageError, ImageOps
 from settings import settings_dict
@@ -10,6 +11,44 @@ This module provides a class for image processing tasks.
 It uses the PIL library for image operations and settings_dict for machine-specific settings.
 """
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# IHDR chunk: length, type, width, height, bit depth, color type, compression, filter, interlace
+PNG_IHDR = struct.Struct('>I4sIIBBBBB')
+PNG_HEADER_SIZE = len(PNG_SIGNATURE) + PNG_IHDR.size
+
+# Allowed bit depths per PNG color type (grayscale, RGB, palette, grayscale+alpha, RGBA), 16 bit is not supported
+PNG_BIT_DEPTHS = {
+    0: (1, 2, 4, 8),
+    2: (8,),
+    3: (1, 2, 4, 8),
+    4: (8,),
+    6: (8,)
+}
+
+
+def read_png_header(data):
+    """
+    Read the image properties from the IHDR chunk of a PNG, without decoding any pixels.
+
+    Parameters:
+        data (bytes): At least the first PNG_HEADER_SIZE bytes of the PNG.
+
+    Returns:
+        tuple: (width, height, bit depth, color type).
+
+    Raises:
+        ImageProcessorError: If the data is not a PNG.
+    """
+    if len(data) < PNG_HEADER_SIZE or bytes(data[:len(PNG_SIGNATURE)]) != PNG_SIGNATURE:
+        raise ImageProcessorError("Not a PNG image.")
+    length, chunk_type, width, height, bit_depth, color_type, _, _, _ = PNG_IHDR.unpack_from(data, len(PNG_SIGNATURE))
+    if chunk_type != b'IHDR' or length != 13:
+        raise ImageProcessorError("PNG image does not start with an IHDR chunk.")
+    if width == 0 or height == 0:
+        raise ImageProcessorError(f"PNG image has an invalid size of {width}x{height} pixels.")
+    return width, height, bit_depth, color_type
+
 
 class ImageProcessorError(Exception):
     """
@@ -40,7 +79,7 @@ class ImageProcessor:
         Initialize the ImageProcessor instance with machine resolution and aspect ratio.
 
         Parameters:
-            file_path (str, optional): The path to the image file.
+            file_path (str or file, optional): The path to the image file or a file object.
         """
         self.__machine_resolution_x = settings_dict['machine']['resolution']['x']
         self.__machine_resolution_y = settings_dict['machine']['resolution']['y']
@@ -51,12 +90,49 @@ class ImageProcessor:
             self.open()
             self.extract_properties()
 
+    def read_header(self, data):
+        """
+        Extract the image properties from the PNG header only (the image is not opened).
+
+        Parameters:
+            data (bytes): At least the first PNG_HEADER_SIZE bytes of the PNG.
+
+        Raises:
+            ImageProcessorError: If the data is not a PNG, its size is zero or the color type or bit depth is not supported.
+        """
+        width, height, bit_depth, color_type = read_png_header(data)
+        if color_type not in PNG_BIT_DEPTHS:
+            raise ImageProcessorError(f"Unsupported PNG color type {color_type}.")
+        if bit_depth not in PNG_BIT_DEPTHS[color_type]:
+            raise ImageProcessorError(f"Unsupported PNG bit depth {bit_depth} for color type {color_type}.")
+
+        self.resolution_x = width
+        self.resolution_y = height
+        self.aspect_ratio = self.resolution_x / self.resolution_y
+
+    def set_resolution(self, width, height):
+        """
+        Set the image properties from a resolution known without decoding (e.g. a file header).
+
+        Parameters:
+            width (int): The width in pixels.
+            height (int): The height in pixels.
+
+        Raises:
+            ImageProcessorError: If the width or height is zero.
+        """
+        if not width or not height:
+            raise ImageProcessorError(f"Invalid image size of {width}x{height} pixels.")
+        self.resolution_x = width
+        self.resolution_y = height
+        self.aspect_ratio = self.resolution_x / self.resolution_y
+
     def open(self, file_path=None):
         """
         Open the image and load it into memory.
 
         Parameters:
-            file_path (str, optional): The path to the image file.
+            file_path (str or file, optional): The path to the image file or a file object.
 
         Raises:
             ImageProcessorError: If the image cannot be opened.
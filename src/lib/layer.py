@@ -1,9 +1,13 @@
 import time
 import logging
+import threading
 
 from lib.stepper import StepperDriver, StepperDriverError
-from lib.mask import Mask, MaskError
-
+from lib.motion import MotionQueue
+from lib.exposure import ExposureController
+from lib.mask import create_mask, changed_rects, scale_rects, threshold_masks, MaskError, PreparedLayer
+from lib.prefetch import LayerPrefetcher
+from lib.ring import FrameDecoder
 from settings import settings_dict
 
 # Configure logging
@@ -25,11 +29,32 @@ class LayerManager:
         Initialize the LayerManager instance with default values.
         """
         self.model = None
-        self.mask = Mask()
+        self.mask = create_mask()
+        self.stopped = stopped_event
         self.stepper = StepperDriver(stopped_event)
+        self.motion = MotionQueue(self.stepper)
+        self.exposure = ExposureController(stopped_event)
+
+        # turn off the UV light and the motor right away in the thread stopping the printer
+        self.stopped.on_set(self.exposure.halt)
+        self.stopped.on_set(self.stepper.disable)
+        self.prefetcher = LayerPrefetcher(self.prepare, self.sizeof)
+        self.decoder = None
+        self.__decoders = settings_dict['system']['prefetch']['decoders']
         self.__layer_current = None
         self.__layer_total = None
 
+        self.__tile = settings_dict['machine']['display']['tile']
+        self.__full_refresh = settings_dict['machine']['display']['full_refresh']
+        self.__greyscale_levels = settings_dict['print']['greyscale']['levels']
+        self.__previous = {}
+        self.__last_frame = (None, None, None)
+        self.__prepare_lock = threading.Lock()
+        self.__displayed = None
+        self.__display_time = 0.0
+        self.display_stats = {'layers': 0, 'partial': 0, 'pixels': 0}
+        self.skip_stats = {'empty': 0, 'duplicate': 0, 'saved': 0.0}
+
     def load(self, model):
         """
         Load a model for printing and reset the current layer index.
@@ -37,66 +62,253 @@ class LayerManager:
         Parameters:
             model (object): The 3D model to be printed.
         """
+        # a previous model which was not unloaded (e.g. after an error) still holds its workers
+        self.__release()
         self.model = model
-        self.__layer_current = list(self.model.images.keys())[0]
-        self.__layer_total = len(self.model.images)
-        self.stepper.goto(0)
+        self.__layer_current = 0
+        self.__layer_total = len(self.model.plan)
+
+        # empty and duplicate layers are never decoded, the screen keeps the last displayed layer
+        layers = [
+            layer for layer in self.model.plan.layers.tolist()
+            if not (self.model.images[layer].get('empty') or self.model.images[layer].get('duplicate'))
+        ]
+        self.__previous = dict(zip(layers[1:], layers[:-1]))
+        self.__last_frame = (None, None, None)
+        self.__displayed = None
+        self.__display_time = 0.0
+        self.display_stats = {'layers': 0, 'partial': 0, 'pixels': 0}
+        self.skip_stats = {'empty': 0, 'duplicate': 0, 'saved': 0.0}
+        self.exposure.reset()
+
+        # decoder processes fill a ring of frames in shared memory ahead of the prefetcher
+        if self.__decoders and layers:
+            frame_size = max(
+                info['info']['resolution_x'] * info['info']['resolution_y'] for info in self.model.images.values()
+            )
+            self.decoder = FrameDecoder(self.model.source, frame_size)
+            self.decoder.start(layers)
+        self.prefetcher.start(layers)
+        self.motion.goto(0)
+        self.motion.flush()
 
     def next(self):
         """
-        Move to the next layer if available.
+        Move to the next layer if available and the printer is not stopped.
         """
-        if self.__layer_current < self.__layer_total:
-            self.layer(self.__layer_current)
+        if self.__layer_current < self.__layer_total and not self.stopped.is_set():
+            self.layer(self.model.plan[self.__layer_current])
             self.__layer_current += 1
 
-    def layer(self, layer):
+    def layer(self, step):
         """
-        Process a specific layer based on its index.
+        Process a layer of the print plan.
 
         Parameters:
-            layer (int): The index of the layer to be processed.
+            step (LayerStep): The row of the print plan.
         """
-        logger.info(f"Processing layer: {layer}")
-
-        if self.__layer_current <= settings_dict['print']['layer']['bottom']['layers']:
-            self.process(
-                self.model.images[layer]['filepath'],
-                settings_dict['print']['layer']['bottom']['height'],
-                settings_dict['print']['layer']['bottom']['exposure'],
-                settings_dict['print']['layer']['bottom']['blackout'],
-                settings_dict['print']['resin']['settling']
-            )
+        logger.info(f"Processing layer: {step.layer}")
+        info = self.model.images.get(step.layer, {})
+        if info.get('empty'):
+            self.skip(step)
+        elif info.get('duplicate') and self.__displayed is not None and self.model.images[self.__displayed]['hash'] == info['hash']:
+            # the screen already shows this layer
+            self.skip_stats['duplicate'] += 1
+            self.skip_stats['saved'] += self.__display_time / max(1, self.display_stats['layers'])
+            self.process(None, step)
+        elif info.get('duplicate'):
+            # the screen shows another layer (e.g. the last mask of a greyscale sequence), duplicates
+            # are not prefetched and not part of the frame chain, so the layer is prepared here
+            self.process(self.prepare_detached(step.layer), step)
         else:
-            self.process(
-                self.model.images[layer]['filepath'],
-                settings_dict['print']['layer']['default']['height'],
-                settings_dict['print']['layer']['default']['exposure'],
-                settings_dict['print']['layer']['default']['blackout'],
-                settings_dict['print']['resin']['settling']
-            )
+            self.process(self.prefetcher.get(step.layer), step)
+
+    def prepare(self, layer):
+        """
+        Decode a layer, prepare it for the display and find the regions changed since the previous
+        layer of the plan. With greyscale exposure, an anti-aliased layer is prepared as a sequence
+        of threshold masks instead. Called by the prefetcher, mostly in layer order.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            PreparedLayer: The prepared layer.
+        """
+        # the prefetch thread and the print thread (on a miss) share the last frame and its slot
+        with self.__prepare_lock:
+            if self.decoder is not None:
+                slot, frame = self.decoder.frame(layer)
+            else:
+                slot, frame = None, self.model.source.frame(layer)
+            base = self.__previous.get(layer)
+
+            # the regions can only be computed if the previous layer was the last one decoded
+            rects = None
+            last_layer, last_frame, last_slot = self.__last_frame
+            if base is not None and last_layer == base:
+                rects = changed_rects(last_frame, frame, self.__tile)
+                if rects is not None:
+                    height, width = frame.shape
+                    if sum(w * h for _, _, w, h in rects) > self.__full_refresh * width * height:
+                        rects = None
+                    else:
+                        rects = scale_rects(rects, (width, height), self.mask.screen_size)
+            prepared = self.__build(layer, frame, base, rects)
+
+            # the frame of the previous layer is not compared anymore, its slot can be decoded into again
+            self.__last_frame = (layer, frame, slot)
+            if self.decoder is not None:
+                self.decoder.release(last_slot)
+        return prepared
+
+    def prepare_detached(self, layer):
+        """
+        Decode and prepare a layer outside of the prefetched frame chain, for a full refresh.
+        The ring and the frame compared by the next prepared layer are left untouched.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            PreparedLayer: The prepared layer.
+        """
+        with self.__prepare_lock:
+            return self.__build(layer, self.model.source.frame(layer), None, None)
+
+    def __build(self, layer, frame, base, rects):
+        """
+        Convert a frame to the display format, or to a sequence of threshold masks with greyscale exposure.
+
+        Parameters:
+            layer (int): The layer number.
+            frame (numpy.ndarray): The decoded frame.
+            base (int): The layer the changed regions are relative to.
+            rects (list): The changed regions in screen coordinates, None for a full refresh.
+
+        Returns:
+            PreparedLayer: The prepared layer.
+        """
+        masks = threshold_masks(frame, self.__greyscale_levels) if self.__greyscale_levels > 1 else None
+        if masks and len(masks) > 1:
+            # the screen shows the last mask after the exposure, the masks are always displayed in full
+            sequence, start = [], masks[0][1]
+            for mask, share in masks[1:]:
+                sequence.append((start, self.mask.prepare(mask)))
+                start += share
+            return PreparedLayer(layer, self.mask.prepare(masks[0][0]), None, None, sequence)
+        return PreparedLayer(layer, self.mask.prepare(frame), base, rects)
 
-    def process(self, image, layer_height, exposure_time, blackout_time, settling):
+    def sizeof(self, prepared):
         """
-        Process a layer with the given parameters.
+        Get the memory used by a prepared layer, including the masks of a greyscale sequence.
 
         Parameters:
-            image (str): The file path of the image to be displayed.
-            layer_height (float): The height of the layer.
-            exposure_time (float): The time for UV exposure.
-            blackout_time (float): The blackout time between layers.
-            settling (float): The time for the resin to settle.
-        """
-        self.stepper.up(layer_height)
-        time.sleep(settling)
-        self.mask.display(image)
-        self.mask.expose(exposure_time)
-        time.sleep(blackout_time)
+            prepared (PreparedLayer): The prepared layer.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return self.mask.sizeof(prepared.image) + sum(self.mask.sizeof(image) for _, image in prepared.sequence or ())
+
+    def display(self, prepared):
+        """
+        Display a prepared layer, updating only the changed regions if the screen shows the previous layer.
+
+        Parameters:
+            prepared (PreparedLayer): The prepared layer.
+
+        Returns:
+            int: The perf_counter_ns() value at which the display was updated.
+        """
+        start = time.perf_counter()
+        partial = prepared.rects is not None and self.__displayed is not None and prepared.base == self.__displayed
+        pixels = self.mask.display(prepared.image, prepared.rects if partial else None)
+        displayed_at = time.perf_counter_ns()
+        self.__displayed = prepared.layer
+        self.__display_time += time.perf_counter() - start
+
+        self.display_stats['layers'] += 1
+        self.display_stats['partial'] += int(partial)
+        self.display_stats['pixels'] += pixels
+        logger.debug(f"Displayed layer {prepared.layer}: {pixels} pixels written ({'partial' if partial else 'full'} refresh)")
+        return displayed_at
+
+    def move(self, step):
+        """
+        Lift and retract to the position of a layer.
+
+        Parameters:
+            step (LayerStep): The row of the print plan.
+        """
+        self.motion.goto(self.stepper.planner.steps(step.z + step.lift), step.lift_speed)
+        self.motion.goto(self.stepper.planner.steps(step.z), step.retract_speed)
+        self.motion.flush()
+
+    def skip(self, step):
+        """
+        Process an empty layer: only move to its position, nothing is displayed or exposed.
+
+        Parameters:
+            step (LayerStep): The row of the print plan.
+        """
+        self.move(step)
+        self.skip_stats['empty'] += 1
+        self.skip_stats['saved'] += step.settling + step.exposure + step.blackout
+
+    def process(self, prepared, step):
+        """
+        Process a layer with the given parameters: lift and retract to the layer position,
+        let the resin settle, expose the layer and wait for the blackout time.
+        All waits end early if the printer is stopped.
+
+        Parameters:
+            prepared (PreparedLayer): The prepared layer to be displayed, None if the screen already shows it.
+            step (LayerStep): The row of the print plan (positions in mm, times in seconds, speeds in mm/s).
+        """
+        self.move(step)
+        if self.stopped.wait(step.settling):
+            return
+        displayed_at = self.display(prepared) if prepared is not None else None
+        sequence = None
+        if prepared is not None and prepared.sequence:
+            sequence = [(start, lambda image=image: self.mask.display(image)) for start, image in prepared.sequence]
+        self.exposure.expose(step.exposure, step.layer, displayed_at, sequence)
+        if sequence:
+            # the screen shows the last mask, not the layer
+            self.__displayed = None
+        self.stopped.wait(step.blackout)
+
+    def unload(self):
+        """
+        Stop prefetching and log the prefetch and display statistics of the model.
+        """
+        logger.info(f"Layer prefetch statistics: {self.prefetcher.stats}")
+        if self.decoder is not None:
+            logger.info(f"Layer decoder statistics: {self.decoder.stats}")
+        logger.info(f"Layer display statistics: {self.display_stats}")
+        logger.info(f"Layer exposure statistics: {self.exposure.stats}")
+        logger.info(f"Motion queue statistics: {self.motion.stats}")
+        logger.info(
+            f"Skipped {self.skip_stats['empty']} empty and {self.skip_stats['duplicate']} duplicate layers, "
+            f"saved {self.skip_stats['saved']:.1f}s"
+        )
+        self.__release()
+
+    def __release(self):
+        """
+        Stop the prefetch thread and the decoder processes and remove the frame ring.
+        """
+        self.prefetcher.stop()
+        self.__last_frame = (None, None, None)
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
 
     @property
     def current_layer(self):
         """
-        Get the current layer index.
+        Get the index of the current layer in the print plan.
 
         Returns:
             int: The current layer index.
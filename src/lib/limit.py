@@ -1,3 +1,4 @@
+import time
 import logging
 import RPi.GPIO as GPIO
 
@@ -14,14 +15,73 @@ logger = logging.getLogger(__name__)
 """
 This module provides a class for managing a limit switch in a 3D printing system.
 It uses the RPi.GPIO library for GPIO operations and custom classes for job and component management.
+The state of the switch is latched by the edge interrupt, so the step loop reads a plain attribute
+instead of the GPIO level.
 """
 
 
+class LimitLatch:
+    """
+    Latched state of the limit switch. Set by the edge interrupt (or a GPIO read) and only cleared by the
+    homing, once the switch is released again or the zero position is set.
+    Reading and writing the flag is a plain attribute access, no lock is needed.
+
+    The switch pulls its input low against the pull-up when pressed, the interrupt fires on the falling edge.
+    """
+
+    def __init__(self):
+        """
+        Initialize the LimitLatch instance (not triggered).
+        """
+        self.triggered = False
+        self.triggered_at = None  # perf_counter_ns() of the last trigger
+        self.__pin = None
+
+    def read(self):
+        """
+        Read the current level of the limit switch (one GPIO read).
+
+        Returns:
+            bool: True if the switch is pressed (input low), False if released or not configured.
+        """
+        if self.__pin is None:
+            self.__pin = Component.handle('limit_switch') if gpio_dict['limit_switch'] else False
+        return self.__pin is not False and not self.__pin.level()
+
+    def trip(self):
+        """
+        Latch the triggered state.
+        """
+        self.triggered_at = time.perf_counter_ns()
+        self.triggered = True
+
+    def clear(self):
+        """
+        Reset the latched state.
+        """
+        self.triggered = False
+
+    def refresh(self):
+        """
+        Latch the triggered state if the switch is pressed right now (one GPIO read).
+        A released switch never resets the latch, so a trip of the interrupt is not lost.
+
+        Returns:
+            bool: True if the latch is triggered.
+        """
+        if self.read():
+            self.trip()
+        return self.triggered
+
+
+# Latched state of the z-axis limit switch, shared by the interrupt callback and the stepper driver
+limit_latch = LimitLatch()
+
+
 class LimitSwitch:
     """
     Class for observing the limit switch.
     """
-    triggered = False
     limit_pin = False
     motor_pin = False
 
@@ -58,6 +118,8 @@ class LimitSwitch:
         Parameters:
             channel (int): The GPIO channel that triggered the event.
         """
-        logger.error(f"Limit switch triggered! Disabling motor (channel {channel}.")
+        limit_latch.trip()
+        logger.error(f"Limit switch triggered! Disabling motor and UV light (channel {channel}).")
         Component.on('motor_disabled')
-        self.stopped.set()
+        Component.off('uv_enabled')
+        self.stopped.set('limit_switch')
@@ -1,8 +1,13 @@
-import time
-import pygame
 import logging
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import pygame
+except ImportError:  # headless installations use the framebuffer mask
+    pygame = None
 
-from lib.component import Component
 from settings import settings_dict
 from utils.raspi import is_raspberrypi
 
@@ -11,9 +16,17 @@ logger = logging.getLogger(__name__)
 
 """
 This module provides a class for managing the mask in a 3D printing system.
-It uses the pygame library for image operations and custom Component class for hardware control.
+It uses the pygame library for image operations, the UV light is controlled by lib.exposure.
+The framebuffer mask (lib.framebuffer) is an alternative without pygame, see create_mask.
 """
 
+GRAYSCALE_PALETTE = [(i, i, i) for i in range(256)]
+
+# A prepared layer: the display-ready image and the screen regions (x, y, width, height) changed
+# since the base layer, or None if the whole screen has to be refreshed. For greyscale exposure, the
+# sequence holds the (start as fraction of the exposure time, display-ready image) of the following masks.
+PreparedLayer = namedtuple('PreparedLayer', ['layer', 'image', 'base', 'rects', 'sequence'], defaults=(None,))
+
 
 class MaskError(Exception):
     """
@@ -24,6 +37,111 @@ class MaskError(Exception):
         super().__init__(message)
 
 
+def changed_rects(previous, current, tile):
+    """
+    Get the regions which differ between two layers, as rectangles aligned to a grid of tiles.
+    Changed tiles are merged into horizontal runs, runs spanning the same columns in consecutive
+    tile rows into one rectangle.
+
+    Parameters:
+        previous (numpy.ndarray): The previous layer (height x width).
+        current (numpy.ndarray): The current layer (height x width).
+        tile (int): The size of a tile in pixels.
+
+    Returns:
+        list: The changed rectangles (x, y, width, height), None if the layers have different sizes.
+    """
+    if previous.shape != current.shape:
+        return None
+
+    height, width = current.shape
+    changed = previous != current
+    tiles = np.logical_or.reduceat(changed, np.arange(0, height, tile), axis=0)
+    tiles = np.logical_or.reduceat(tiles, np.arange(0, width, tile), axis=1)
+
+    def rect(span, first, last):
+        x0, x1 = span[0] * tile, min(span[1] * tile, width)
+        y0, y1 = first * tile, min(last * tile, height)
+        return x0, y0, x1 - x0, y1 - y0
+
+    rects = []
+    spans_open = {}
+    for row in range(tiles.shape[0]):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], tiles[row].view(np.int8), [0]))))
+        spans = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        for span in [span for span in spans_open if span not in spans]:
+            rects.append(rect(span, spans_open.pop(span), row))
+        for span in spans:
+            spans_open.setdefault(span, row)
+    rects.extend(rect(span, first, tiles.shape[0]) for span, first in spans_open.items())
+    return rects
+
+
+def threshold_masks(frame, levels):
+    """
+    Split a greyscale layer into threshold masks shown one after the other during the exposure, so every
+    pixel is lit for its grey value as share of the exposure time (rounded to 1/levels).
+    Consecutive thresholds without a grey value between them give the same mask and are merged.
+
+    Parameters:
+        frame (numpy.ndarray): The layer (uint8, height x width).
+        levels (int): The number of thresholds.
+
+    Returns:
+        list: The (mask, share of the exposure time) in display order, None if the layer has no grey values.
+    """
+    histogram = np.bincount(frame.ravel(), minlength=256)
+    if not histogram[1:255].any():
+        return None
+
+    # a pixel is lit by the masks of all thresholds up to its grey value
+    thresholds = np.ceil((np.arange(levels) + 0.5) * 255 / levels).astype(np.int64)
+    masks = []
+    for k, threshold in enumerate(thresholds.tolist()):
+        if masks and not histogram[thresholds[k - 1]:threshold].any():
+            mask, share = masks[-1]
+            masks[-1] = (mask, share + 1 / levels)
+        else:
+            masks.append((np.where(frame >= threshold, 255, 0).astype(np.uint8), 1 / levels))
+    return masks
+
+
+def scale_rects(rects, size, screen_size):
+    """
+    Scale rectangles from the layer resolution to the screen, rounding outwards.
+
+    Parameters:
+        rects (list): The rectangles (x, y, width, height) at layer resolution.
+        size (tuple): The width and height of the layer.
+        screen_size (tuple): The width and height of the screen.
+
+    Returns:
+        list: The rectangles on the screen.
+    """
+    if tuple(size) == tuple(screen_size):
+        return rects
+    (width, height), (screen_width, screen_height) = size, screen_size
+    scaled = []
+    for x, y, w, h in rects:
+        x0, y0 = x * screen_width // width, y * screen_height // height
+        x1, y1 = -(-(x + w) * screen_width // width), -(-(y + h) * screen_height // height)
+        scaled.append((x0, y0, x1 - x0, y1 - y0))
+    return scaled
+
+
+def create_mask():
+    """
+    Create the mask of the configured display backend.
+
+    Returns:
+        Mask or FramebufferMask: The mask.
+    """
+    if settings_dict['machine']['display']['backend'] == 'framebuffer':
+        from lib.framebuffer import FramebufferMask
+        return FramebufferMask()
+    return Mask()
+
+
 class Mask:
     """
     Class for managing the mask in a 3D printing system.
@@ -33,9 +151,12 @@ class Mask:
         """
         Initialize the Mask instance with default values.
         """
+        if pygame is None:
+            raise MaskError("pygame is not installed, use the framebuffer display backend")
         self.__hdmi_port = settings_dict['machine']['hdmi_port']
         pygame.init()
         self.screen = None
+        self.screen_size = (settings_dict['machine']['resolution']['x'], settings_dict['machine']['resolution']['y'])
 
         if not is_raspberrypi():
             logger.error("Not running on a raspberry Pi. Stopping init of Print-Loop...")
@@ -46,13 +167,15 @@ class Mask:
         """
         Destructor to clean up resources.
         """
-        pygame.quit()
+        if pygame is not None:
+            pygame.quit()
 
     def setup_screen(self):
         """
         Set up the screen with specified display mode (full-screen).
         """
         self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN, display=self.__hdmi_port)
+        self.screen_size = self.get_screen_dimensions()
 
     def get_screen_dimensions(self):
         """
@@ -69,7 +192,7 @@ class Mask:
         Load an image and scale it to the specified dimensions.
 
         Parameters:
-            image_path (str): The file path of the image to be loaded.
+            image_path (str or file): The file path of the image to be loaded or a file object.
             width (int): The width to scale the image to.
             height (int): The height to scale the image to.
 
@@ -79,25 +202,80 @@ class Mask:
         image = pygame.image.load(image_path)
         return pygame.transform.scale(image, (width, height))
 
-    def display(self, image_path):
+    def load_frame(self, frame, width, height):
         """
-        Display an image on the screen.
+        Wrap a grayscale layer buffer into a surface and scale it to the specified dimensions.
 
         Parameters:
-            image_path (str): The file path of the image to be displayed.
+            frame (numpy.ndarray): The layer (uint8, height x width).
+            width (int): The width to scale the image to.
+            height (int): The height to scale the image to.
+
+        Returns:
+            pygame.Surface: The scaled image.
         """
-        width, height = self.get_screen_dimensions()
-        scaled_image = self.load_image(image_path, width, height)
-        self.screen.blit(scaled_image, (0, 0))
-        pygame.display.flip()
+        frame = np.ascontiguousarray(frame)
+        image = pygame.image.frombuffer(frame, (frame.shape[1], frame.shape[0]), 'P')
+        image.set_palette(GRAYSCALE_PALETTE)
+        if image.get_size() == (width, height):
+            return image
+        return pygame.transform.scale(image, (width, height))
 
-    def expose(self, exposure_time):
+    def prepare(self, image):
         """
-        Turn on the UV light source, wait for the exposure time, and turn it off.
+        Load an image, scale it to the screen and convert it to the pixel format of the screen,
+        so displaying it is a plain blit. Can be called from a background thread.
 
         Parameters:
-            exposure_time (float): The time for UV exposure in seconds.
+            image (numpy.ndarray, str or file): A grayscale layer buffer, or the file path of the
+                image to be loaded or a file object.
+
+        Returns:
+            pygame.Surface: The display-ready image.
+        """
+        width, height = self.screen_size
+        if isinstance(image, np.ndarray):
+            surface = self.load_frame(image, width, height)
+        else:
+            surface = self.load_image(image, width, height)
+        if self.screen is not None:
+            surface = surface.convert(self.screen)
+        return surface
+
+    @staticmethod
+    def sizeof(surface):
         """
-        Component.on('uv_enabled')
-        time.sleep(exposure_time)
-        Component.off('uv_enabled')
+        Get the memory used by a prepared image.
+
+        Parameters:
+            surface (pygame.Surface): The prepared image.
+
+        Returns:
+            int: The size in bytes.
+        """
+        return surface.get_pitch() * surface.get_height()
+
+    def display(self, image, rects=None):
+        """
+        Display an image on the screen.
+
+        Parameters:
+            image (pygame.Surface, numpy.ndarray, str or file): A prepared image, a grayscale layer
+                buffer, or the file path of the image to be displayed or a file object.
+            rects (list, optional): Update only these regions (x, y, width, height) of the screen,
+                the rest of the screen already shows the image.
+
+        Returns:
+            int: The number of pixels written.
+        """
+        if not isinstance(image, pygame.Surface):
+            image = self.prepare(image)
+        if rects is None:
+            self.screen.blit(image, (0, 0))
+            pygame.display.flip()
+            return image.get_width() * image.get_height()
+
+        for rect in rects:
+            self.screen.blit(image, rect[:2], rect)
+        pygame.display.update(rects)
+        return sum(w * h for _, _, w, h in rects)
@@ -1,8 +1,19 @@
-import logging
 import os
+import hashlib
+import logging
+import threading
+import concurrent.futures
+
+import numpy as np
 
+from lib.container import ContainerLayerSource, ContainerError, compile_container, CONTAINER_EXTENSION
 from lib.unpack import Unpacker, UnpackerError
-from lib.image import ImageProcessor, ImageProcessorError
+from lib.geometry import layer_geometry
+from lib.image import ImageProcessor, ImageProcessorError, PNG_HEADER_SIZE
+from lib.plan import PrintPlan
+from lib.scheduling import worker_pool, release_realtime
+from lib.source import LayerSourceError
+from settings import settings_dict
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -12,6 +23,115 @@ This module provides a class for managing 3D models in a 3D printing system.
 It uses custom Unpacker and ImageProcessor classes for file and image operations.
 """
 
+# Layer sources opened by the validation worker processes (one per job file and process)
+_worker_sources = {}
+
+# Containers being compiled in the background (container path -> thread)
+_compiling = {}
+_compiling_lock = threading.Lock()
+
+
+def _worker_source(source_class, filepath):
+    """
+    Get the layer source of a job file in a worker process, opened on first use.
+
+    Parameters:
+        source_class (type): The class of the layer source.
+        filepath (str): The path to the job file.
+
+    Returns:
+        LayerSource: The layer source.
+    """
+    source = _worker_sources.get(filepath)
+    if source is None:
+        source = _worker_sources[filepath] = source_class(filepath)
+    return source
+
+
+def _validate_layer(source_class, filepath, layer):
+    """
+    Decode and validate a single layer. Runs in a validation worker process.
+
+    Parameters:
+        source_class (type): The class of the layer source.
+        filepath (str): The path to the job file.
+        layer (int): The layer number.
+
+    Returns:
+        dict: The image information of the layer.
+    """
+    height, width = _worker_source(source_class, filepath).frame(layer).shape
+    img = ImageProcessor()
+    img.set_resolution(width, height)
+    img.validate(to_grayscale=False)
+    return {
+        'resolution_x': img.resolution_x,
+        'resolution_y': img.resolution_y,
+        'aspect_ratio': img.aspect_ratio
+    }
+
+
+def _measure_frame(frame):
+    """
+    Measure the cross-section of a layer: lit area (mm²), perimeter (mm), number of islands and
+    area of the largest island (mm²).
+
+    Parameters:
+        frame (numpy.ndarray): The layer (uint8, height x width).
+
+    Returns:
+        dict: The geometry of the layer.
+    """
+    dimensions = settings_dict['machine']['dimensions']
+    pitch_x, pitch_y = dimensions['x'] / frame.shape[1], dimensions['y'] / frame.shape[0]
+    geometry = layer_geometry(frame)
+    return {
+        'area': geometry.area * pitch_x * pitch_y,
+        'perimeter': geometry.edges_x * pitch_y + geometry.edges_y * pitch_x,
+        'islands': geometry.islands,
+        'largest': geometry.largest * pitch_x * pitch_y
+    }
+
+
+def _scan_layer(source_class, filepath, layer):
+    """
+    Decode a layer and measure its cross-section. Runs in a worker process.
+
+    Parameters:
+        source_class (type): The class of the layer source.
+        filepath (str): The path to the job file.
+        layer (int): The layer number.
+
+    Returns:
+        dict: Whether any pixel is lit and the geometry of the layer.
+    """
+    frame = _worker_source(source_class, filepath).frame(layer)
+    return {'lit': bool(frame.any()), 'geometry': _measure_frame(frame)}
+
+
+def _compile_in_background(source_class, filepath, container_path):
+    """
+    Compile a job into a container with a layer source of its own. Runs in a background thread.
+
+    Parameters:
+        source_class (type): The class of the layer source.
+        filepath (str): The path to the job file.
+        container_path (str): The path of the container to write.
+    """
+    # the compilation does not compete with the print loop on its CPU core
+    release_realtime()
+    try:
+        source = source_class(filepath)
+        try:
+            compile_container(source, container_path)
+        finally:
+            source.close()
+    except Exception as e:
+        logger.error(f"Could not compile '{filepath}' into a container, its layers are read from the job file. Reason: {e}")
+    finally:
+        with _compiling_lock:
+            _compiling.pop(container_path, None)
+
 
 class ModelError(Exception):
     """
@@ -36,6 +156,8 @@ class Model:
         """
         self.images = {}
         self.config = {}
+        self.plan = None
+        self.source = None
         self.filepath = filepath
 
         if self.filepath:
@@ -53,9 +175,11 @@ class Model:
         """
         if file_path:
             self.filepath = file_path
+        self.close()
         try:
             up = Unpacker(self.filepath)
             up.unpack()
+            self.source = up.source
             self.images = up.images
             self.config = up.config
         except UnpackerError as e:
@@ -64,10 +188,22 @@ class Model:
 
         self.extract_image_info()
 
+        if settings_dict['system']['container']['enabled']:
+            self.compile()
+        self.classify()
+
+        self.plan = PrintPlan.compile(list(self.images), self.config)
+        if settings_dict['print']['adaptive']['enabled']:
+            self.adapt_exposure()
+
     def extract_image_info(self):
         """
         Extract image information and validate images using ImageProcessor.
 
+        The resolution, color type and bit depth of every layer are checked from the PNG header
+        (or the file header of run-length encoded formats) without decoding any pixels. With validation mode 'full', all layers are additionally
+        decoded by a pool of worker processes. The validation stops at the first invalid layer.
+
         Returns:
             bool: True if the image information is successfully extracted, False otherwise.
 
@@ -76,14 +212,201 @@ class Model:
         """
         try:
             for image in self.images:
-                img = ImageProcessor(os.path.abspath(self.images[image]['filepath']))
-                img.validate()
+                img = ImageProcessor()
+                if self.source.width:
+                    img.set_resolution(self.source.width, self.source.height)
+                else:
+                    img.read_header(self.source.read_head(image, PNG_HEADER_SIZE))
+                img.validate(to_grayscale=False)
 
                 self.images[image]['info'] = {
                     'resolution_x': img.resolution_x,
                     'resolution_y': img.resolution_y,
                     'aspect_ratio': img.aspect_ratio
                 }
-            return True
-        except ImageProcessorError as e:
-            raise ModelError(e)
+        except (ImageProcessorError, LayerSourceError) as e:
+            raise ModelError(f"Layer {image} is invalid: {e}")
+
+        if settings_dict['system']['validation']['mode'] == 'full':
+            self.decode_images()
+        return True
+
+    def decode_images(self):
+        """
+        Decode and validate all images in parallel, cancelling the remaining layers on the first error.
+
+        Raises:
+            ModelError: If an image cannot be decoded or is invalid.
+        """
+        self.run_workers(_validate_layer, self.images)
+
+    def run_workers(self, worker, layers, *args):
+        """
+        Run a worker function for every layer in a pool of worker processes, which open the layer source
+        by its path. The remaining layers are cancelled on the first error.
+
+        Parameters:
+            worker (callable): The worker function, called with the source class, the path, the layer and args.
+            layers (iterable): The layer numbers.
+            *args: Further arguments of the worker function.
+
+        Returns:
+            dict: The result of every layer.
+
+        Raises:
+            ModelError: If the worker fails for a layer.
+        """
+        results = {}
+        workers = settings_dict['system']['validation']['workers'] or None
+        with worker_pool(workers) as executor:
+            futures = {
+                executor.submit(worker, type(self.source), self.source.filepath, layer, *args): layer
+                for layer in layers
+            }
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    results[futures[future]] = future.result()
+            except Exception as e:
+                # any failure of a worker (corrupt data, a crashed worker process) invalidates the model
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise ModelError(f"Layer {futures[future]} is invalid: {e}")
+        return results
+
+    def compile(self):
+        """
+        Read the layers from the job container if it has been compiled already. Otherwise the container is
+        compiled in the background for the next load of the job and the layers are read from the job file,
+        so the print does not wait for every layer to be decoded.
+
+        Returns:
+            bool: True if the layers are read from the container.
+        """
+        container_path = os.path.join(
+            settings_dict['system']['paths']['unpack'],
+            os.path.basename(self.filepath) + CONTAINER_EXTENSION
+        )
+        if os.path.exists(container_path) and os.path.getmtime(container_path) >= os.path.getmtime(self.filepath):
+            try:
+                container = ContainerLayerSource(container_path)
+            except ContainerError as e:
+                logger.warning(f"Could not open container of '{self.filepath}', compiling it again. Reason: {e}")
+            else:
+                self.source.close()
+                self.source = container
+                for image in self.images:
+                    self.images[image].update(container.info(image))
+                return True
+
+        with _compiling_lock:
+            if container_path not in _compiling:
+                thread = threading.Thread(
+                    target=_compile_in_background,
+                    args=(type(self.source), self.source.filepath, container_path),
+                    name="container",
+                    daemon=True
+                )
+                _compiling[container_path] = thread
+                thread.start()
+        return False
+
+    def classify(self):
+        """
+        Classify the layers by content: layers without any lit pixel are marked 'empty', layers identical
+        to the previous layer 'duplicate'. The content hash is taken from the compressed container payload
+        if available, otherwise from the layers as stored in the job file, so no layer is decoded while the
+        container is compiled in the background. Empty layers are only known from the container, on the
+        first load of a job every layer counts as lit.
+
+        With adaptive exposure the cross-section of every layer (see _measure_frame) is measured in the same
+        pass. Only the distinct layers with lit pixels are decoded for it, which also finds the empty layers.
+        """
+        measure = settings_dict['print']['adaptive']['enabled']
+        layers = sorted(self.images)
+        contents = {}
+        if isinstance(self.source, ContainerLayerSource):
+            for image in layers:
+                entry = self.source.entry(image)
+                content = (int(entry['encoding']), int(entry['value']), self.images[image]['bbox'])
+                digest = hashlib.blake2b(str(content).encode(), digest_size=16)
+                digest.update(self.source.payload(image))
+                contents[image] = {'hash': digest.hexdigest(), 'lit': int(entry['area']) > 0, 'geometry': None}
+        else:
+            try:
+                for image in layers:
+                    digest = hashlib.blake2b(digest_size=16)
+                    digest.update(self.source.payload(image))
+                    contents[image] = {'hash': digest.hexdigest(), 'lit': True, 'geometry': None}
+            except LayerSourceError as e:
+                raise ModelError(f"Layer {image} is invalid: {e}")
+
+        if measure:
+            distinct = [
+                image for previous, image in zip([None] + layers, layers)
+                if contents[image]['lit'] and (previous is None or contents[image]['hash'] != contents[previous]['hash'])
+            ]
+            for image, scan in self.run_workers(_scan_layer, distinct).items():
+                contents[image]['lit'] = scan['lit']
+                contents[image]['geometry'] = scan['geometry']
+            # the layers following a distinct layer with the same content were not decoded
+            for previous, image in zip(layers, layers[1:]):
+                if contents[image]['hash'] == contents[previous]['hash']:
+                    contents[image]['lit'] = contents[previous]['lit']
+
+        previous = previous_image = None
+        empty = duplicates = 0
+        for image in layers:
+            info = self.images[image]
+            content = contents[image]
+            info['hash'] = content['hash']
+            info['empty'] = not content['lit']
+            info['duplicate'] = not info['empty'] and info['hash'] == previous
+            if measure:
+                if info['empty']:
+                    info['geometry'] = {'area': 0.0, 'perimeter': 0.0, 'islands': 0, 'largest': 0.0}
+                elif info['duplicate']:
+                    info['geometry'] = dict(self.images[previous_image]['geometry'])
+                else:
+                    info['geometry'] = content['geometry']
+            previous, previous_image = info['hash'], image
+            empty += info['empty']
+            duplicates += info['duplicate']
+
+        logger.info(f"Classified {len(self.images)} layers: {empty} empty, {duplicates} duplicate")
+
+    def adapt_exposure(self):
+        """
+        Scale the exposure of every layer after the bottom layers by the configured curves of the area of
+        its largest island (mm²) and its mean feature width (2 * area / perimeter, in mm), so layers of only
+        small cross-sections and thin features get shorter exposures. The factors are limited to min_factor.
+        Uses the geometry measured by classify().
+        """
+        adaptive = settings_dict['print']['adaptive']
+        bottom_layers = int(self.config.get('header', {}).get('bottom_layers', settings_dict['print']['layer']['bottom']['layers']))
+
+        geometry = [self.images[layer]['geometry'] for layer in self.plan.layers.tolist()]
+        area = np.array([g['area'] for g in geometry])
+        perimeter = np.array([g['perimeter'] for g in geometry])
+        largest = np.array([g['largest'] for g in geometry])
+        width = 2 * area / np.maximum(perimeter, 1e-9)
+
+        area_x, area_y = np.array(adaptive['area'], dtype=np.float64).T
+        width_x, width_y = np.array(adaptive['width'], dtype=np.float64).T
+        factors = np.interp(largest, area_x, area_y) * np.interp(width, width_x, width_y)
+        factors = np.maximum(factors, adaptive['min_factor'])
+        factors[:bottom_layers] = 1.0
+        factors[area == 0] = 1.0
+
+        exposure = self.plan.exposure
+        self.plan = self.plan.replace(exposure=exposure * factors)
+        logger.info(
+            f"Adapted exposure of {int(np.count_nonzero(factors != 1.0))} layers "
+            f"(factors {factors.min():.2f} to {factors.max():.2f}), saving {float((exposure - self.plan.exposure).sum()):.1f}s"
+        )
+
+    def close(self):
+        """
+        Close the layer source of the currently loaded model.
+        """
+        if self.source is not None:
+            self.source.close()
+            self.source = None
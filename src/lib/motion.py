@@ -0,0 +1,341 @@
+import math
+import logging
+import functools
+import threading
+from array import array
+
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides a motion planner for the stepper motor of the z-axis.
+It builds constant-acceleration (trapezoidal) step-delay tables with Austin's recurrence
+and caches them, as every layer repeats the same moves.
+The motion queue in front of the stepper driver drops redundant moves, chains consecutive moves in the
+same direction and keeps the driver enabled between moves.
+"""
+
+# Austin's correction factor for the first step delay (compensates the error of the recurrence)
+AUSTIN_C0_FACTOR = 0.676
+
+
+class MotionPlannerError(Exception):
+    """
+    Custom exception for motion planner errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+@functools.lru_cache(maxsize=64)
+def ramp(cruise_delay, acceleration, max_delay):
+    """
+    Build the acceleration ramp from standstill up to the cruise speed.
+
+    Uses the recurrence c(n) = c(n-1) - 2 * c(n-1) / (4n + 1) from D. Austin,
+    "Generate stepper-motor speed profiles in real time", which is O(1) per step.
+
+    Parameters:
+        cruise_delay (float): The step delay at cruise speed in seconds.
+        acceleration (float): The acceleration in steps/s².
+        max_delay (float): The longest allowed step delay in seconds.
+
+    Returns:
+        array: The step delays of the ramp in seconds (do not modify, the array is cached).
+    """
+    delays = array('d')
+    delay = AUSTIN_C0_FACTOR * math.sqrt(2.0 / acceleration)
+    n = 0
+    while delay > cruise_delay:
+        delays.append(min(delay, max_delay))
+        n += 1
+        delay -= 2.0 * delay / (4 * n + 1)
+    return delays
+
+
+@functools.lru_cache(maxsize=128)
+def profile(steps, cruise_delay, acceleration, max_delay):
+    """
+    Build the step-delay table of a trapezoidal (or triangular) move.
+
+    Parameters:
+        steps (int): Number of steps to move.
+        cruise_delay (float): The step delay at cruise speed in seconds.
+        acceleration (float): The acceleration in steps/s².
+        max_delay (float): The longest allowed step delay in seconds.
+
+    Returns:
+        array: One delay per step in ns (do not modify, the array is cached).
+    """
+    accel_ramp = ramp(cruise_delay, acceleration, max_delay)
+
+    # on short moves we never reach the cruise speed and turn the trapezoid into a triangle
+    accel_steps = min(len(accel_ramp), steps // 2)
+    decel_steps = min(len(accel_ramp), steps - accel_steps)
+    cruise_steps = steps - accel_steps - decel_steps
+
+    delays = array('d', accel_ramp[:accel_steps])
+    delays.extend(array('d', [cruise_delay]) * cruise_steps)
+    delays.extend(reversed(accel_ramp[:decel_steps]))
+    return array('q', [round(delay * 1e9) for delay in delays])
+
+
+class MotionPlanner:
+    """
+    Class for planning constant-acceleration moves of the z-axis.
+    """
+
+    def __init__(self):
+        """
+        Initialize the MotionPlanner instance with the machine and acceleration settings.
+        """
+        self.__mm_per_step = settings_dict['machine']['accuracy']['z']
+        self.__acceleration = settings_dict['print']['acceleration']['rate']
+        self.__min_delay = settings_dict['print']['acceleration']['min_delay']
+        self.__max_delay = settings_dict['print']['acceleration']['max_delay']
+
+    def steps(self, distance):
+        """
+        Convert a distance to a number of steps.
+
+        Parameters:
+            distance (float): The distance in mm.
+
+        Returns:
+            int: The number of steps.
+        """
+        return int(round(distance / self.__mm_per_step))
+
+    def cruise_delay(self, speed):
+        """
+        Get the step delay for a speed, limited by the minimal step delay of the machine.
+
+        Parameters:
+            speed (float): The speed in mm/s.
+
+        Returns:
+            float: The step delay in seconds.
+
+        Raises:
+            MotionPlannerError: If the speed is not positive.
+        """
+        if speed <= 0:
+            raise MotionPlannerError(f"Speed must be positive, got {speed}")
+        return min(max(self.__mm_per_step / speed, self.__min_delay), self.__max_delay)
+
+    def plan_chain(self, segments):
+        """
+        Plan consecutive moves in the same direction as one move, without stopping between them.
+
+        The ramp of the fastest segment is used as speed table, where an index is the number of steps
+        needed to accelerate from standstill. The speed at a junction is limited by both segments and
+        by what can be reached from the neighbouring junctions (backward and forward pass).
+
+        Parameters:
+            segments (list): The (steps, speed) of each move, speeds in mm/s.
+
+        Returns:
+            array: One delay per step in ns.
+        """
+        segments = [(int(steps), self.cruise_delay(speed)) for steps, speed in segments if steps > 0]
+        if not segments:
+            return array('q')
+        if len(segments) == 1:
+            return profile(segments[0][0], segments[0][1], self.__acceleration / self.__mm_per_step, self.__max_delay)
+
+        acceleration = self.__acceleration / self.__mm_per_step
+        table = ramp(min(delay for _, delay in segments), acceleration, self.__max_delay)
+        cruise = [len(ramp(delay, acceleration, self.__max_delay)) for _, delay in segments]
+
+        # speed index at the start of each segment and at the end of the last one
+        junctions = [0] + [min(cruise[k - 1], cruise[k]) for k in range(1, len(segments))] + [0]
+        for k in range(len(segments) - 1, -1, -1):
+            junctions[k] = min(junctions[k], junctions[k + 1] + segments[k][0])
+        for k in range(len(segments)):
+            junctions[k + 1] = min(junctions[k + 1], junctions[k] + segments[k][0])
+
+        delays = array('d')
+        for k, (steps, cruise_delay) in enumerate(segments):
+            entry, exit = junctions[k], junctions[k + 1]
+            peak = min(cruise[k], (steps + entry + exit) // 2)
+            delays.extend(table[entry:peak])
+            delays.extend(array('d', [cruise_delay if peak == cruise[k] else table[peak]]) * (steps - 2 * peak + entry + exit))
+            delays.extend(reversed(table[exit:peak]))
+        logger.debug(f"Planned {len(segments)} chained moves of {len(delays)} steps")
+        return array('q', [round(delay * 1e9) for delay in delays])
+
+    def plan(self, steps, speed):
+        """
+        Plan a move and return its step-delay table.
+
+        Parameters:
+            steps (int): Number of steps to move.
+            speed (float): The target (cruise) speed in mm/s.
+
+        Returns:
+            array: One delay per step in ns.
+        """
+        if steps <= 0:
+            return array('q')
+        delays = profile(
+            int(steps),
+            self.cruise_delay(speed),
+            self.__acceleration / self.__mm_per_step,
+            self.__max_delay
+        )
+        logger.debug(f"Planned move of {steps} steps at {speed} mm/s")
+        return delays
+
+
+class MotionQueue:
+    """
+    Class queueing absolute moves of the z-axis for a stepper driver. Queued moves are executed by flush().
+    """
+
+    def __init__(self, stepper):
+        """
+        Initialize the MotionQueue instance.
+
+        Parameters:
+            stepper (StepperDriver): The driver executing the moves.
+        """
+        self.stepper = stepper
+        self.__idle_disable = settings_dict['machine']['timing']['idle_disable']
+        self.__default_speed = settings_dict['print']['layer']['default']['speed']
+        self.__pending = []  # [target position in steps, speed in mm/s]
+        self.__lock = threading.Lock()
+        self.__idle_timer = None
+        self.stats = {'moves': 0, 'dropped': 0, 'merged': 0, 'chained': 0, 'executed': 0, 'transitions_saved': 0, 'max_depth': 0}
+
+    @property
+    def depth(self):
+        """
+        Get the number of queued moves.
+
+        Returns:
+            int: The number of moves waiting for flush().
+        """
+        return len(self.__pending)
+
+    @property
+    def target(self):
+        """
+        Get the position after all queued moves.
+
+        Returns:
+            int: The position in steps.
+        """
+        return self.__pending[-1][0] if self.__pending else self.stepper.position
+
+    def goto(self, position, speed=None):
+        """
+        Queue a move to a position. A move to the position the queue already ends at is dropped and
+        a move continuing the last one in the same direction at the same speed is merged into it.
+
+        Parameters:
+            position (int): The position to move to in steps.
+            speed (float, optional): Target speed in mm/s, defaults to the default layer speed.
+        """
+        speed = speed if speed else self.__default_speed
+        self.stats['moves'] += 1
+        last = self.target
+        if position == last:
+            self.stats['dropped'] += 1
+            return
+
+        if self.__pending:
+            start = self.__pending[-2][0] if len(self.__pending) > 1 else self.stepper.position
+            if (last - start > 0) == (position - last > 0) and self.__pending[-1][1] == speed:
+                self.__pending[-1][0] = position
+                self.stats['merged'] += 1
+                return
+
+        self.__pending.append([position, speed])
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self.__pending))
+
+    def move(self, steps, speed=None):
+        """
+        Queue a move relative to the position after all queued moves.
+
+        Parameters:
+            steps (int): Number of steps, positive to move up.
+            speed (float, optional): Target speed in mm/s.
+        """
+        self.goto(self.target + steps, speed)
+
+    def chains(self):
+        """
+        Split the queued moves into chains of consecutive moves in the same direction.
+
+        Returns:
+            list: The (direction, [(steps, speed), ...]) of each chain.
+        """
+        chains = []
+        position = self.stepper.position
+        for target, speed in self.__pending:
+            direction = 1 if target > position else -1
+            if chains and chains[-1][0] == direction:
+                chains[-1][1].append((abs(target - position), speed))
+                self.stats['chained'] += 1
+            else:
+                chains.append((direction, [(abs(target - position), speed)]))
+            position = target
+        return chains
+
+    def flush(self):
+        """
+        Execute all queued moves and return when they are done. The driver stays enabled for the
+        idle-disable time afterwards. The queue is dropped if the printer is stopped.
+
+        Returns:
+            int: Number of steps performed.
+        """
+        with self.__lock:
+            if self.__idle_timer is not None:
+                self.__idle_timer.cancel()
+                self.__idle_timer = None
+
+            performed = 0
+            try:
+                for direction, segments in self.chains():
+                    if self.stepper.stopped.is_set():
+                        break
+                    # up() and down() enable the driver and disable it again for every move
+                    saved = 2
+                    if not self.stepper.enabled:
+                        self.stepper.enable()
+                        saved -= 1
+                    # the direction pin is shared with other drivers (e.g. leveling), so it is written for every chain
+                    self.stepper.set_direction('CW' if direction > 0 else 'CCW')
+                    performed += self.stepper.execute(self.stepper.planner.plan_chain(segments))
+                    self.stats['executed'] += 1
+                    self.stats['transitions_saved'] += saved
+            finally:
+                self.__pending = []
+
+            if self.__idle_disable and not self.stepper.stopped.is_set():
+                self.__idle_timer = threading.Timer(self.__idle_disable, self.release)
+                self.__idle_timer.daemon = True
+                self.__idle_timer.start()
+            elif self.stepper.enabled:
+                self.stepper.disable()
+                self.stats['transitions_saved'] -= 1
+        return performed
+
+    def release(self):
+        """
+        Disable the driver unless a move is being executed (called by the idle-disable timer).
+        """
+        if self.__lock.acquire(blocking=False):
+            try:
+                if self.__idle_timer is not None:
+                    self.__idle_timer.cancel()
+                    self.__idle_timer = None
+                if self.stepper.enabled:
+                    self.stepper.disable()
+                    self.stats['transitions_saved'] -= 1
+            finally:
+                self.__lock.release()
@@ -0,0 +1,316 @@
+import re
+import logging
+import configparser
+from collections import namedtuple
+
+import numpy as np
+
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the parser for the slicer metadata of a job (run.gcode or config.ini) and
+the print plan. The plan is compiled once per job from the slicer values and the defaults of
+settings.yaml and holds one row per layer in read-only NumPy arrays.
+"""
+
+# Keys of the run.gcode header (ChiTuBox and compatible slicers) mapped to plan parameters.
+# Speeds are given in mm/min, times in seconds.
+GCODE_HEADER_KEYS = {
+    'layerHeight': 'height',
+    'normalExposureTime': 'exposure',
+    'bottomLayExposureTime': 'bottom_exposure',
+    'bottomLayerExposureTime': 'bottom_exposure',
+    'bottomLayerCount': 'bottom_layers',
+    'lightOffTime': 'blackout',
+    'bottomLightOffTime': 'bottom_blackout',
+    'normalLayerLiftHeight': 'lift',
+    'bottomLayerLiftHeight': 'bottom_lift',
+    'normalLayerLiftSpeed': 'lift_speed',
+    'bottomLayerLiftSpeed': 'bottom_lift_speed',
+    'normalDropSpeed': 'retract_speed',
+}
+
+# Keys of the config.ini (Prusa SL1 and compatible slicers) mapped to plan parameters.
+INI_KEYS = {
+    'layerHeight': 'height',
+    'expTime': 'exposure',
+    'expTimeFirst': 'bottom_exposure',
+    'numFade': 'bottom_layers',
+}
+
+# Plan parameters given in mm/min by the slicers
+SPEED_PARAMETERS = ('lift_speed', 'bottom_lift_speed', 'retract_speed')
+
+GCODE_HEADER = re.compile(r'^;\s*(\w+)\s*:\s*([-+\d.eE]+)\s*$')
+GCODE_LAYER_START = re.compile(r'^;\s*LAYER_START\s*:\s*(\d+)', re.IGNORECASE)
+GCODE_LAYER_END = re.compile(r'^;\s*LAYER_END', re.IGNORECASE)
+GCODE_CURRENT_POSITION = re.compile(r'^;\s*currPos\s*:\s*([-+\d.eE]+)')
+GCODE_WORD = re.compile(r'([A-Z])\s*([-+]?\d*\.?\d+)')
+
+# One row of the plan. Heights and positions in mm, times in seconds, speeds in mm/s.
+LayerStep = namedtuple('LayerStep', ['layer', 'z', 'height', 'exposure', 'blackout', 'settling', 'lift', 'lift_speed', 'retract_speed'])
+
+
+class PrintPlanError(Exception):
+    """
+    Custom exception for print plan errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def parse_gcode(content):
+    """
+    Parse the header and the layer blocks of a run.gcode file.
+
+    Every layer block (;LAYER_START to ;LAYER_END) is scanned for the lift and retract moves,
+    the delay before the light is switched on (blackout) and the exposure (delay while the light is on).
+
+    Parameters:
+        content (str): The content of the run.gcode file.
+
+    Returns:
+        dict: 'header' (plan parameters of the header) and 'layers' (plan parameters per layer block).
+    """
+    header = {}
+    layers = []
+    layer = None
+    light = False
+    absolute = True
+    z = 0.0
+
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        if line.startswith(';'):
+            match = GCODE_LAYER_START.match(line)
+            if match:
+                layer = {'moves': []}
+                light = False
+                continue
+            if GCODE_LAYER_END.match(line):
+                if layer is not None:
+                    layers.append(finish_layer(layer))
+                layer = None
+                continue
+            match = GCODE_CURRENT_POSITION.match(line)
+            if match and layer is not None:
+                layer['z'] = float(match.group(1))
+                continue
+            match = GCODE_HEADER.match(line)
+            if match and layer is None and match.group(1) in GCODE_HEADER_KEYS:
+                header[GCODE_HEADER_KEYS[match.group(1)]] = float(match.group(2))
+            continue
+
+        code = line.split(';', 1)[0].strip().upper()
+        if not code:
+            continue
+        command = code.split()[0]
+        words = dict(GCODE_WORD.findall(code[len(command):]))
+
+        if command == 'G90':
+            absolute = True
+        elif command == 'G91':
+            absolute = False
+        elif command in ('G0', 'G1') and 'Z' in words:
+            target = float(words['Z']) if absolute else z + float(words['Z'])
+            if layer is not None:
+                layer['moves'].append((z, target, float(words['F']) if 'F' in words else None))
+            z = target
+        elif command == 'M106' and layer is not None:
+            light = float(words.get('S', 255)) > 0
+        elif command == 'G4' and layer is not None and 'P' in words:
+            key = 'exposure' if light else 'blackout'
+            layer[key] = layer.get(key, 0.0) + float(words['P']) / 1000
+
+    for key in SPEED_PARAMETERS:
+        if key in header:
+            header[key] /= 60
+    if 'bottom_layers' in header:
+        header['bottom_layers'] = int(header['bottom_layers'])
+
+    return {'header': header, 'layers': layers}
+
+
+def finish_layer(layer):
+    """
+    Derive the plan parameters of a parsed layer block.
+
+    Parameters:
+        layer (dict): The parsed layer block.
+
+    Returns:
+        dict: The plan parameters found in the layer block.
+    """
+    moves = layer.pop('moves')
+    z = layer.get('z', moves[-1][1] if moves else None)
+
+    # the first move goes up (lift), the last one down to the layer position (retract)
+    if len(moves) >= 2 and z is not None:
+        start, peak, speed = moves[0]
+        layer['lift'] = max(0.0, peak - z)
+        if speed:
+            layer['lift_speed'] = speed / 60
+        if moves[-1][2]:
+            layer['retract_speed'] = moves[-1][2] / 60
+    return layer
+
+
+def parse_ini(content):
+    """
+    Parse a config.ini file.
+
+    Parameters:
+        content (str): The content of the config.ini file.
+
+    Returns:
+        dict: 'header' (plan parameters) and 'layers' (always empty).
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    config.read_string("[job]\n" + content)
+
+    keys = {key.lower(): parameter for key, parameter in INI_KEYS.items()}
+    header = {}
+    for key, value in config['job'].items():
+        if key in keys:
+            try:
+                header[keys[key]] = float(value)
+            except ValueError:
+                logger.warning(f"Ignoring invalid value '{value}' of '{key}' in config.ini")
+    if 'bottom_layers' in header:
+        header['bottom_layers'] = int(header['bottom_layers'])
+    return {'header': header, 'layers': []}
+
+
+class PrintPlan:
+    """
+    Immutable per-layer execution plan of a job.
+    """
+    __slots__ = ('layers', 'z', 'height', 'exposure', 'blackout', 'settling', 'lift', 'lift_speed', 'retract_speed', 'steps')
+
+    COLUMNS = LayerStep._fields
+
+    def __init__(self, **columns):
+        """
+        Initialize the PrintPlan instance from its columns. Use PrintPlan.compile to build a plan.
+
+        Parameters:
+            **columns: One array per column of LayerStep, all of the same length.
+        """
+        length = len(columns['layer'])
+        for name in self.COLUMNS:
+            column = np.array(columns[name], dtype=np.int64 if name == 'layer' else np.float64)
+            if column.shape != (length,):
+                raise PrintPlanError(f"Column '{name}' has {column.size} rows instead of {length}")
+            column.flags.writeable = False
+            object.__setattr__(self, 'layers' if name == 'layer' else name, column)
+
+        # the rows as plain Python tuples, so executing a layer does not touch NumPy
+        object.__setattr__(self, 'steps', [LayerStep(*row) for row in zip(*(self.column(name).tolist() for name in self.COLUMNS))])
+
+    def __setattr__(self, key, value):
+        raise AttributeError("PrintPlan is immutable")
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getitem__(self, index):
+        return self.steps[index]
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def column(self, name):
+        """
+        Get a column of the plan.
+
+        Parameters:
+            name (str): The name of the column (see LayerStep).
+
+        Returns:
+            numpy.ndarray: The read-only column.
+        """
+        return self.layers if name == 'layer' else getattr(self, name)
+
+    def replace(self, **columns):
+        """
+        Create a new plan with some columns replaced.
+
+        Parameters:
+            **columns: The columns to replace.
+
+        Returns:
+            PrintPlan: The new plan.
+        """
+        return PrintPlan(**{name: columns.get(name, self.column(name)) for name in self.COLUMNS})
+
+    @classmethod
+    def compile(cls, layers, config=None):
+        """
+        Compile the plan of a job from the slicer metadata and the defaults of settings.yaml.
+        Values of a layer block override the header of the slicer, which overrides settings.yaml.
+
+        Parameters:
+            layers (list): The layer numbers in print order.
+            config (dict, optional): The parsed slicer metadata ('header' and 'layers').
+
+        Returns:
+            PrintPlan: The plan.
+        """
+        config = config or {}
+        header = config.get('header', {})
+        blocks = config.get('layers', [])
+        if blocks and len(blocks) != len(layers):
+            logger.warning(f"Slicer defines {len(blocks)} layers for {len(layers)} images. Ignoring per-layer values.")
+            blocks = []
+
+        default = settings_dict['print']['layer']['default']
+        bottom = settings_dict['print']['layer']['bottom']
+        settling = settings_dict['print']['resin']['settling'] / 1000
+
+        def value(key, fallback):
+            return header.get(key, fallback)
+
+        bottom_layers = int(value('bottom_layers', bottom['layers']))
+        height = value('height', default['height'])
+        normal = {
+            'height': height,
+            'exposure': value('exposure', default['exposure']),
+            'blackout': value('blackout', default['blackout']),
+            'settling': settling,
+            'lift': value('lift', default['lift']),
+            'lift_speed': value('lift_speed', default['speed']),
+            'retract_speed': value('retract_speed', default['speed'])
+        }
+        first = {
+            'height': value('height', bottom['height']),
+            'exposure': value('bottom_exposure', bottom['exposure']),
+            'blackout': value('bottom_blackout', value('blackout', bottom['blackout'])),
+            'settling': settling,
+            'lift': value('bottom_lift', value('lift', bottom['lift'])),
+            'lift_speed': value('bottom_lift_speed', value('lift_speed', bottom['speed'])),
+            'retract_speed': value('retract_speed', bottom['speed'])
+        }
+
+        columns = {name: [] for name in cls.COLUMNS}
+        z = 0.0
+        for index, layer in enumerate(layers):
+            row = dict(first if index < bottom_layers else normal)
+            if blocks:
+                row.update({key: blocks[index][key] for key in row if key in blocks[index]})
+
+            z = blocks[index]['z'] if blocks and 'z' in blocks[index] else z + row['height']
+            row['layer'] = layer
+            row['z'] = z
+            for name in cls.COLUMNS:
+                columns[name].append(row[name])
+
+        plan = cls(**columns)
+        logger.info(f"Compiled print plan of {len(plan)} layers ({bottom_layers} bottom layers)")
+        return plan
@@ -0,0 +1,207 @@
+import os
+import mmap
+import atexit
+import struct
+import logging
+import zlib
+
+from settings import system_dict
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides a crash-consistent journal for the motor position.
+The position is kept in memory and persisted into a small memory-mapped file holding two
+checksummed records, which are written alternately (double-buffered). A power loss while
+writing can only corrupt the record being written, the other one stays valid.
+"""
+
+JOURNAL_FILENAME = "position.journal"
+
+# Record: sequence number, position (steps), flags, crc32 of the preceding fields
+RECORD = struct.Struct('<QqII')
+RECORD_SLOTS = (0, 32)
+JOURNAL_SIZE = 64
+
+# Flags
+FLAG_MOVING = 0x1
+
+
+class PositionJournalError(Exception):
+    """
+    Custom exception for position journal errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class PositionJournal:
+    """
+    Singleton class to keep track of the motor position (in steps, counting up from the printing bed).
+    """
+    _instance = None
+
+    def __init__(self):
+        self.filepath = None
+        self.position = 0
+        self.moving = False
+        self.recovered = False
+        self.__sequence = 0
+        self.__persisted = None
+        self.__file = None
+        self.__map = None
+
+    def __new__(cls, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def open(self, filepath, default=0):
+        """
+        Open (or create) the journal file and recover the last persisted position.
+
+        Parameters:
+            filepath (str): The path to the journal file.
+            default (int, optional): The position to start with if there is no valid record.
+        """
+        self.filepath = filepath
+        directory, _ = os.path.split(self.filepath)
+        os.makedirs(directory, exist_ok=True)
+
+        try:
+            fd = os.open(self.filepath, os.O_RDWR | os.O_CREAT, 0o644)
+            self.__file = os.fdopen(fd, 'r+b')
+            if os.fstat(fd).st_size < JOURNAL_SIZE:
+                self.__file.truncate(JOURNAL_SIZE)
+            self.__map = mmap.mmap(fd, JOURNAL_SIZE)
+        except OSError as e:
+            raise PositionJournalError(f"Could not open the position journal '{self.filepath}'. Reason: {e}")
+
+        self.recover(default)
+
+    def recover(self, default=0):
+        """
+        Load the newest valid record of the journal.
+
+        Parameters:
+            default (int, optional): The position to use if there is no valid record.
+        """
+        records = [record for record in (self.read(slot) for slot in RECORD_SLOTS) if record]
+        if not records:
+            logger.info(f"No valid position record found. Starting at position {default}")
+            self.__sequence = 0
+            self.position = int(default)
+            self.moving = False
+            self.recovered = False
+            self.flush()
+            return
+
+        self.__sequence, self.position, flags = max(records)
+        self.__persisted = (self.position, flags)
+        self.moving = bool(flags & FLAG_MOVING)
+        self.recovered = True
+
+        if self.moving:
+            logger.warning(f"Motor was moving during the last shutdown. Position {self.position} is not reliable, leveling required")
+        else:
+            logger.info(f"Recovered motor position {self.position}")
+
+    def read(self, offset):
+        """
+        Read and verify a record of the journal.
+
+        Parameters:
+            offset (int): The offset of the record slot.
+
+        Returns:
+            tuple: (sequence, position, flags), or None if the record is empty or corrupt.
+        """
+        sequence, position, flags, crc = RECORD.unpack_from(self.__map, offset)
+        if sequence == 0 or crc != zlib.crc32(self.__map[offset:offset + RECORD.size - 4]):
+            return None
+        return sequence, position, flags
+
+    def write(self, flags):
+        """
+        Write the in-memory position into the older of the two records and flush it to disk.
+
+        Parameters:
+            flags (int): The record flags.
+        """
+        self.__sequence += 1
+        offset = RECORD_SLOTS[self.__sequence % len(RECORD_SLOTS)]
+
+        RECORD.pack_into(self.__map, offset, self.__sequence, self.position, flags, 0)
+        crc = zlib.crc32(self.__map[offset:offset + RECORD.size - 4])
+        RECORD.pack_into(self.__map, offset, self.__sequence, self.position, flags, crc)
+        self.__map.flush()
+        self.__persisted = (self.position, flags)
+
+    def begin(self):
+        """
+        Mark the start of a move. If we lose power before end() the position is marked unreliable.
+        """
+        self.moving = True
+        self.write(FLAG_MOVING)
+
+    def move(self, steps):
+        """
+        Update the in-memory position. Not persisted until end() or flush().
+
+        Parameters:
+            steps (int): The number of steps moved (negative when moving down).
+        """
+        self.position += steps
+
+    def end(self):
+        """
+        Mark the end of a move and persist the position.
+        """
+        self.moving = False
+        self.flush()
+
+    def set(self, position):
+        """
+        Set and persist the position (e.g. after leveling).
+
+        Parameters:
+            position (int): The new position in steps.
+        """
+        self.position = int(position)
+        self.moving = False
+        self.flush()
+
+    def flush(self):
+        """
+        Persist the in-memory position if it changed since the last write.
+        """
+        flags = FLAG_MOVING if self.moving else 0
+        if self.__map is not None and self.__persisted != (self.position, flags):
+            self.write(flags)
+
+    def close(self):
+        """
+        Flush and close the journal.
+        """
+        if self.__map is None:
+            return
+        self.flush()
+        self.__map.close()
+        self.__file.close()
+        self.__map = None
+        self.__file = None
+
+
+# Create the instance of the position journal. Positions of older installations are taken over from system.json.
+motor_position = PositionJournal()
+motor_position.open(
+    os.path.join(settings_dict['system']['paths']['state'], JOURNAL_FILENAME),
+    default=system_dict['motor_position'] or 0
+)
+atexit.register(motor_position.close)
+
+if motor_position.moving:
+    system_dict['is_calibrated'] = False
@@ -0,0 +1,197 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides a background prefetcher for layers.
+While the current layer is moving or exposing, a worker thread prepares the next layers
+(decode, scale and convert to the display format) and keeps them in a bounded cache.
+"""
+
+
+class LayerPrefetcher:
+    """
+    Class for preparing the upcoming layers in a background thread.
+    """
+
+    def __init__(self, loader, sizeof):
+        """
+        Initialize the LayerPrefetcher instance.
+
+        Parameters:
+            loader (callable): Function preparing a layer, called with the layer number.
+            sizeof (callable): Function returning the size in bytes of a prepared layer.
+        """
+        self.__loader = loader
+        self.__sizeof = sizeof
+        self.__depth = settings_dict['system']['prefetch']['depth']
+        self.__memory = settings_dict['system']['prefetch']['memory'] * 1024 * 1024
+
+        self.__cache = OrderedDict()
+        self.__cache_size = 0
+        self.__condition = threading.Condition()
+        self.__layers = []
+        self.__index = {}
+        self.__failed = set()
+        self.__loading = None
+        self.__position = 0
+        self.__stopped = False
+        self.__thread = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, layers, first=None):
+        """
+        Start prefetching the given layers in order.
+
+        Parameters:
+            layers (list): The layer numbers in print order.
+            first (int, optional): The layer to start with, defaults to the first layer.
+        """
+        self.stop()
+        with self.__condition:
+            self.__layers = list(layers)
+            self.__index = {layer: i for i, layer in enumerate(self.__layers)}
+            self.__position = self.__index.get(first, 0)
+            self.__failed = set()
+            self.__cache.clear()
+            self.__cache_size = 0
+            self.__stopped = False
+            self.hits = 0
+            self.misses = 0
+
+        if self.__depth > 0:
+            self.__thread = threading.Thread(target=self.__prefetch, name="prefetch", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        """
+        Stop the prefetch thread and drop the cache.
+        """
+        with self.__condition:
+            self.__stopped = True
+            self.__cache.clear()
+            self.__cache_size = 0
+            self.__condition.notify_all()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def get(self, layer):
+        """
+        Get a prepared layer and move the prefetch window behind it.
+        Layers not in the cache are prepared synchronously (miss).
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            The prepared layer.
+        """
+        with self.__condition:
+            # the layer is being prepared right now, wait for it instead of preparing it twice
+            while self.__loading == layer and layer not in self.__cache:
+                self.__condition.wait()
+
+            item = self.__cache.pop(layer, None)
+            if item is not None:
+                self.__cache_size -= self.__sizeof(item)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            # the window starts behind the requested layer
+            if layer in self.__index:
+                self.__position = self.__index[layer] + 1
+            self.__evict()
+            self.__condition.notify_all()
+
+        if item is None:
+            logger.debug(f"Prefetch miss for layer {layer}")
+            item = self.__loader(layer)
+        return item
+
+    @property
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: Hits, misses, cached layers and cached bytes.
+        """
+        with self.__condition:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached': len(self.__cache),
+                'bytes': self.__cache_size
+            }
+
+    def __evict(self):
+        """
+        Drop all cached layers which are not in the prefetch window anymore. Needs the lock.
+        """
+        window = set(self.__window())
+        for layer in [layer for layer in self.__cache if layer not in window]:
+            self.__cache_size -= self.__sizeof(self.__cache.pop(layer))
+
+    def __next(self):
+        """
+        Get the next layer in the prefetch window which is not cached yet. Needs the lock.
+
+        Returns:
+            int: The layer number, or None if the window is complete or the memory cap is reached.
+        """
+        if self.__cache_size >= self.__memory:
+            return None
+        for layer in self.__window():
+            if layer not in self.__cache and layer not in self.__failed:
+                return layer
+        return None
+
+    def __window(self):
+        """
+        Get the layers of the prefetch window. Needs the lock.
+
+        Returns:
+            list: The next layers to prepare, at most the prefetch depth.
+        """
+        return self.__layers[self.__position:self.__position + self.__depth]
+
+    def __prefetch(self):
+        """
+        Prefetch loop, prepares the layers of the window and waits for the window to move.
+        """
+        while True:
+            with self.__condition:
+                layer = self.__next()
+                while layer is None and not self.__stopped:
+                    self.__condition.wait()
+                    layer = self.__next()
+                if self.__stopped:
+                    return
+                self.__loading = layer
+
+            try:
+                item = self.__loader(layer)
+            except Exception as e:
+                # the layer is prepared (again) synchronously on get, which then raises the error
+                logger.error(f"Could not prefetch layer {layer}. Reason: {e}")
+                item = None
+
+            with self.__condition:
+                self.__loading = None
+                self.__condition.notify_all()
+                if self.__stopped:
+                    return
+                if item is None:
+                    self.__failed.add(layer)
+                elif layer in self.__window() and layer not in self.__cache:
+                    self.__cache[layer] = item
+                    self.__cache_size += self.__sizeof(item)
@@ -1,6 +1,5 @@
 import os
 import threading
-import queue
 import logging
 import time
 
@@ -8,6 +7,7 @@ from lib.job import Job
 from lib.layer import LayerManager
 from lib.mask import MaskError
 from lib.model import Model, ModelError
+from lib.realtime import STATE_IDLE, STATE_PRINTING, STATE_STOPPED
 from lib.stepper import StepperDriverError
 from lib.unpack import UnpackerError
 from utils.raspi import is_raspberrypi
@@ -19,13 +19,20 @@ from settings import settings_dict
 logger = logging.getLogger(__name__)
 
 class PrintLoop:
-    def __init__(self, queues, stop_event):
-        """Initialize the PrintLoop instance."""
+    def __init__(self, queues, stop_event, status=None):
+        """Initialize the PrintLoop instance.
+
+        Parameters:
+            queues (dict): The queues of the process, jobs arrive on queues['print'].
+            stop_event (StopSignal): The stop signal.
+            status (RealtimeStatus, optional): The shared status of the print loop, read by the API.
+        """
         if not is_raspberrypi():
             logger.error("Not running on a raspberry Pi. Stopping init of Print-Loop...")
         else:
             self.queues = queues
             self.stopped = stop_event
+            self.status = status
             self.model = Model()
             self.layer_manager = LayerManager(self.stopped)
             self.loop()
@@ -34,30 +41,48 @@ class PrintLoop:
         """Main loop for the print process."""
         while True:
             try:
+                # block until the printer is started again and a job arrives, no polling while idle
                 if self.stopped.is_set():
-                    continue
+                    self.publish(STATE_STOPPED)
+                    self.stopped.wait_clear()
+                    self.publish(STATE_IDLE)
+
+                sjob = self.queues['print'].get()
 
-                sjob = self.queues['print'].get(timeout=2)
+                # a job sent while the printer is stopped waits for the start command following it
+                if self.stopped.is_set():
+                    self.stopped.wait_clear()
 
                 if sjob:
+                    logger.info(f"Job received {self.queues['print'].last_latency / 1e6:.1f}ms after it was sent")
                     job = Job().deserialize(sjob)
                     self.model.load(job.path)
-                    self.layer_manager.load(self.model)
-                    system_dict['last_job_id'] = job.id
+                    try:
+                        self.layer_manager.load(self.model)
+                        system_dict['last_job_id'] = job.id
 
+                        logger.info("Print started...")
+                        self.publish(STATE_PRINTING)
+                        while self.layer_manager.current_layer < self.layer_manager.total_layers and not self.stopped.is_set():
+                            self.layer_manager.next()
+                            self.publish(STATE_PRINTING)
+                    finally:
+                        # the decoder processes, the frame ring and the prefetch thread are released on errors too
+                        self.layer_manager.unload()
 
-                    self.layer_manager.stepper.goto(0)
-
-                    logger.info("Print started...")
-                    while self.layer_manager.current_layer < self.layer_manager.total_layers:
-                        self.layer_manager.next()
+                    if self.stopped.is_set():
+                        self.publish(STATE_STOPPED)
+                        logger.warning(
+                            f"Print stopped at layer {self.layer_manager.current_layer} ({self.stopped.reason}), "
+                            f"print loop halted {self.stopped.latency() / 1e6:.1f}ms after the stop request"
+                        )
                     else:
                         logger.info("Print ended...")
                         system_dict['last_job_id'] = None
-                        self.layer_manager.stepper.up(10000)
+                        self.layer_manager.motion.move(10000)
+                        self.layer_manager.motion.flush()
+                        self.publish(STATE_IDLE)
 
-            except queue.Empty:
-                time.sleep(1)
             except ModelError as e:
                 logger.error(f"Error while loading the model. Cannot start print. Reason: {e}")
                 self.stopped.set()
@@ -74,6 +99,15 @@ class PrintLoop:
                 logger.error(f"Unhandled Error while Processing layer. Stopping print. Reason: {e}")
                 self.stopped.set()
 
+    def publish(self, state):
+        """Publish the state and the current layer to the shared status, if there is one.
+
+        Parameters:
+            state (int): The state (see lib.realtime).
+        """
+        if self.status is not None:
+            self.status.publish(state, self.layer_manager.current_layer, self.layer_manager.total_layers)
+
     @property
     def progress(self):
         """Calculate and return the printing progress as a percentage."""
@@ -0,0 +1,267 @@
+import os
+import time
+import ctypes
+import logging
+import threading
+import multiprocessing
+
+from lib.scheduling import configure_realtime
+from lib.thread import ThreadManager
+from manager import Manager
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the real-time print process. The print loop, the layer manager, the stepper driver and
+the exposure run in a process of their own, pinned to a CPU core and with SCHED_FIFO priority where permitted,
+so the API and the websockets do not compete with the step and exposure timing for the GIL.
+
+The main process talks to it through a pipe (commands, jobs and stops in both directions) and reads its state
+from shared memory.
+"""
+
+# States of the print process in the shared status
+STATE_IDLE = 0
+STATE_PRINTING = 1
+STATE_STOPPED = 2
+STATES = ('idle', 'printing', 'stopped')
+
+
+class StatusRecord(ctypes.Structure):
+    """
+    Layout of the shared status. The sequence number is odd while the record is being written.
+    """
+    _fields_ = [
+        ('sequence', ctypes.c_uint64),
+        ('state', ctypes.c_int32),
+        ('layer', ctypes.c_int32),
+        ('layers', ctypes.c_int32),
+        ('pid', ctypes.c_int32),
+        ('updated', ctypes.c_double)
+    ]
+
+
+class RealtimeStatus:
+    """
+    Status of the print process in shared memory, written by the print loop and read by the main process.
+    Reads are consistent without a lock (sequence lock, there is only one writer).
+    """
+
+    def __init__(self, record=None):
+        """
+        Initialize the RealtimeStatus instance.
+
+        Parameters:
+            record (StatusRecord, optional): The shared record, a new one is allocated if None.
+        """
+        self.record = record if record is not None else multiprocessing.get_context('spawn').RawValue(StatusRecord)
+
+    def publish(self, state, layer=None, layers=None):
+        """
+        Write the status.
+
+        Parameters:
+            state (int): One of STATE_IDLE, STATE_PRINTING or STATE_STOPPED.
+            layer (int, optional): The current layer index, unchanged if None.
+            layers (int, optional): The number of layers of the job, unchanged if None.
+        """
+        record = self.record
+        record.sequence += 1
+        record.state = state
+        if layer is not None:
+            record.layer = layer
+        if layers is not None:
+            record.layers = layers
+        record.pid = os.getpid()
+        record.updated = time.time()
+        record.sequence += 1
+
+    def read(self):
+        """
+        Read the status.
+
+        Returns:
+            dict: The state, current layer, number of layers, pid of the print process and time of the last update.
+        """
+        record = self.record
+        while True:
+            sequence = record.sequence
+            if sequence & 1:
+                continue
+            status = {
+                'state': STATES[record.state],
+                'layer': record.layer,
+                'layers': record.layers,
+                'pid': record.pid,
+                'updated': record.updated
+            }
+            if record.sequence == sequence:
+                return status
+
+
+def realtime_main(conn, record, cpu, priority):
+    """
+    Entry point of the print process: runs the limit switch observer, the manager and the print loop
+    as threads and feeds them from the pipe until the main process closes it. Every change of the stop
+    signal (stops of the limit switch or the print loop, clears after leveling or a start) is sent back,
+    so the stop signal of the main process follows the one of the print process.
+
+    Parameters:
+        conn (multiprocessing.connection.Connection): The child end of the command pipe.
+        record (StatusRecord): The shared status.
+        cpu (int): The CPU core to pin the process to, -1 to keep the affinity.
+        priority (int): The SCHED_FIFO priority, 0 to keep the scheduling policy.
+    """
+    from lib.limit import LimitSwitch
+    from lib.print import PrintLoop
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(settings_dict['system']['paths']['logging'], "application.log")),
+            logging.StreamHandler()
+        ]
+    )
+    configure_realtime(cpu, priority)
+
+    status = RealtimeStatus(record)
+    status.publish(STATE_IDLE, 0, 0)
+
+    tm = ThreadManager()
+    lock = threading.Lock()
+
+    def send(kind, payload=None):
+        try:
+            with lock:
+                conn.send((kind, payload))
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not send '{kind}' to the main process. Reason: {e}")
+
+    tm.stop_signal.on_set(lambda: send('stop', tm.stop_signal.reason))
+    tm.stop_signal.on_clear(lambda: send('clear'))
+    tm.register("limit", LimitSwitch)
+    tm.register("manager", Manager)
+    tm.register("printer", PrintLoop, status=status)
+    for thread in tm.threads.values():
+        thread.daemon = True
+    tm.start()
+
+    while True:
+        try:
+            kind, payload = conn.recv()
+        except (EOFError, OSError):
+            tm.stop()
+            break
+        if kind == 'stop':
+            if not tm.stop_signal.is_set():
+                tm.stop_signal.set(payload)
+        elif kind == 'job':
+            tm.queues['print'].put(payload)
+        elif kind == 'cmd':
+            tm.queues['cmd'].put(payload)
+
+
+class RealtimeBridge(Manager):
+    """
+    Manager of the main process if the print process is enabled. Starts the print process, forwards the jobs,
+    the start and level commands and every stop to it and handles the other commands itself. The stop signal
+    follows the stops and clears of the print process.
+    """
+
+    def __init__(self, queues, stop_signal, status=None):
+        """
+        Initialize the RealtimeBridge instance, start the print process and handle the commands.
+
+        Parameters:
+            queues (dict): The queues of the main process.
+            stop_signal (StopSignal): The stop signal of the main process.
+            status (RealtimeStatus, optional): The status the print process publishes to, a new one if None.
+        """
+        self.queues = queues
+        self.stopped = stop_signal
+        config = settings_dict['system']['realtime']
+        context = multiprocessing.get_context('spawn')
+
+        self.status = status if status is not None else RealtimeStatus()
+        self.__lock = threading.Lock()
+        self.__origin = threading.local()  # set while handling a stop of the print process, which is not sent back
+        self.__conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=realtime_main,
+            name="printer",
+            args=(child_conn, self.status.record, config['cpu'], config['priority']),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        logger.info(f"Started print process (pid {self.process.pid})")
+
+        # stops are forwarded right away from the thread setting the signal (API, websockets, manager)
+        self.stopped.on_set(self.forward_stop)
+        threading.Thread(target=self.forward_jobs, name="bridge", daemon=True).start()
+        threading.Thread(target=self.receive, name="bridge-receive", daemon=True).start()
+        super().__init__(queues, stop_signal)
+
+    def send(self, kind, payload):
+        """
+        Send a message to the print process. If the process is gone, the printer is stopped.
+
+        Parameters:
+            kind (str): 'stop', 'job' or 'cmd'.
+            payload: The stop reason, the serialized job or the command.
+        """
+        try:
+            with self.__lock:
+                self.__conn.send((kind, payload))
+        except (OSError, ValueError) as e:
+            logger.error(f"Print process not reachable (exit code {self.process.exitcode}). Reason: {e}")
+            if kind != 'stop' and not self.stopped.is_set():
+                self.stopped.set('realtime')
+
+    def forward_stop(self):
+        """
+        Forward a stop of the main process to the print process (stop handler).
+        """
+        if not getattr(self.__origin, 'printer', False):
+            self.send('stop', self.stopped.reason)
+
+    def receive(self):
+        """
+        Receive the stops and clears of the print process, blocks until a message arrives. If the print process
+        is gone, the printer is stopped.
+        """
+        while True:
+            try:
+                kind, payload = self.__conn.recv()
+            except (EOFError, OSError) as e:
+                logger.error(f"Print process not reachable (exit code {self.process.exitcode}). Reason: {e}")
+                if not self.stopped.is_set():
+                    self.stopped.set('realtime')
+                return
+            if kind == 'stop' and not self.stopped.is_set():
+                self.__origin.printer = True
+                try:
+                    self.stopped.set(payload)
+                finally:
+                    self.__origin.printer = False
+            elif kind == 'clear':
+                self.stopped.clear()
+
+    def forward_jobs(self):
+        """
+        Forward the jobs of the print queue to the print process, blocks until a job arrives.
+        """
+        while True:
+            self.send('job', self.queues['print'].get())
+
+    def start(self, **kwargs):
+        super().start(**kwargs)
+        self.send('cmd', ["start", kwargs])
+
+    def level(self, **kwargs):
+        # leveling is an explicit request to move, it clears a previous stop
+        self.stopped.clear()
+        self.send('cmd', ["level", kwargs])
@@ -0,0 +1,334 @@
+import logging
+import threading
+import concurrent.futures
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from lib.scheduling import worker_pool
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides a ring of layer frames in shared memory, filled by decoder worker processes.
+The workers open the layer source by its path and decode straight into a slot, the print process
+reads the slot as NumPy view, so no frame is pickled between the processes.
+
+Every slot has a header of int64 values: the state, the layer, the sequence number the slot was
+assigned with, the sequence number of the last completed write and the height and width of the frame.
+Only the print process changes the state of a slot. A worker writes the frame and then its sequence
+number, and skips the slot if it was assigned again in the meantime (e.g. after a restart).
+"""
+
+# Slot states
+SLOT_FREE = 0
+SLOT_WRITING = 1
+SLOT_READY = 2
+SLOT_READING = 3
+
+# Header fields of a slot
+HEADER_STATE = 0
+HEADER_LAYER = 1
+HEADER_SEQUENCE = 2
+HEADER_WRITTEN = 3
+HEADER_HEIGHT = 4
+HEADER_WIDTH = 5
+HEADER_FIELDS = 6
+
+# Rings and layer sources opened by the decoder worker processes (one per ring/job file and process)
+_worker_rings = {}
+_worker_sources = {}
+
+
+class FrameRingError(Exception):
+    """
+    Custom exception for frame ring errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class FrameRing:
+    """
+    Class for a ring of frame slots in shared memory.
+    """
+
+    def __init__(self, slots, frame_size, name=None):
+        """
+        Initialize the FrameRing instance, creating the shared memory or attaching to it.
+
+        Parameters:
+            slots (int): Number of slots.
+            frame_size (int): The size of a slot in bytes (the largest frame).
+            name (str, optional): The name of an existing ring to attach to, a new ring is created if None.
+        """
+        self.slots = slots
+        self.frame_size = frame_size
+        self.owner = name is None
+        header_size = slots * HEADER_FIELDS * 8
+        try:
+            if self.owner:
+                self.memory = shared_memory.SharedMemory(create=True, size=header_size + slots * frame_size)
+            else:
+                self.memory = shared_memory.SharedMemory(name=name)
+        except OSError as e:
+            raise FrameRingError(f"Could not {'create' if self.owner else 'attach'} frame ring. Reason: {e}")
+
+        self.name = self.memory.name
+        self.header = np.ndarray((slots, HEADER_FIELDS), dtype=np.int64, buffer=self.memory.buf)
+        self.frames = np.ndarray((slots, frame_size), dtype=np.uint8, buffer=self.memory.buf, offset=header_size)
+        if self.owner:
+            self.header[:] = 0
+
+    def view(self, slot):
+        """
+        Get the frame of a slot as view (no copy).
+
+        Parameters:
+            slot (int): The slot index.
+
+        Returns:
+            numpy.ndarray: The frame (uint8, height x width).
+        """
+        height, width = self.header[slot, HEADER_HEIGHT], self.header[slot, HEADER_WIDTH]
+        return self.frames[slot, :height * width].reshape(height, width)
+
+    def write(self, slot, sequence, frame):
+        """
+        Copy a frame into a slot, unless the slot was assigned again. Called by the decoder workers.
+
+        Parameters:
+            slot (int): The slot index.
+            sequence (int): The sequence number the slot was assigned with.
+            frame (numpy.ndarray): The frame (uint8, height x width).
+
+        Returns:
+            bool: True if the frame was written.
+
+        Raises:
+            FrameRingError: If the frame does not fit into a slot.
+        """
+        if frame.nbytes > self.frame_size:
+            raise FrameRingError(f"Frame of {frame.nbytes} bytes does not fit into a slot of {self.frame_size} bytes")
+        header = self.header[slot]
+        if header[HEADER_SEQUENCE] != sequence:
+            return False
+        height, width = frame.shape
+        self.frames[slot, :frame.nbytes].reshape(height, width)[:] = frame
+        header[HEADER_HEIGHT] = height
+        header[HEADER_WIDTH] = width
+        header[HEADER_WRITTEN] = sequence
+        return True
+
+    def close(self):
+        """
+        Release the views and the shared memory, which is removed by the ring that created it.
+        """
+        self.header = None
+        self.frames = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # a frame is still in use, the memory is unmapped with its last view
+            pass
+        if self.owner:
+            self.memory.unlink()
+
+
+def _decode_into_ring(ring_name, slots, frame_size, source_class, filepath, layer, slot, sequence):
+    """
+    Decode a layer into a slot of the ring. Runs in a decoder worker process.
+
+    Parameters:
+        ring_name (str): The name of the shared memory of the ring.
+        slots (int): Number of slots of the ring.
+        frame_size (int): The size of a slot in bytes.
+        source_class (type): The class of the layer source.
+        filepath (str): The path to the job file.
+        layer (int): The layer number.
+        slot (int): The slot index.
+        sequence (int): The sequence number the slot was assigned with.
+
+    Returns:
+        bool: True if the frame was written.
+    """
+    ring = _worker_rings.get(ring_name)
+    if ring is None:
+        ring = _worker_rings[ring_name] = FrameRing(slots, frame_size, ring_name)
+    source = _worker_sources.get(filepath)
+    if source is None:
+        source = _worker_sources[filepath] = source_class(filepath)
+    return ring.write(slot, sequence, source.frame(layer))
+
+
+class FrameDecoder:
+    """
+    Class decoding the layers of a job ahead into a frame ring with a pool of worker processes.
+    """
+
+    def __init__(self, source, frame_size):
+        """
+        Initialize the FrameDecoder instance, create the ring and start the worker processes.
+
+        Parameters:
+            source (LayerSource): The layer source (reopened by its path in the workers).
+            frame_size (int): The size of the largest frame in bytes.
+        """
+        prefetch = settings_dict['system']['prefetch']
+        self.source = source
+        self.ring = FrameRing(prefetch['slots'], frame_size)
+        self.executor = worker_pool(prefetch['decoders'])
+
+        self.__condition = threading.Condition()
+        self.__layers = []
+        self.__index = {}
+        self.__position = 0
+        self.__slots = {}  # layer -> slot
+        self.__pending = set()
+        self.__sequence = 0
+        self.__errors = {}
+        self.stats = {'decoded': 0, 'misses': 0}
+
+    def start(self, layers):
+        """
+        Start decoding the given layers in order, as far ahead as there are free slots.
+
+        Parameters:
+            layers (list): The layer numbers in print order.
+        """
+        # slots are only reassigned once their workers are done writing
+        with self.__condition:
+            pending = list(self.__pending)
+        concurrent.futures.wait(pending)
+        with self.__condition:
+            self.ring.header[:, HEADER_STATE] = SLOT_FREE
+            self.ring.header[:, HEADER_SEQUENCE] = -1
+            self.__layers = list(layers)
+            self.__index = {layer: i for i, layer in enumerate(self.__layers)}
+            self.__position = 0
+            self.__slots = {}
+            self.__errors = {}
+            self.stats = {'decoded': 0, 'misses': 0}
+            self.__fill()
+
+    def __fill(self):
+        """
+        Assign the free slots to the next layers and submit their decoding. Needs the lock.
+        """
+        header = self.ring.header
+        for slot in np.flatnonzero(header[:, HEADER_STATE] == SLOT_FREE).tolist():
+            if self.__position >= len(self.__layers):
+                return
+            layer = self.__layers[self.__position]
+            self.__position += 1
+            self.__sequence += 1
+            header[slot, HEADER_STATE] = SLOT_WRITING
+            header[slot, HEADER_LAYER] = layer
+            header[slot, HEADER_SEQUENCE] = self.__sequence
+            self.__slots[layer] = slot
+            future = self.executor.submit(
+                _decode_into_ring, self.ring.name, self.ring.slots, self.ring.frame_size,
+                type(self.source), self.source.filepath, layer, slot, self.__sequence
+            )
+            self.__pending.add(future)
+            future.add_done_callback(lambda f, slot=slot, layer=layer, sequence=self.__sequence: self.__done(f, slot, layer, sequence))
+
+    def __done(self, future, slot, layer, sequence):
+        """
+        Mark a slot as ready when its worker completed (called in a thread of the executor).
+        """
+        with self.__condition:
+            self.__pending.discard(future)
+            header = self.ring.header
+            if header is None or header[slot, HEADER_SEQUENCE] != sequence:
+                return
+            if self.__slots.get(layer) != slot:
+                # the layer was passed while it was decoded
+                header[slot, HEADER_STATE] = SLOT_FREE
+                self.__fill()
+                return
+            try:
+                future.result()
+                header[slot, HEADER_STATE] = SLOT_READY
+                self.stats['decoded'] += 1
+            except Exception as e:
+                self.__errors[layer] = e
+                header[slot, HEADER_STATE] = SLOT_READY
+            self.__condition.notify_all()
+
+    def frame(self, layer):
+        """
+        Get the frame of a layer. Blocks until its worker completed, layers which are not in the
+        ring are decoded in this process (miss). The slot stays reserved until released.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            tuple: The slot (None on a miss) and the frame (uint8, height x width).
+
+        Raises:
+            LayerSourceError: If the layer cannot be decoded.
+        """
+        with self.__condition:
+            self.__drop_before(layer)
+            slot = self.__slots.get(layer)
+            if slot is not None:
+                header = self.ring.header
+                while header[slot, HEADER_STATE] == SLOT_WRITING:
+                    self.__condition.wait()
+                del self.__slots[layer]
+                header[slot, HEADER_STATE] = SLOT_READING
+                error = self.__errors.pop(layer, None)
+                if error is None and header[slot, HEADER_WRITTEN] == header[slot, HEADER_SEQUENCE]:
+                    return slot, self.ring.view(slot)
+                self.release(slot)
+            self.stats['misses'] += 1
+
+        # the layer was skipped or its worker failed, decode it here (raises the error of the layer)
+        return None, self.source.frame(layer)
+
+    def __drop_before(self, layer):
+        """
+        Free the slots of the layers before the given layer, they are not needed anymore. Slots which are
+        still written are freed by their completion. Needs the lock.
+
+        Parameters:
+            layer (int): The layer number.
+        """
+        index = self.__index.get(layer)
+        if index is None:
+            return
+        header = self.ring.header
+        for passed in [passed for passed in self.__slots if self.__index[passed] < index]:
+            slot = self.__slots.pop(passed)
+            self.__errors.pop(passed, None)
+            if header[slot, HEADER_STATE] == SLOT_READY:
+                header[slot, HEADER_STATE] = SLOT_FREE
+        self.__fill()
+
+    def release(self, slot):
+        """
+        Free a slot and assign it to the next layer.
+
+        Parameters:
+            slot (int): The slot index, None is ignored.
+        """
+        if slot is None:
+            return
+        with self.__condition:
+            if self.ring.header is None:
+                return
+            self.ring.header[slot, HEADER_STATE] = SLOT_FREE
+            self.__fill()
+
+    def close(self):
+        """
+        Stop the worker processes and remove the ring.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self.__condition:
+            self.ring.close()
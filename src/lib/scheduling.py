@@ -0,0 +1,85 @@
+import os
+import logging
+import concurrent.futures
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides the CPU affinity and scheduling policy of the print process. The print process is
+pinned to a CPU core and raised to SCHED_FIFO, which every thread and process started by it inherits.
+Worker processes and background threads which only decode or compile layers give both up again, so they
+neither compete with the print loop on its core nor preempt the rest of the system.
+"""
+
+# CPU cores of the process before it was pinned, None if it was not pinned
+_affinity = None
+
+
+def configure_realtime(cpu, priority):
+    """
+    Pin the calling thread to a CPU core and raise it to SCHED_FIFO. Threads started afterwards inherit both.
+
+    Parameters:
+        cpu (int): The CPU core, -1 to keep the affinity.
+        priority (int): The SCHED_FIFO priority (1-99), 0 to keep the scheduling policy.
+    """
+    global _affinity
+
+    if cpu >= 0 and hasattr(os, 'sched_setaffinity'):
+        try:
+            affinity = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, {cpu})
+            _affinity = affinity
+            logger.info(f"Print process pinned to CPU {cpu}")
+        except OSError as e:
+            logger.warning(f"Could not pin the print process to CPU {cpu}. Reason: {e}")
+
+    if priority > 0 and hasattr(os, 'sched_setscheduler'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            logger.info(f"Print process running with SCHED_FIFO priority {priority}")
+        except (OSError, PermissionError) as e:
+            logger.warning(f"Could not set SCHED_FIFO priority {priority} for the print process. Reason: {e}")
+
+
+def release_realtime(affinity=None):
+    """
+    Undo configure_realtime() for the calling thread: restore the CPU cores it ran on before it was pinned
+    and return to the default scheduler. Used as initializer of worker processes.
+
+    Parameters:
+        affinity (set, optional): The CPU cores to run on, defaults to the cores before pinning
+            (known in this process only, worker processes get them as argument).
+    """
+    affinity = affinity or _affinity
+    if affinity and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, affinity)
+        except OSError as e:
+            logger.warning(f"Could not restore the CPU affinity {sorted(affinity)}. Reason: {e}")
+
+    if hasattr(os, 'sched_setscheduler'):
+        try:
+            if os.sched_getscheduler(0) != os.SCHED_OTHER:
+                os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        except OSError as e:
+            logger.warning(f"Could not return to the default scheduler. Reason: {e}")
+
+
+def worker_pool(max_workers=None):
+    """
+    Create a pool of worker processes which run on all CPU cores with the default scheduler,
+    even if created by the pinned print process.
+
+    Parameters:
+        max_workers (int, optional): The number of worker processes, defaults to one per CPU.
+
+    Returns:
+        concurrent.futures.ProcessPoolExecutor: The pool.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=release_realtime,
+        initargs=(_affinity,)
+    )
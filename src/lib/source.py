@@ -0,0 +1,287 @@
+import io
+import os
+import re
+import mmap
+import zlib
+import struct
+import zipfile
+import logging
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides layer sources, which serve the layer images of a print job on demand.
+The ZIP source indexes the central directory of the uploaded archive once and reads the layers
+straight from the memory-mapped archive, without extracting anything to disk.
+"""
+
+# Local file header: signature, version, flags, compression, time, date, crc, sizes, name and extra length
+LOCAL_FILE_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_FILE_SIGNATURE = b'PK\x03\x04'
+
+
+class LayerSourceError(Exception):
+    """
+    Custom exception for layer source errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class LayerSource:
+    """
+    Base class for layer sources. Maps layer numbers to the encoded layer images.
+    """
+
+    def __init__(self, filepath):
+        """
+        Initialize the LayerSource instance.
+
+        Parameters:
+            filepath (str): The path to the job file.
+        """
+        self.filepath = filepath
+        self.layers = {}
+        self.width = None  # native resolution, if known without decoding a layer
+        self.height = None
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __contains__(self, layer):
+        return layer in self.layers
+
+    def __iter__(self):
+        return iter(sorted(self.layers))
+
+    def read(self, layer):
+        """
+        Read the encoded image of a layer.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The encoded image (bytes or memoryview).
+        """
+        raise NotImplementedError
+
+    def payload(self, layer):
+        """
+        Get the layer as stored in the job file, without decoding it (e.g. to hash its content).
+        Equal payloads decode to equal layers.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The stored layer (bytes, memoryview or NumPy array).
+        """
+        return self.read(layer)
+
+    def read_head(self, layer, size):
+        """
+        Read the beginning of the encoded image of a layer (e.g. to check its header).
+
+        Parameters:
+            layer (int): The layer number.
+            size (int): The number of bytes to read.
+
+        Returns:
+            bytes: Up to size bytes of the encoded image.
+        """
+        return self.read(layer)[:size]
+
+    def open(self, layer):
+        """
+        Open the encoded image of a layer as file object (e.g. for PIL or pygame).
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            io.BytesIO: The encoded image.
+        """
+        return io.BytesIO(self.read(layer))
+
+    def frame(self, layer):
+        """
+        Decode a layer into a grayscale buffer at native resolution.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            numpy.ndarray: The layer (uint8, height x width).
+
+        Raises:
+            LayerSourceError: If the image cannot be decoded.
+        """
+        try:
+            with Image.open(self.open(layer)) as image:
+                return np.asarray(image.convert('L'))
+        except (OSError, UnidentifiedImageError) as e:
+            raise LayerSourceError(f"Could not decode layer {layer}. Reason: {e}")
+
+    def close(self):
+        """
+        Release the resources of the source.
+        """
+        pass
+
+
+class ZipLayerSource(LayerSource):
+    """
+    Layer source reading numbered PNG layers from a memory-mapped ZIP archive.
+    """
+
+    def __init__(self, filepath):
+        """
+        Initialize the ZipLayerSource instance, map the archive and index its central directory.
+
+        Parameters:
+            filepath (str): The path to the ZIP file.
+
+        Raises:
+            LayerSourceError: If the archive cannot be read or the layers are not numbered consecutively.
+        """
+        super().__init__(filepath)
+        self.members = {}
+        self.__file = None
+        self.__map = None
+        self.__offsets = {}
+
+        try:
+            self.__file = open(self.filepath, 'rb')
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            with zipfile.ZipFile(self.__file, 'r') as zip_ref:
+                self.members = {info.filename: info for info in zip_ref.infolist() if not info.is_dir()}
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            self.close()
+            raise LayerSourceError(f"Could not read zip '{self.filepath}'. Reason: {e}")
+
+        self.index()
+
+    def index(self):
+        """
+        Map the layer numbers to the PNG members of the archive.
+
+        Raises:
+            LayerSourceError: If the layers are not numbered consecutively.
+        """
+        numbered_files = []
+        for name in self.members:
+            if not name.lower().endswith('.png'):
+                continue
+            # the last number of the name, SL1 files prefix it with the job name (e.g. part2_00001.png)
+            numbers = re.findall(r'\d+', os.path.basename(name))
+            if numbers:
+                numbered_files.append((int(numbers[-1]), name))
+
+        numbered_files.sort()
+        numbers = [num for num, _ in numbered_files]
+        if any(a - b != 1 for a, b in zip(numbers[1:], numbers[:-1])):
+            raise LayerSourceError("Files not numbered consecutively!")
+
+        self.layers = {num: name for num, name in numbered_files}
+        logger.debug(f"Indexed {len(self.layers)} layers in '{self.filepath}'")
+
+    def member(self, name, size=-1, inflate=True):
+        """
+        Read a member of the archive.
+
+        Parameters:
+            name (str): The name of the member.
+            size (int, optional): Read only the first size bytes of the member.
+            inflate (bool, optional): Inflate a compressed member, otherwise its compressed data is returned.
+
+        Returns:
+            bytes: The content of the member (a zero-copy memoryview for uncompressed members).
+
+        Raises:
+            LayerSourceError: If the member does not exist or cannot be read.
+        """
+        info = self.members.get(name)
+        if info is None:
+            raise LayerSourceError(f"Member '{name}' not found in '{self.filepath}'")
+
+        offset = self.__offsets.get(name)
+        if offset is None:
+            header = LOCAL_FILE_HEADER.unpack_from(self.__map, info.header_offset)
+            if header[0] != LOCAL_FILE_SIGNATURE:
+                raise LayerSourceError(f"Invalid local file header of member '{name}'")
+            offset = info.header_offset + LOCAL_FILE_HEADER.size + header[9] + header[10]
+            self.__offsets[name] = offset
+
+        data = memoryview(self.__map)[offset:offset + info.compress_size]
+        if info.compress_type == zipfile.ZIP_STORED or not inflate:
+            return data if size < 0 else data[:size]
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            try:
+                return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, max(size, 0))
+            except zlib.error as e:
+                raise LayerSourceError(f"Could not inflate member '{name}'. Reason: {e}")
+        raise LayerSourceError(f"Unsupported compression of member '{name}'")
+
+    def read(self, layer):
+        """
+        Read the PNG image of a layer.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            bytes: The PNG image.
+        """
+        if layer not in self.layers:
+            raise LayerSourceError(f"Layer {layer} not found in '{self.filepath}'")
+        return self.member(self.layers[layer])
+
+    def payload(self, layer):
+        """
+        Get the PNG image of a layer as stored in the archive, compressed members are not inflated.
+
+        Parameters:
+            layer (int): The layer number.
+
+        Returns:
+            memoryview: The stored member (zero-copy view into the archive).
+        """
+        if layer not in self.layers:
+            raise LayerSourceError(f"Layer {layer} not found in '{self.filepath}'")
+        return self.member(self.layers[layer], inflate=False)
+
+    def read_head(self, layer, size):
+        """
+        Read the beginning of the PNG image of a layer, inflating only what is needed.
+
+        Parameters:
+            layer (int): The layer number.
+            size (int): The number of bytes to read.
+
+        Returns:
+            bytes: Up to size bytes of the PNG image.
+        """
+        if layer not in self.layers:
+            raise LayerSourceError(f"Layer {layer} not found in '{self.filepath}'")
+        return self.member(self.layers[layer], size)
+
+    def close(self):
+        """
+        Unmap and close the archive.
+        """
+        if self.__map is not None:
+            try:
+                self.__map.close()
+            except BufferError:
+                # a memoryview of a layer is still in use, the map is released with it
+                pass
+            self.__map = None
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
@@ -1,8 +1,14 @@
 import time
-from datetime import datetime, timedelta
-import RPi.GPIO as GPIO
+from array import array
+from datetime import datetime
 import logging
 from lib.component import Component
+from lib.gpio import gpio_dict
+from lib.limit import limit_latch
+from lib.motion import MotionPlanner, MotionPlannerError
+from lib.position import motor_position
+from lib.timing import StepExecutor
+from lib.waveform import build_waveform, create_waveform_backend, pin_mask
 from settings import system_dict
 from settings import settings_dict
 
@@ -20,34 +26,82 @@ class StepperDriverError(Exception):
 class StepperDriver:
     """Class for managing the stepper motor driver in a 3D printing system."""
 
-    def __init__(self, stopped_event):
-        """Initialize the StepperDriver instance with default values."""
+    def __init__(self, stopped_event, waveform=None):
+        """Initialize the StepperDriver instance with default values.
+
+        Parameters:
+            stopped_event (threading.Event): Event stopping a move when set.
+            waveform (WaveformBackend, optional): The backend playing the moves, defaults to the
+                backend configured in machine.timing.waveform (None steps inline in the calling thread).
+        """
         self.__machine_stepping = settings_dict['machine']['stepping']
         self.__machine_accuracy_z = settings_dict['machine']['accuracy']['z']
         self.__machine_dimension_z = settings_dict['machine']['dimensions']['z']
-        self.__acceleration_min_delay = settings_dict['print']['acceleration']['min_delay']
-        self.__acceleration_max_delay = settings_dict['print']['acceleration']['max_delay']
-
+        self.__default_speed = settings_dict['print']['layer']['default']['speed']
+        self.__limit_verify = settings_dict['machine']['timing']['limit_verify']
+        self.__homing = settings_dict['machine']['homing']
+        self.__limit_countdown = 0
+        self.__limit_interval = 0  # ns between reads of the level, 0 to count the calls
+        self.__limit_next = 0
+
+        self.planner = MotionPlanner()
+        self.executor = StepExecutor()
+
+        # the pins are bound once, the step loop calls the handles directly
+        self.__step_pin = Component.handle('motor_stepping')
+        self.__direction_pin = Component.handle('motor_direction')
+        self.__disabled_pin = Component.handle('motor_disabled')
+        step_pin = gpio_dict['motor_stepping']
+        self.__step_mask = pin_mask([step_pin]) if step_pin else 0
+        self.__own_waveform = not waveform
+        self.waveform = waveform if waveform else create_waveform_backend({step_pin: self.__step_pin} if step_pin else {})
+        self.direction = 1  # +1 when moving up (CW), -1 when moving down (CCW)
+        self.enabled = False
         self.stopped = stopped_event
         self.enable()
 
     def enable(self):
         """Enable the stepper motor."""
         logger.debug(f"Enabling Stepper Motor")
-        Component.off('motor_disabled')
+        self.__disabled_pin.clear()
+        self.enabled = True
 
     def disable(self):
         """Disable the stepper motor."""
         logger.debug(f"Disabling Stepper Motor")
-        Component.on('motor_disabled')
+        self.__disabled_pin.set()
+        self.enabled = False
+
+    def close(self):
+        """Disable the stepper motor and release the waveform backend created by the driver
+        (e.g. the connection to the pigpio daemon). The driver cannot move anymore.
+        """
+        self.disable()
+        if self.waveform is not None and self.__own_waveform:
+            self.waveform.close()
 
     def end_stop_triggered(self):
-        """Check if the end-stop limit switch is triggered.
+        """Check if the end-stop limit switch is triggered. Called before every step of a down move,
+        or periodically while a waveform backend plays the move.
+
+        Reads the latch set by the limit switch interrupt. The GPIO level is only read every
+        limit_verify steps, in case an edge was missed. Waveform backends do not call this per step,
+        their reads are timed by the duration of limit_verify steps at the top speed of the move.
 
         Returns:
             bool: True if triggered, False otherwise.
         """
-        if Component.is_set('limit_switch'):
+        if self.__limit_interval:
+            now = time.perf_counter_ns()
+            if now >= self.__limit_next:
+                self.__limit_next = now + self.__limit_interval
+                limit_latch.refresh()
+        elif self.__limit_verify:
+            self.__limit_countdown -= 1
+            if self.__limit_countdown <= 0:
+                self.__limit_countdown = self.__limit_verify
+                limit_latch.refresh()
+        if limit_latch.triggered:
             logger.debug(f"End-Stop triggered")
             return True
         return False
@@ -63,41 +117,72 @@ class StepperDriver:
         """
         if direction == "CW":
             logger.debug(f"Setting direction to CW (clock-wise)")
-            Component.on('motor_direction')
+            self.__direction_pin.set()
+            self.direction = 1
         elif direction == "CCW":
             logger.debug(f"Setting direction to CCW (counter-clock-wise)")
-            Component.off('motor_direction')
+            self.__direction_pin.clear()
+            self.direction = -1
         else:
             raise ValueError("Direction must be either 'CW' or 'CCW'")
 
-    def move_with_accel(self, steps, accel_rate=0.95):
-        """Move the stepper motor with acceleration.
+    def move_with_accel(self, steps, speed=None):
+        """Move the stepper motor with a constant-acceleration (trapezoidal) profile.
 
         Parameters:
             steps (int): Number of steps to move.
-            accel_rate (float): Acceleration rate, defaults to 0.95.
+            speed (float, optional): Target speed in mm/s, defaults to the default layer speed.
+
+        Raises:
+            StepperDriverError: If the move cannot be planned.
+        """
+        speed = speed if speed else self.__default_speed
+        logger.debug(f"Moving motor for {steps} steps with a target speed of {speed} mm/s")
+
+        try:
+            delays = self.planner.plan(steps, speed)
+        except MotionPlannerError as e:
+            raise StepperDriverError(f"Could not plan move. Reason: {e}")
+
+        self.execute(delays)
+
+    def execute(self, delays):
+        """Execute a step-delay table, stopping early if the printer is stopped or, when moving down,
+        the end-stop gets triggered. The position is journaled at the start and the end of the move only.
+
+        Parameters:
+            delays (array): One delay per step in ns.
+
+        Returns:
+            int: Number of steps performed.
         """
-        logger.debug(f"Moving motor for {steps} steps with an acceleration of {accel_rate}")
-        delay = self.__acceleration_max_delay
-        half_steps = steps // 2
-
-        # Acceleration
-        for _ in range(half_steps):
-            if self.end_stop_triggered():
-                break
-            self.step(1, delay)
-            delay *= accel_rate
-            if delay < self.__acceleration_min_delay:
-                delay = self.__acceleration_min_delay
-
-        # Deceleration
-        for _ in range(steps - half_steps):
-            if self.end_stop_triggered():
-                break
-            self.step(1, delay)
-            delay /= accel_rate
-            if delay > self.__acceleration_max_delay:
-                delay = self.__acceleration_max_delay
+        # the limit switch is at the bottom of the z-axis, it does not block moving away from it
+        if self.direction < 0:
+            limit_latch.refresh()
+            self.__limit_countdown = self.__limit_verify
+            self.__limit_interval = self.__limit_verify * min(delays) if self.waveform is not None and len(delays) else 0
+            self.__limit_next = time.perf_counter_ns() + self.__limit_interval
+            abort = lambda: self.stopped.is_set() or self.end_stop_triggered()
+        else:
+            abort = self.stopped.is_set
+
+        motor_position.begin()
+        try:
+            if self.waveform is None:
+                steps = self.executor.execute(
+                    delays,
+                    self.__step_pin.set,
+                    self.__step_pin.clear,
+                    abort
+                )
+            else:
+                # fire-and-wait, the waveform plays without this thread (two pulses per step)
+                self.waveform.send(build_waveform(delays, self.__step_mask), abort)
+                steps = (self.waveform.wait() + 1) // 2
+            motor_position.move(steps * self.direction)
+        finally:
+            motor_position.end()
+        return steps
 
     def step(self, steps, delay=0.001):
         """Perform a number of steps with the stepper motor.
@@ -106,45 +191,63 @@ class StepperDriver:
             steps (int): Number of steps to perform.
             delay (float): Delay between steps in seconds, defaults to 0.001s.
 
-        Raises:
-            StepperDriverError: If the printer is not leveled or calibrated.
+        Returns:
+            int: Number of steps performed.
+        """
+        return self.execute(array('q', [round(delay * 1e9)]) * steps)
+
+    @property
+    def jitter(self):
+        """Get the step timing jitter statistics of the last move.
+
+        Returns:
+            JitterStats: The statistics, or None if no move was executed yet or the backend does not record them.
         """
-        for _ in range(steps):
-            Component.on('motor_stepping')
-            time.sleep(delay / 2)
-            Component.off('motor_stepping')
-            time.sleep(delay / 2)
-            system_dict['motor_position'] += 1
-
-    def up(self, steps):
+        if self.waveform is not None:
+            return self.waveform.stats
+        return self.executor.stats
+
+    def up(self, steps, speed=None):
         """Move the stepper motor up by a number of steps.
 
         Parameters:
             steps (int): Number of steps to move up.
+            speed (float, optional): Target speed in mm/s.
         """
         logger.debug(f"Moving motor UP for {steps} steps")
         self.enable()
         self.set_direction('CW')
-        self.move_with_accel(steps)
+        self.move_with_accel(steps, speed)
         self.disable()
 
-    def down(self, steps):
+    def down(self, steps, speed=None):
         """Move the stepper motor down by a number of steps.
 
         Parameters:
             steps (int): Number of steps to move down.
+            speed (float, optional): Target speed in mm/s.
         """
         logger.debug(f"Moving motor DOWN for {steps} steps")
         self.enable()
         self.set_direction('CCW')
-        self.move_with_accel(steps)
+        self.move_with_accel(steps, speed)
         self.disable()
 
-    def goto(self, pos):
+    @property
+    def position(self):
+        """Get the current motor position.
+
+        Returns:
+            int: The position in steps above the printing bed.
+        """
+        return motor_position.position
+
+    def goto(self, pos, speed=None):
         """Move the stepper motor to a specific position.
 
         Parameters:
             pos (int): The position to move to.
+            speed (float, optional): Target speed in mm/s.
 
         Returns:
             bool: True if the move is successful, False otherwise.
@@ -152,25 +255,80 @@ class StepperDriver:
         Raises:
             StepperDriverError: If the printer is not leveled or motor position is not set.
         """
-        delta = system_dict['motor_position'] - pos
+        delta = pos - motor_position.position
         logger.debug(f"Moving motor to Position {pos} (delta of {delta} steps)")
 
         if delta > 0:
-            self.up(delta)
+            self.up(delta, speed)
             return True
         elif delta < 0:
-            self.down(delta)
+            self.down(-delta, speed)
             return True
         else:
             return True
 
-    def level(self):
-        """Level the stepper motor to the printing bed (position 0)."""
-        logger.debug(f"Leveling to 0 (printing bed)")
-        self.down(10000000000) # we move down until the limit switch gets triggered.
-        system_dict['motor_position'] = 0
-        system_dict['is_calibrated'] = True
-        system_dict['calibration_time'] = datetime.now().time()
+    def approach(self, steps, speed):
+        """Move down until the limit switch gets triggered, at most a number of steps.
+
+        Parameters:
+            steps (int): Maximal number of steps to move.
+            speed (float): Target speed in mm/s.
+
+        Returns:
+            int: Number of steps performed.
+
+        Raises:
+            StepperDriverError: If the approach is interrupted by a stop request or the limit switch is not reached.
+        """
+        self.enable()
+        self.set_direction('CCW')
+        try:
+            moved = self.execute(self.planner.plan(steps, speed))
+        finally:
+            self.disable()
+
+        if self.stopped.is_set() and getattr(self.stopped, 'reason', None) != 'limit_switch':
+            raise StepperDriverError("Leveling was interrupted by a stop request")
+        if not (limit_latch.triggered or self.stopped.is_set()):
+            raise StepperDriverError(f"Limit switch not reached within {steps} steps")
 
         # the limit observer thread is setting the stopped event if we reach the plate. Reset this.
-        self.stopped.clear()
\ No newline at end of file
+        self.stopped.clear()
+        return moved
+
+    def level(self):
+        """Level the stepper motor to the printing bed (position 0).
+
+        Approaches the limit switch fast, backs off and approaches it again slowly for a precise zero.
+        The fast approach travels at most the whole z-axis, the slow one at most twice the back-off distance.
+
+        Returns:
+            float: The homing time in seconds.
+
+        Raises:
+            StepperDriverError: If the leveling is interrupted by a stop request or the limit switch is not reached.
+        """
+        logger.debug(f"Leveling to 0 (printing bed)")
+        start = time.perf_counter()
+        backoff = max(1, self.planner.steps(self.__homing['backoff']))
+
+        # a trip latched before (e.g. by a crash during a print) is resolved by the homing
+        limit_latch.clear()
+        self.approach(self.planner.steps(self.__machine_dimension_z), self.__homing['fast_speed'])
+        self.up(backoff, self.__homing['fast_speed'])
+        limit_latch.clear()
+        if limit_latch.refresh():
+            raise StepperDriverError("Limit switch still triggered after backing off")
+        self.approach(2 * backoff, self.__homing['slow_speed'])
+
+        # the switch is at the zero position, it is released by the next move up
+        limit_latch.clear()
+        motor_position.set(0)
+        homing_time = time.perf_counter() - start
+        system_dict.update(
+            is_calibrated=True,
+            calibration_time=datetime.now().isoformat(),
+            homing_time=round(homing_time, 3)
+        )
+        logger.info(f"Leveled in {homing_time:.2f}s")
+        return homing_time
@@ -1,5 +1,148 @@
+import time
+import logging
 import threading
 import queue
+from collections import deque
+
+from lib.timing import percentile
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class StopSignal(threading.Event):
+    """Event shared by all threads to stop the printer.
+
+    Setting the signal runs the registered handlers (e.g. UV off, motor disabled) right away in the
+    thread setting it, so the hardware is safe without waiting for the print thread to notice.
+    The time of the stop and of the completed handlers is recorded to measure the stop latency.
+    """
+
+    def __init__(self):
+        """Initialize the StopSignal instance without handlers."""
+        super().__init__()
+        self.__handlers = []
+        self.__clear_handlers = []
+        self.__cleared = threading.Condition(threading.Lock())
+        self.reason = None
+        self.set_at = None  # perf_counter_ns() of the last stop
+        self.handled_at = None  # perf_counter_ns() at which the handlers of the last stop completed
+
+    def on_set(self, handler):
+        """Register a handler to run when the signal is set.
+
+        Parameters:
+            handler (callable): The function to call (without arguments).
+        """
+        self.__handlers.append(handler)
+
+    def on_clear(self, handler):
+        """Register a handler to run when the signal is cleared after being set.
+
+        Parameters:
+            handler (callable): The function to call (without arguments).
+        """
+        self.__clear_handlers.append(handler)
+
+    def set(self, reason=None):
+        """Set the signal and run the handlers.
+
+        Parameters:
+            reason (str, optional): The reason of the stop (e.g. 'limit_switch').
+        """
+        self.set_at = time.perf_counter_ns()
+        self.reason = reason
+        super().set()
+        for handler in self.__handlers:
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Stop handler failed. Reason: {e}")
+        self.handled_at = time.perf_counter_ns()
+        logger.info(f"Stop signal set ({reason}), handlers completed in {(self.handled_at - self.set_at) / 1e6:.3f}ms")
+
+    def clear(self):
+        """Clear the signal, wake up the threads waiting for it to be cleared and run the clear handlers."""
+        with self.__cleared:
+            was_set = self.is_set()
+            self.reason = None
+            super().clear()
+            self.__cleared.notify_all()
+        if not was_set:
+            return
+        for handler in self.__clear_handlers:
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Clear handler failed. Reason: {e}")
+
+    def wait_clear(self, timeout=None):
+        """Block until the signal is cleared, without polling.
+
+        Parameters:
+            timeout (float, optional): The maximal time to wait in seconds, waits forever if None.
+
+        Returns:
+            bool: True if the signal is cleared, False if the timeout expired.
+        """
+        with self.__cleared:
+            return self.__cleared.wait_for(lambda: not self.is_set(), timeout)
+
+    def latency(self, now=None):
+        """Get the time since the last stop.
+
+        Parameters:
+            now (int, optional): The perf_counter_ns() value to measure to, defaults to now.
+
+        Returns:
+            int: The time in ns, 0 if the signal was never set.
+        """
+        if self.set_at is None:
+            return 0
+        return (now or time.perf_counter_ns()) - self.set_at
+
+
+class TimedQueue(queue.Queue):
+    """Queue recording the time every item waited between put() and get().
+
+    The waiting time is the latency from a command (or job) being sent to the thread acting on it.
+    """
+
+    def __init__(self, maxsize=0, history=1000):
+        """Initialize the TimedQueue instance.
+
+        Parameters:
+            maxsize (int, optional): The maximal number of items, 0 for no limit.
+            history (int, optional): Number of latencies kept for the statistics.
+        """
+        super().__init__(maxsize)
+        self.latencies = deque(maxlen=history)
+        self.last_latency = None
+
+    def _put(self, item):
+        super()._put((time.perf_counter_ns(), item))
+
+    def _get(self):
+        put_at, item = super()._get()
+        self.last_latency = time.perf_counter_ns() - put_at
+        self.latencies.append(self.last_latency)
+        return item
+
+    @property
+    def stats(self):
+        """Get the statistics of the recorded latencies.
+
+        Returns:
+            dict: Number of items and the p50, p99 and max latency in ns.
+        """
+        with self.mutex:
+            values = sorted(self.latencies)
+        return {
+            'items': len(values),
+            'p50': percentile(values, 0.50),
+            'p99': percentile(values, 0.99),
+            'max': values[-1] if values else 0
+        }
 
 
 class ThreadManager:
@@ -10,10 +153,11 @@ class ThreadManager:
         self.queues = {}  # Dictionary holding all the queues
         self.threads = {}  # Dictionary to store threads
         self.stop_events = {}  # Dictionary to store stop events for threads
+        self.stop_signal = StopSignal()  # Stop signal shared by all threads
 
-        # Initialize print and system queues
-        self.queues['print'] = queue.Queue()
-        self.queues['cmd'] = queue.Queue()
+        # Initialize print and system queues, the threads block on them until an item arrives
+        self.queues['print'] = TimedQueue()
+        self.queues['cmd'] = TimedQueue()
 
     def register(self, name, func, **kwargs):
         """Register a new thread with its function, name, and optional arguments.
@@ -23,8 +167,8 @@ class ThreadManager:
             func (callable): The function that the thread will execute.
             **kwargs: Optional keyword arguments to pass to the thread function.
         """
-        # Register stop event for the thread
-        self.stop_events[name] = threading.Event()
+        # All threads share the stop signal, so a stop from any thread reaches the print loop
+        self.stop_events[name] = self.stop_signal
 
         # Register the thread
         self.threads[name] = threading.Thread(
@@ -41,6 +185,5 @@ class ThreadManager:
 
     def stop(self):
         """Gracefully stop all registered threads."""
-        # Signal each thread to stop by setting their respective stop events
-        for key, event in self.stop_events.items():
-            event.set()
+        # Signal all threads to stop through the shared stop signal
+        self.stop_signal.set('shutdown')
@@ -0,0 +1,168 @@
+import time
+import logging
+from array import array
+
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides deadline-based timing for step pulses.
+Every edge is scheduled against an absolute perf_counter_ns() deadline, so sleep overshoot
+does not accumulate over a move, and the actual edge times are recorded for jitter statistics.
+"""
+
+
+def wait_until(deadline_ns, spin_threshold_ns, event=None):
+    """
+    Wait until an absolute deadline with a hybrid sleep-then-spin strategy.
+
+    Sleeps while the deadline is further away than the spin threshold and busy-waits the rest.
+    If an event is given, the sleep is a wait on the event and ends early when it is set.
+
+    Parameters:
+        deadline_ns (int): The deadline as perf_counter_ns() value.
+        spin_threshold_ns (int): The remaining time in ns below which we spin instead of sleep.
+        event (threading.Event, optional): An event interrupting the wait (e.g. the stop signal).
+
+    Returns:
+        int: The perf_counter_ns() value at which the wait ended.
+    """
+    now = time.perf_counter_ns()
+    remaining = deadline_ns - now
+    if remaining > spin_threshold_ns:
+        if event is None:
+            time.sleep((remaining - spin_threshold_ns) / 1e9)
+        elif event.wait((remaining - spin_threshold_ns) / 1e9):
+            return time.perf_counter_ns()
+        now = time.perf_counter_ns()
+    while now < deadline_ns:
+        now = time.perf_counter_ns()
+    return now
+
+
+def percentile(sorted_values, fraction):
+    """
+    Get a percentile of already sorted values (nearest-rank).
+
+    Parameters:
+        sorted_values (list): The sorted values.
+        fraction (float): The percentile as fraction (0.5 for p50).
+
+    Returns:
+        The value at the percentile, or 0 if there are no values.
+    """
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class JitterStats:
+    """
+    Class holding the jitter statistics (lateness of the actual edges) of one move.
+    """
+
+    def __init__(self, lateness):
+        """
+        Initialize the JitterStats instance from the lateness of every edge.
+
+        Parameters:
+            lateness (list): Actual minus planned edge time in ns for every edge.
+        """
+        values = sorted(lateness)
+        self.edges = len(values)
+        self.p50 = percentile(values, 0.50)
+        self.p99 = percentile(values, 0.99)
+        self.max = values[-1] if values else 0
+
+    def serialize(self):
+        """
+        Get the statistics as dictionary.
+
+        Returns:
+            dict: Number of edges and the p50, p99 and max lateness in ns.
+        """
+        return {'edges': self.edges, 'p50': self.p50, 'p99': self.p99, 'max': self.max}
+
+    def __repr__(self):
+        return f"JitterStats(edges={self.edges}, p50={self.p50}ns, p99={self.p99}ns, max={self.max}ns)"
+
+
+class StepExecutor:
+    """
+    Class for executing step pulses against absolute deadlines.
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        Initialize the StepExecutor instance and preallocate the edge timestamp buffers.
+
+        Parameters:
+            capacity (int, optional): Number of steps the buffers are preallocated for.
+        """
+        self.__spin_threshold_ns = int(settings_dict['machine']['timing']['spin_threshold'] * 1e9)
+        self.planned = array('q')
+        self.actual = array('q')
+        self.stats = None
+        self.reserve(capacity)
+
+    def reserve(self, steps):
+        """
+        Make sure the edge timestamp buffers can hold a move of the given size (two edges per step).
+
+        Parameters:
+            steps (int): Number of steps.
+        """
+        missing = 2 * steps - len(self.planned)
+        if missing > 0:
+            self.planned.extend(array('q', [0]) * missing)
+            self.actual.extend(array('q', [0]) * missing)
+
+    def execute(self, delays, rising, falling, abort=None):
+        """
+        Execute one step pulse per delay. The rising edge of each step is scheduled at the
+        accumulated delays since the start of the move, the falling edge half a delay later.
+
+        Parameters:
+            delays (array): One step delay per step in ns.
+            rising (callable): Function setting the step pin high.
+            falling (callable): Function setting the step pin low.
+            abort (callable, optional): Function checked before every step, stops the move if True.
+
+        Returns:
+            int: The number of steps performed.
+        """
+        self.reserve(len(delays))
+        planned = self.planned
+        actual = self.actual
+        spin_threshold_ns = self.__spin_threshold_ns
+
+        steps = 0
+        edge = 0
+        deadline = time.perf_counter_ns()
+        for delay in delays:
+            if abort and abort():
+                break
+
+            planned[edge] = deadline
+            actual[edge] = wait_until(deadline, spin_threshold_ns)
+            rising()
+
+            deadline += delay >> 1
+            planned[edge + 1] = deadline
+            actual[edge + 1] = wait_until(deadline, spin_threshold_ns)
+            falling()
+
+            deadline += delay - (delay >> 1)
+            edge += 2
+            steps += 1
+
+        # wait for the low phase of the last step before the next move can start
+        if steps:
+            wait_until(deadline, spin_threshold_ns)
+
+        self.stats = JitterStats([actual[i] - planned[i] for i in range(edge)])
+        logger.debug(f"Executed {steps} steps with {self.stats}")
+        return steps
@@ -1,13 +1,9 @@
-import datetime
-import json
-import os
-import re
-import zipfile
-import uuid
 import logging
 import configparser
 
-from settings import settings_dict
+from lib.formats import open_source
+from lib.plan import parse_gcode, parse_ini
+from lib.source import ZipLayerSource, LayerSourceError
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -21,7 +17,11 @@ class UnpackerError(Exception):
 
 
 class Unpacker:
-    """Class to handle the unpacking of ZIP files containing 3D print data."""
+    """Class to handle the loading of job files containing 3D print data (without extracting them).
+
+    Supported are ZIP files with PNG layers (including Prusa .sl1) and the run-length encoded
+    .ctb, .cbddlp and .photon files. The format is detected from the content, not the file name.
+    """
 
     def __init__(self, zip_file_path=None):
         """Initialize the Unpacker instance.
@@ -30,14 +30,12 @@ class Unpacker:
             zip_file_path (str): The path to the ZIP file to be unpacked.
         """
         self.zip_file = zip_file_path
-        self.directory_root = settings_dict['system']['paths']['unpack']
-        self.directory = None
-        self.extracted_at = datetime.datetime.now()
+        self.source = None
         self.images = {}
         self.config = {}
 
     def unpack(self, zip_file=None):
-        """Unpack the ZIP file and parse its contents.
+        """Index the ZIP file and parse its contents.
 
         Parameters:
             zip_file (str): Optional path to the ZIP file to be unpacked.
@@ -47,67 +45,47 @@ class Unpacker:
         elif not getattr(self, 'zip_file', None):
             raise UnpackerError("ZIP-File is not set!")
 
-        logger.debug(f"Unpacking zip file '{self.zip_file}'")
-        if self.unpack_zip():
-            if not self.parse_images():
-                raise UnpackerError("Could not parse images")
-            if not self.parse_gcode():
-                raise UnpackerError("Could not parse GCODE file")
+        logger.debug(f"Indexing job file '{self.zip_file}'")
+        if self.open_source() is None:
+            raise UnpackerError(f"Could not open job file '{self.zip_file}'")
+        if not self.parse_images():
+            raise UnpackerError("Could not parse images")
+        if not self.parse_gcode():
+            raise UnpackerError("Could not parse GCODE file")
 
-    def unpack_zip(self):
-        """Unpack the ZIP file to a directory."""
+    def open_source(self):
+        """Open the job file as layer source (indexes the central directory or the layer table only)."""
         try:
-            subdirectory_date = self.extracted_at.strftime("%Y%m%d%H%M%S")
-            subdirectory_uuid = uuid.uuid4().hex
-            subdirectory_name = subdirectory_date + "-" + subdirectory_uuid
-
-            self.directory = os.path.join(self.directory_root, subdirectory_name)
-            os.makedirs(self.directory, exist_ok=True)
-
-            with zipfile.ZipFile(self.zip_file, 'r') as zip_ref:
-                zip_ref.extractall(self.directory)
-
-            logger.info(f"Successfully unpacked zip '{self.zip_file}' to '{self.directory}'.")
-            return self.directory
-        except Exception as e:
+            self.source = open_source(self.zip_file)
+            logger.info(f"Successfully indexed '{self.zip_file}' ({len(self.source)} layers).")
+            return self.source
+        except LayerSourceError as e:
             logger.error(f"Error while unpacking: {e}")
             return None
 
     def parse_images(self):
-        """Parse and sort the image files in the unpacked directory."""
-        try:
-            png_files = [f for f in os.listdir(self.directory) if f.lower().endswith('.png')]
-            numbered_files = []
-            for file in png_files:
-                match = re.search(r'(\d+)', file)
-                if match:
-                    num = int(match.group(1))
-                    numbered_files.append((num, file))
-
-            numbered_files.sort()
-            numbers = [num for num, _ in numbered_files]
-            if any(a - b != 1 for a, b in zip(numbers[1:], numbers[:-1])):
-                logger.error("Files not numbered consecutively!")
-                self.images = {}
-            else:
-                self.images = {num: {'filepath': os.path.join(self.directory, file)} for num, file in numbered_files}
-            return self.images
-
-        except OSError as e:
-            logger.error(f"Error while listing files in directory: {e}")
-            return {}
+        """Map the layer numbers to the image members of the ZIP file."""
+        self.images = {num: {'name': name} for num, name in self.source.layers.items()}
+        return self.images
 
     def parse_gcode(self):
-        """Parse the GCODE file in the unpacked directory."""
-        config_file = os.path.join(self.directory, "run.gcode")
-        config = configparser.ConfigParser()
-
-        try:
-            with open(config_file, 'r') as f:
-                pass
-        except FileNotFoundError:
-            logger.error(f"File '{config_file}' not found.")
-            return {}
-
-        # TODO: For now we don't need the gcode
-        return {'content': None}
+        """Parse the slicer metadata in the ZIP file (run.gcode, or config.ini of SL1 files).
+        The metadata of the other formats is read from their file header."""
+        if not isinstance(self.source, ZipLayerSource):
+            self.config = self.source.config
+            return self.config
+
+        parsers = {"run.gcode": parse_gcode, "config.ini": parse_ini}
+        for name, parser in parsers.items():
+            if name not in self.source.members:
+                continue
+            try:
+                self.config = parser(bytes(self.source.member(name)).decode('utf-8', errors='replace'))
+            except (LayerSourceError, ValueError, configparser.Error) as e:
+                logger.error(f"Could not parse '{name}'. Reason: {e}")
+                return {}
+            logger.debug(f"Parsed slicer metadata from '{name}': {self.config['header']}")
+            return self.config
+
+        logger.error("Neither 'run.gcode' nor 'config.ini' found.")
+        return {}
@@ -0,0 +1,411 @@
+import time
+import logging
+import threading
+
+import numpy as np
+
+from lib.timing import JitterStats, wait_until
+from settings import settings_dict
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+"""
+This module provides waveform backends for the stepper driver. A move is compiled into a waveform,
+an array of pulses (pins to set, pins to clear, delay until the next pulse), which a backend executes
+in one call. The caller starts the waveform and waits for it (fire-and-wait), so the timing of the
+pulses does not depend on the calling Python thread.
+
+Backends:
+    python: executes the pulses in a worker thread against absolute deadlines.
+    simulated: verifies the pulses (edge order, pulse widths) and records them, without any GPIO.
+    pigpio: hands the pulses to the pigpio daemon, which plays them by DMA (optional dependency).
+"""
+
+# One pulse: bit masks of the GPIO pins to set and to clear, then the delay in ns until the next pulse
+PULSE = np.dtype([('on', '<u4'), ('off', '<u4'), ('delay', '<u8')])
+
+
+class WaveformError(Exception):
+    """
+    Custom exception for waveform errors.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def build_waveform(delays, step_mask):
+    """
+    Compile step delays into a waveform: per step one pulse setting the step pin (high for half the delay)
+    and one pulse clearing it.
+
+    Parameters:
+        delays (array): One step delay per step in ns.
+        step_mask (int): The bit mask of the step pin.
+
+    Returns:
+        numpy.ndarray: The pulses (PULSE), two per step.
+    """
+    delays = np.frombuffer(delays, dtype=np.int64) if not isinstance(delays, np.ndarray) else delays
+    wave = np.zeros(2 * len(delays), dtype=PULSE)
+    high = delays >> 1
+    wave['on'][0::2] = step_mask
+    wave['delay'][0::2] = high
+    wave['off'][1::2] = step_mask
+    wave['delay'][1::2] = delays - high
+    return wave
+
+
+def pin_mask(pins):
+    """
+    Get the bit mask of GPIO pins.
+
+    Parameters:
+        pins (iterable): The BCM pin numbers.
+
+    Returns:
+        int: The bit mask.
+    """
+    mask = 0
+    for pin in pins:
+        mask |= 1 << pin
+    return mask
+
+
+class WaveformBackend:
+    """
+    Base class for waveform backends. Only one waveform is played at a time.
+    """
+
+    def __init__(self):
+        """
+        Initialize the WaveformBackend instance.
+        """
+        self.stats = None
+        self._done = threading.Event()
+        self._done.set()
+        self._pulses = 0
+
+    @property
+    def busy(self):
+        """
+        Check if a waveform is playing.
+
+        Returns:
+            bool: True while a waveform is playing.
+        """
+        return not self._done.is_set()
+
+    def send(self, wave, abort=None):
+        """
+        Start playing a waveform and return immediately.
+
+        Parameters:
+            wave (numpy.ndarray): The pulses (PULSE).
+            abort (callable, optional): Function checked between pulses, stops the waveform if True.
+        """
+        raise NotImplementedError
+
+    def wait(self):
+        """
+        Wait until the waveform has been played or aborted.
+
+        Returns:
+            int: The number of pulses played.
+        """
+        self._done.wait()
+        return self._pulses
+
+    def close(self):
+        """
+        Release the resources of the backend.
+        """
+        pass
+
+
+class PythonWaveformBackend(WaveformBackend):
+    """
+    Waveform backend playing the pulses in a worker thread with the pin handles.
+    """
+
+    def __init__(self, handles):
+        """
+        Initialize the PythonWaveformBackend instance.
+
+        Parameters:
+            handles (dict): The pin handles (set/clear) by BCM pin number.
+        """
+        super().__init__()
+        self.__handles = handles
+        self.__spin_threshold_ns = int(settings_dict['machine']['timing']['spin_threshold'] * 1e9)
+        self.__calls = {}
+
+    def calls(self, mask, method):
+        """
+        Get the handle methods for the pins of a bit mask (cached per mask).
+
+        Parameters:
+            mask (int): The bit mask.
+            method (str): 'set' or 'clear'.
+
+        Returns:
+            tuple: The bound methods.
+        """
+        key = (mask, method)
+        calls = self.__calls.get(key)
+        if calls is None:
+            calls = self.__calls[key] = tuple(
+                getattr(handle, method) for pin, handle in self.__handles.items() if mask & (1 << pin)
+            )
+        return calls
+
+    def send(self, wave, abort=None):
+        if self.busy:
+            raise WaveformError("A waveform is already playing")
+        self._done.clear()
+        self._pulses = 0
+        threading.Thread(target=self.__play, args=(wave, abort), name="waveform", daemon=True).start()
+
+    def __play(self, wave, abort):
+        """
+        Play the pulses against absolute deadlines, then clear all pins used by the waveform.
+        """
+        spin_threshold_ns = self.__spin_threshold_ns
+        lateness = []
+        pulses = 0
+        try:
+            deadline = time.perf_counter_ns()
+            for on, off, delay in wave.tolist():
+                if abort and abort():
+                    break
+                lateness.append(wait_until(deadline, spin_threshold_ns) - deadline)
+                for call in self.calls(off, 'clear'):
+                    call()
+                for call in self.calls(on, 'set'):
+                    call()
+                deadline += delay
+                pulses += 1
+            if pulses:
+                wait_until(deadline, spin_threshold_ns)
+        finally:
+            for call in self.calls(int(np.bitwise_or.reduce(wave['on'])) if len(wave) else 0, 'clear'):
+                call()
+            self.stats = JitterStats(lateness)
+            self._pulses = pulses
+            self._done.set()
+
+
+class SimulatedWaveformBackend(WaveformBackend):
+    """
+    Waveform backend without GPIO. Verifies every waveform and optionally takes as long as playing it.
+    """
+
+    def __init__(self, min_pulse_ns=0, realtime=True):
+        """
+        Initialize the SimulatedWaveformBackend instance.
+
+        Parameters:
+            min_pulse_ns (int, optional): The minimal time in ns between two edges of a pin.
+            realtime (bool, optional): Wait for the duration of the waveform (interruptible by abort).
+        """
+        super().__init__()
+        self.min_pulse_ns = min_pulse_ns
+        self.realtime = realtime
+        self.history = []
+
+    def verify(self, wave):
+        """
+        Verify a waveform: the edges of every pin alternate between set and clear, no pin is set and
+        cleared by the same pulse and the edges of a pin are at least the minimal pulse width apart.
+
+        Parameters:
+            wave (numpy.ndarray): The pulses (PULSE).
+
+        Returns:
+            dict: Number of pulses, duration in ns and rising edges per pin.
+
+        Raises:
+            WaveformError: If the waveform is invalid.
+        """
+        if np.any(wave['on'] & wave['off']):
+            raise WaveformError("A pulse sets and clears the same pin")
+
+        # time of every pulse since the start of the waveform
+        times = np.concatenate(([0], np.cumsum(wave['delay'], dtype=np.int64)[:-1]))
+        pins = int(np.bitwise_or.reduce(wave['on'] | wave['off'])) if len(wave) else 0
+        edges = {}
+        for pin in range(32):
+            if not pins & (1 << pin):
+                continue
+            rising = (wave['on'] >> pin) & 1
+            falling = (wave['off'] >> pin) & 1
+            changes = np.flatnonzero(rising | falling)
+            levels = rising[changes]
+            if np.any(levels[1:] == levels[:-1]):
+                raise WaveformError(f"Edges of pin {pin} do not alternate")
+            widths = np.diff(times[changes])
+            if widths.size and widths.min() < self.min_pulse_ns:
+                raise WaveformError(f"Pulse of pin {pin} shorter than {self.min_pulse_ns}ns ({widths.min()}ns)")
+            edges[pin] = int(levels.sum())
+
+        return {'pulses': len(wave), 'duration': int(wave['delay'].sum()), 'edges': edges}
+
+    def send(self, wave, abort=None):
+        if self.busy:
+            raise WaveformError("A waveform is already playing")
+        record = self.verify(wave)
+        self.history.append(record)
+        self._pulses = len(wave)
+
+        if not self.realtime:
+            return
+        self._done.clear()
+        threading.Thread(target=self.__play, args=(wave, abort), name="waveform", daemon=True).start()
+
+    def __play(self, wave, abort):
+        """
+        Take as long as the waveform, checking abort every millisecond.
+        """
+        try:
+            start = time.perf_counter_ns()
+            ends = start + np.cumsum(wave['delay'], dtype=np.int64)
+            while True:
+                now = time.perf_counter_ns()
+                if now >= ends[-1] if len(ends) else True:
+                    break
+                if abort and abort():
+                    self._pulses = int(np.searchsorted(ends, now, side='right')) + 1
+                    break
+                time.sleep(min(0.001, (int(ends[-1]) - now) / 1e9))
+        finally:
+            self._done.set()
+
+
+class PigpioWaveformBackend(WaveformBackend):
+    """
+    Waveform backend playing the pulses with the pigpio daemon (DMA timed, independent of Python).
+    The waveform is sent in chunks, as the daemon limits the pulses per wave. The next chunk is created
+    while the current one plays and queued to start the moment it ends, so the chunks play without a gap.
+    """
+
+    CHUNK = 4096
+
+    def __init__(self, host='localhost', port=8888):
+        """
+        Initialize the PigpioWaveformBackend instance and connect to the daemon.
+
+        Parameters:
+            host (str, optional): The host of the pigpio daemon.
+            port (int, optional): The port of the pigpio daemon.
+
+        Raises:
+            WaveformError: If pigpio is not installed or the daemon is not running.
+        """
+        super().__init__()
+        try:
+            import pigpio
+        except ImportError:
+            raise WaveformError("pigpio is not installed")
+        self.__pigpio = pigpio
+        self.__pi = pigpio.pi(host, port)
+        if not self.__pi.connected:
+            raise WaveformError(f"Could not connect to the pigpio daemon at {host}:{port}")
+
+    def send(self, wave, abort=None):
+        if self.busy:
+            raise WaveformError("A waveform is already playing")
+        self._done.clear()
+        self._pulses = 0
+        threading.Thread(target=self.__play, args=(wave, abort), name="waveform", daemon=True).start()
+
+    def __play(self, wave, abort):
+        """
+        Play the waveform chunk by chunk. Every chunk is sent in ONE_SHOT_SYNC mode, which starts it when the
+        playing chunk ends. At most two chunks exist at a time, the playing one is deleted once the next one
+        took over, as the daemon has room for a limited number of pulses only.
+        """
+        pi = self.__pi
+        pulse = self.__pigpio.pulse
+        ends = np.cumsum(wave['delay'], dtype=np.int64)
+        created = []
+        started = None
+        try:
+            for start in range(0, len(wave), self.CHUNK):
+                chunk = wave[start:start + self.CHUNK]
+                pi.wave_add_generic([pulse(on, off, max(1, delay // 1000)) for on, off, delay in chunk.tolist()])
+                wave_id = pi.wave_create()
+                created.append(wave_id)
+                pi.wave_send_using_mode(wave_id, self.__pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+                if started is None:
+                    started = time.perf_counter_ns()
+                    continue
+
+                # the chunk before plays until the new one takes over
+                previous = created[0]
+                if not self.__wait(lambda: pi.wave_tx_at() == previous, abort, started, ends):
+                    return
+                pi.wave_delete(created.pop(0))
+                self._pulses = start
+
+            if created and not self.__wait(pi.wave_tx_busy, abort, started, ends):
+                return
+            self._pulses = len(wave)
+        finally:
+            for wave_id in created:
+                try:
+                    pi.wave_delete(wave_id)
+                except self.__pigpio.error:
+                    pass
+            pins = int(np.bitwise_or.reduce(wave['on'])) if len(wave) else 0
+            for pin in range(32):
+                if pins & (1 << pin):
+                    pi.write(pin, 0)
+            self._done.set()
+
+    def __wait(self, playing, abort, started, ends):
+        """
+        Wait while a condition on the transmission holds. If aborted, the transmission is stopped and the
+        pulses played are derived from the time since the first chunk started (the chunks play without gaps).
+
+        Parameters:
+            playing (callable): The condition.
+            abort (callable): Function checked every millisecond, stops the waveform if True.
+            started (int): The time the first chunk was sent in ns (perf_counter_ns).
+            ends (numpy.ndarray): The end of every pulse in ns since the start of the waveform.
+
+        Returns:
+            bool: False if aborted.
+        """
+        while playing():
+            if abort and abort():
+                self.__pi.wave_tx_stop()
+                elapsed = time.perf_counter_ns() - started
+                self._pulses = min(len(ends), int(np.searchsorted(ends, elapsed, side='right')) + 1)
+                return False
+            time.sleep(0.001)
+        return True
+
+    def close(self):
+        self.__pi.stop()
+
+
+def create_waveform_backend(handles):
+    """
+    Create the waveform backend configured in machine.timing.waveform.
+
+    Parameters:
+        handles (dict): The pin handles by BCM pin number (for the python backend).
+
+    Returns:
+        WaveformBackend: The backend, None for inline stepping in the calling thread.
+    """
+    timing = settings_dict['machine']['timing']
+    backend = timing['waveform']
+    if backend == 'python':
+        return PythonWaveformBackend(handles)
+    if backend == 'simulated':
+        return SimulatedWaveformBackend(int(timing['min_pulse'] * 1e9))
+    if backend == 'pigpio':
+        return PigpioWaveformBackend()
+    return None
@@ -5,6 +5,7 @@ import sys
 from lib.thread import ThreadManager
 from lib.limit import LimitSwitch
 from lib.print import PrintLoop
+from lib.realtime import RealtimeBridge, RealtimeStatus
 
 from manager import Manager
 from settings import settings_dict
@@ -26,14 +27,21 @@ logger = logging.getLogger(__name__)
 # Initialize the ThreadManager
 tm = ThreadManager()
 
+# State of the print-loop, shared with the print process if it runs in its own
+status = RealtimeStatus()
+
 # Register various threads
-tm.register("limit", LimitSwitch)  # Registering the z-axis limit switch observer for safety
-tm.register("manager", Manager)    # Registering the manager for handling commands
-tm.register("printer", PrintLoop)  # Registering the print-loop for handling print jobs
+if settings_dict['system']['realtime']['enabled']:
+    # the limit switch observer, the manager and the print-loop run in the real-time print process
+    tm.register("manager", RealtimeBridge, status=status)  # Registering the bridge forwarding commands and jobs to the print process
+else:
+    tm.register("limit", LimitSwitch)  # Registering the z-axis limit switch observer for safety
+    tm.register("manager", Manager)    # Registering the manager for handling commands
+    tm.register("printer", PrintLoop, status=status)  # Registering the print-loop for handling print jobs
 
 # Conditionally register API and WebSocket controllers based on settings
 if settings_dict['system']['modules']['api'] == 'enabled':
-    tm.register("api", APIController)  # Registering the Flask REST API for external control
+    tm.register("api", APIController, status=status)  # Registering the Flask REST API for external control
 
 if settings_dict['system']['modules']['wsc'] == 'enabled':
     tm.register("wsc", WebSocketController)  # Registering the WebSocket controller for real-time communication
@@ -1,8 +1,6 @@
 import logging
 import os
-import queue
 import sys
-import time
 
 from lib.job import Job
 from lib.stepper import StepperDriver
@@ -25,32 +23,38 @@ class Manager:
             "exit": self.exit,
             "reboot": self.reboot
         }
+        self.handle(None)
 
     def handle(self, incoming_string, *args, **kwargs):
-        """Main loop for the print process."""
+        """Main loop dispatching the commands, blocks until a command arrives."""
         while True:
-            try:
-                cmd = self.queues['cmd'].get(timeout=2)
-                # Look up the function in the dictionary
-                func = self.function_map.get(cmd[0])
-
-                # Call the function if it exists
-                if func:
-                    func(cmd[1])
-                else:
-                    logger.warning(f"No function mapped to the string '{incoming_string}'")
-            except queue.Empty:
-                time.sleep(1)
+            cmd = self.queues['cmd'].get()
+            logger.debug(f"Command '{cmd[0]}' dispatched {self.queues['cmd'].last_latency / 1e6:.3f}ms after it was sent")
+
+            # Look up the function in the dictionary
+            func = self.function_map.get(cmd[0])
+
+            # Call the function if it exists
+            if func:
+                func(**cmd[1])
+            else:
+                logger.warning(f"No function mapped to the string '{cmd[0]}'")
 
     def start(self, **kwargs):
         self.stopped.clear()
 
     def stop(self, **kwargs):
-        self.stopped.set()
+        if not self.stopped.is_set():
+            self.stopped.set('command')
 
     def level(self, **kwargs):
+        # leveling is an explicit request to move, it clears a previous stop
+        self.stopped.clear()
         sd = StepperDriver(self.stopped)
-        sd.level()
+        try:
+            sd.level()
+        finally:
+            sd.close()
 
     def exit(self, **kwargs):
         sys.exit()
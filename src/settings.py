@@ -1,8 +1,12 @@
 import os
+import time
 import yaml
 import json
+import atexit
 import logging
 import datetime
+import threading
+import contextlib
 from cerberus import Validator
 
 # Configure logging
@@ -17,6 +21,7 @@ VALIDATION_SCHEMA = "src/config/validate.yaml"
 SYSTEM_DEFAULTS = {
     "is_calibrated": False,
     "calibration_time": False,
+    "homing_time": None,
     "motor_position": False,
     "initial_setup_time": datetime.datetime.now().strftime("%Y-%m-%d-%H:%M:%S"),
     "last_job_id": None
@@ -113,21 +118,31 @@ class Settings:
 class SystemSettings:
     """
     Singleton class to manage system settings.
+
+    The settings are shared between threads and guarded by a lock. Changes are not written
+    synchronously but persisted by a background writer, which coalesces all changes within
+    the write window into one atomic write (temp-file, fsync and os.replace).
     """
     _instance = None
 
     def __init__(self):
         self.filepath = None
         self.settings = {}
+        self.window = 0.0
+        self.lock = threading.RLock()
+        self.writes_requested = 0
+        self.writes_performed = 0
+        self.__changed = threading.Condition(self.lock)
+        self.__write_lock = threading.Lock()
+        self.__dirty = False
+        self.__batch_depth = 0
+        self.__writer = None
 
     def __new__(cls, **kwargs):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def __del__(self):
-        self.save()
-
     def __getitem__(self, key):
         """
         Retrieve a system setting by its key.
@@ -138,59 +153,153 @@ class SystemSettings:
         Returns:
             The value associated with the key.
         """
-        if key in self.settings:
-            return self.settings[key]
-        else:
-            raise KeyError(f"'{key}' not found")
+        with self.lock:
+            if key in self.settings:
+                return self.settings[key]
+            else:
+                raise KeyError(f"'{key}' not found")
 
     def __setitem__(self, key, value):
         """
-        Set a system setting by its key and save it.
+        Set a system setting by its key and schedule saving it.
 
         Args:
             key (str): The key to set.
             value: The value to set.
         """
-        if key in self.settings:
-            self.settings[key] = value
-            self.save()
-        else:
-            raise KeyError(f"'{key}' not found")
+        self.update(**{key: value})
 
-    def load(self, filepath):
+    def update(self, **kwargs):
+        """
+        Set multiple system settings at once, persisted with a single write.
+
+        Args:
+            **kwargs: The keys and values to set.
+        """
+        with self.lock:
+            for key in kwargs:
+                if key not in self.settings:
+                    raise KeyError(f"'{key}' not found")
+            self.settings.update(kwargs)
+            self.schedule()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager holding the lock and deferring the write until the block is left.
+
+        Example:
+            with system_dict.batch():
+                system_dict['is_calibrated'] = True
+                system_dict['calibration_time'] = now
+        """
+        with self.lock:
+            self.__batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.__batch_depth -= 1
+                if self.__batch_depth == 0 and self.__dirty:
+                    self.__changed.notify()
+
+    def schedule(self):
+        """
+        Mark the settings as changed and wake up the background writer.
+        """
+        with self.lock:
+            self.writes_requested += 1
+            self.__dirty = True
+            if self.__writer is None:
+                self.__writer = threading.Thread(target=self.__write_behind, name="system-settings", daemon=True)
+                self.__writer.start()
+            if self.__batch_depth == 0:
+                self.__changed.notify()
+
+    @property
+    def writes_saved(self):
+        """
+        Get the number of writes saved by coalescing.
+
+        Returns:
+            int: Requested minus performed writes.
+        """
+        return max(0, self.writes_requested - self.writes_performed)
+
+    def __write_behind(self):
+        """
+        Background writer. Waits for changes, lets further changes accumulate for the write window
+        and then persists a snapshot of the settings.
+        """
+        while True:
+            with self.lock:
+                while not self.__dirty or self.__batch_depth:
+                    self.__changed.wait()
+            time.sleep(self.window)
+            self.flush()
+
+    def load(self, filepath, window=0.0):
         """
         Load system settings from a JSON file.
 
         Args:
             filepath (str): The path to the JSON file.
+            window (float, optional): The time in seconds to coalesce changes before writing them.
         """
-        self.filepath = filepath
-        try:
-            with open(self.filepath, 'r') as f:
-                self.settings = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            self.settings = SYSTEM_DEFAULTS.copy()
-            self.save()
+        with self.lock:
+            self.filepath = filepath
+            self.window = window
+            try:
+                with open(self.filepath, 'r') as f:
+                    # keys added after the file was written get their defaults
+                    self.settings = {**SYSTEM_DEFAULTS, **json.load(f)}
+                    return
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.settings = SYSTEM_DEFAULTS.copy()
+
+        # the defaults are written without holding the lock
+        self.save()
+
+    def flush(self):
+        """
+        Save the system settings now if there are pending changes.
+        """
+        with self.lock:
+            if not self.__dirty:
+                return
+        # the file is written without holding the lock, readers and writers of the settings do not wait for it
+        self.save()
 
     def save(self):
         """
-        Save system settings to a JSON file.
+        Save system settings to a JSON file atomically (temp-file, fsync and os.replace).
+        The lock is only held to take the snapshot, never while writing. Must not be called with the lock held.
         """
         directory, filename = os.path.split(self.filepath)
+        temp_filepath = os.path.join(directory, f".{filename}.tmp")
         os.makedirs(directory, exist_ok=True)
         try:
-            with open(self.filepath, 'w') as f:
-                json.dump(self.settings, f, indent=4)
+            # snapshots are taken in the order they are written, so an older one never replaces a newer one
+            with self.__write_lock:
+                with self.lock:
+                    content = json.dumps(self.settings, indent=4, default=str)
+                    self.__dirty = False
+                with open(temp_filepath, 'w') as f:
+                    f.write(content)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_filepath, self.filepath)
+                self.writes_performed += 1
         except PermissionError as e:
             logger.error(f"A permission error occurred while saving the system settings file. Reason: {e}")
         except OSError as e:
             logger.error(f"An error occurred while saving the system settings file. Reason: {e}")
 
 
-# Create instances of system settings and settings
-system_dict = SystemSettings()
-system_dict.load(SYSTEM_PATH)
-
+# Create instances of settings and system settings
 settings_dict = Settings()
 settings_dict.load(SETTINGS_PATH)
 settings_dict.validate(VALIDATION_SCHEMA)
+
+system_dict = SystemSettings()
+system_dict.load(SYSTEM_PATH, window=settings_dict['system']['persistence']['window'])
+atexit.register(system_dict.flush)
@@ -0,0 +1,22 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+"""
+Test configuration. The modules are imported from src and the settings are loaded relative to the
+repository root, like the application does. The job and state directories point to a temporary
+directory, so the tests do not touch the files of the printer.
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+from settings import settings_dict  # noqa: E402
+
+_files = tempfile.mkdtemp(prefix='reppy-tests-')
+atexit.register(shutil.rmtree, _files, True)
+for _path in ('upload', 'unpack', 'state', 'current'):
+    settings_dict['system']['paths'][_path] = os.path.join(_files, _path)
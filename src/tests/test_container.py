@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pytest
+
+from lib.container import (
+    ContainerError, ContainerLayerSource, ENCODING_BITPACK, ENCODING_EMPTY, ENCODING_RLE,
+    compile_container, encode_layer, rle_decode, rle_encode
+)
+from lib.source import LayerSource
+
+HEIGHT, WIDTH = 60, 90
+
+
+class FrameSource(LayerSource):
+    """
+    Layer source serving frames from memory.
+    """
+
+    def __init__(self, frames, first=1):
+        super().__init__('memory')
+        self.frames = {first + i: frame for i, frame in enumerate(frames)}
+        self.layers = {layer: i for i, layer in enumerate(self.frames)}
+
+    def frame(self, layer):
+        return self.frames[layer]
+
+
+def random_frames(count, seed=0):
+    """
+    Create layers of every kind: empty, binary with a single lit value and anti-aliased.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+        kind = i % 4
+        if kind:
+            y0, x0 = rng.integers(0, HEIGHT // 2), rng.integers(0, WIDTH // 2)
+            y1, x1 = rng.integers(y0 + 1, HEIGHT + 1), rng.integers(x0 + 1, WIDTH + 1)
+            lit = rng.random((y1 - y0, x1 - x0)) < 0.6
+            if kind == 1:
+                frame[y0:y1, x0:x1] = lit * 255
+            elif kind == 2:
+                frame[y0:y1, x0:x1] = lit * rng.integers(1, 256, (y1 - y0, x1 - x0))
+            else:
+                frame[y0:y1, x0:x1] = 128
+        frames.append(frame)
+    return frames
+
+
+def test_rle_round_trip():
+    rng = np.random.default_rng(1)
+    pixels = np.repeat(rng.integers(0, 3, 200).astype(np.uint8), rng.integers(1, 20, 200))
+    values, lengths = rle_encode(pixels)
+    assert np.all(values[1:] != values[:-1])
+    np.testing.assert_array_equal(rle_decode(values, lengths), pixels)
+
+
+def test_encode_layer():
+    frame = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+    assert encode_layer(frame) == (ENCODING_EMPTY, 0, 0, (0, 0, 0, 0), b'')
+
+    # a solid block is a few runs, a pattern is smaller bit-packed
+    frame[10:20, 30:70] = 200
+    encoding, value, area, bbox, _ = encode_layer(frame)
+    assert (encoding, area, bbox) == (ENCODING_RLE, 400, (30, 10, 70, 20))
+
+    frame[10:20:2, 30:70:2] = 0
+    encoding, value, area, bbox, _ = encode_layer(frame)
+    assert (encoding, value, area, bbox) == (ENCODING_BITPACK, 200, 300, (30, 10, 70, 20))
+
+    frame[15, 41] = 100
+    assert encode_layer(frame)[0] == ENCODING_RLE
+
+
+@pytest.mark.parametrize('first', [0, 1, 7])
+def test_container_round_trip(tmp_path, first):
+    frames = random_frames(24)
+    path = str(tmp_path / 'job.rpyc')
+    compile_container(FrameSource(frames, first), path)
+    assert os.listdir(tmp_path) == ['job.rpyc']
+
+    container = ContainerLayerSource(path)
+    try:
+        assert (container.width, container.height) == (WIDTH, HEIGHT)
+        assert list(container) == list(range(first, first + len(frames)))
+        assert {int(entry['encoding']) for entry in container.table} == {ENCODING_EMPTY, ENCODING_BITPACK, ENCODING_RLE}
+
+        out = np.full((HEIGHT, WIDTH), 77, dtype=np.uint8)
+        for i, frame in enumerate(frames):
+            layer = first + i
+            np.testing.assert_array_equal(container.frame(layer), frame)
+            assert container.frame(layer, out) is out
+            np.testing.assert_array_equal(out, frame)
+
+            info = container.info(layer)
+            assert info['area'] == np.count_nonzero(frame)
+            if info['area']:
+                rows, cols = np.nonzero(frame)
+                assert info['bbox'] == (cols.min(), rows.min(), cols.max() + 1, rows.max() + 1)
+
+        with pytest.raises(ContainerError):
+            container.frame(first + len(frames))
+    finally:
+        container.close()
+
+
+def test_compile_rejects_mixed_resolutions(tmp_path):
+    frames = random_frames(3)
+    frames.append(np.zeros((HEIGHT, WIDTH + 1), dtype=np.uint8))
+    with pytest.raises(ContainerError, match="different resolution"):
+        compile_container(FrameSource(frames), str(tmp_path / 'job.rpyc'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / 'job.rpyc'
+    path.write_bytes(b'PNG\0' + bytes(100))
+    with pytest.raises(ContainerError, match="not a job container"):
+        ContainerLayerSource(str(path))
+    with pytest.raises(ContainerError):
+        ContainerLayerSource(str(tmp_path / 'missing.rpyc'))
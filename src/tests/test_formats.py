@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from lib.formats import FormatError, decode_cbddlp, decode_ctb, decrypt_ctb
+
+
+def reference_decode_ctb(data):
+    """
+    Decode a .ctb layer byte by byte.
+    """
+    greys, lengths = [], []
+    i = 0
+    while i < len(data):
+        code = data[i]
+        i += 1
+        length = 1
+        if code & 0x80:
+            if i >= len(data):
+                raise FormatError("truncated")
+            b = data[i]
+            if b & 0x80 == 0:
+                size = 1
+            elif b & 0xC0 == 0x80:
+                size = 2
+            elif b & 0xE0 == 0xC0:
+                size = 3
+            elif b & 0xF0 == 0xE0:
+                size = 4
+            else:
+                raise FormatError("invalid prefix")
+            if i + size > len(data):
+                raise FormatError("truncated")
+            length = b & (0x7F >> (size - 1)) if size > 1 else b
+            for extra in data[i + 1:i + size]:
+                length = (length << 8) | extra
+            i += size
+        grey = code & 0x7F
+        greys.append((grey << 1) | 1 if grey else 0)
+        lengths.append(length)
+    return np.repeat(np.array(greys, dtype=np.uint8), lengths)
+
+
+def encode_ctb(runs, rng):
+    """
+    Encode runs of (grey, length) as .ctb, with a random size of every length field.
+    """
+    data = bytearray()
+    for grey, length in runs:
+        if length == 1 and rng.random() < 0.5:
+            data.append(grey)
+            continue
+        data.append(grey | 0x80)
+        size = max(int(rng.integers(1, 5)), 1 if length < 0x80 else 2 if length < 0x4000 else 3)
+        prefix = (0x00, 0x80, 0xC0, 0xE0)[size - 1]
+        data.append(prefix | (length >> (8 * (size - 1))))
+        data.extend((length >> (8 * shift)) & 0xFF for shift in range(size - 2, -1, -1))
+    return bytes(data)
+
+
+def reference_decrypt_ctb(data, key, index):
+    """
+    Decrypt a .ctb layer byte by byte.
+    """
+    init = (key * 0x2D83CDAC + 0xD8A83423) & 0xFFFFFFFF
+    xor = ((index * 0x1E1530CD + 0xEC3D47CD) * init) & 0xFFFFFFFF
+    out = bytearray(data)
+    for i in range(len(out)):
+        if i and i % 4 == 0:
+            xor = (xor + init) & 0xFFFFFFFF
+        out[i] ^= (xor >> (8 * (i % 4))) & 0xFF
+    return bytes(out)
+
+
+def test_decode_ctb_random():
+    rng = np.random.default_rng(1)
+    for _ in range(3000):
+        count = int(rng.integers(0, 40))
+        greys = rng.integers(0, 128, count)
+        lengths = np.where(rng.random(count) < 0.9, rng.integers(1, 300, count), rng.integers(1, 100000, count))
+        data = encode_ctb(zip(greys.tolist(), lengths.tolist()), rng)
+        np.testing.assert_array_equal(decode_ctb(data), reference_decode_ctb(data))
+
+
+def test_decode_ctb_length_bytes_with_bit_7():
+    # the length bytes look like codes: 0x85 0x81 0x85 is one run of 0x185 pixels
+    np.testing.assert_array_equal(decode_ctb(b'\x85\x81\x85'), np.full(0x185, 11, dtype=np.uint8))
+    assert decode_ctb(b'\x85\xe0\x00\xf0\x01\x00').size == 0xF001 + 1
+
+
+def test_decode_ctb_grey_values():
+    np.testing.assert_array_equal(decode_ctb(bytes([0x00, 0x01, 0x02, 0x40, 0x7F])), [0, 3, 5, 129, 255])
+
+
+@pytest.mark.parametrize('data', [b'\x85', b'\x85\x81', b'\x01\x85\xc0\x01', b'\x85\xe0\x00\x00'])
+def test_decode_ctb_truncated(data):
+    with pytest.raises(FormatError, match="truncated"):
+        decode_ctb(data)
+
+
+@pytest.mark.parametrize('data', [b'\x85\xf0\x00\x00\x00', b'\x01\x85\x05\x85\xff\x01\x02\x03'])
+def test_decode_ctb_invalid_prefix(data):
+    with pytest.raises(FormatError, match="Invalid run length prefix"):
+        decode_ctb(data)
+
+
+def test_decode_ctb_empty():
+    assert decode_ctb(b'').size == 0
+
+
+def test_decode_cbddlp():
+    np.testing.assert_array_equal(decode_cbddlp(bytes([0x83, 0x02, 0x81])), [255, 255, 255, 0, 0, 255])
+
+
+def test_decrypt_ctb():
+    rng = np.random.default_rng(2)
+    for size in (0, 1, 3, 4, 5, 8, 1001):
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        key, index = int(rng.integers(1, 1 << 32)), int(rng.integers(0, 5000))
+        decrypted = decrypt_ctb(data, key, index)
+        assert decrypted.tobytes() == reference_decrypt_ctb(data, key, index)
+        # the key stream is XORed, decrypting twice gives the data
+        assert decrypt_ctb(decrypted.tobytes(), key, index).tobytes() == data
+
+
+def test_decrypt_ctb_depends_on_layer():
+    data = bytes(16)
+    assert decrypt_ctb(data, 0x1234, 0).tobytes() != decrypt_ctb(data, 0x1234, 1).tobytes()
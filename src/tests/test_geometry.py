@@ -0,0 +1,62 @@
+from collections import deque
+
+import numpy as np
+
+from lib.geometry import LayerGeometry, layer_geometry
+
+
+def reference_geometry(frame):
+    """
+    Compute the statistics pixel by pixel, the islands by a breadth-first search (4-connectivity).
+    """
+    lit = frame > 0
+    height, width = lit.shape
+    padded = np.pad(lit, 1)
+    edges_x = int(np.count_nonzero(padded[:, 1:] != padded[:, :-1]))
+    edges_y = int(np.count_nonzero(padded[1:] != padded[:-1]))
+
+    seen = np.zeros_like(lit)
+    sizes = []
+    for y in range(height):
+        for x in range(width):
+            if not lit[y, x] or seen[y, x]:
+                continue
+            seen[y, x] = True
+            queue, size = deque([(y, x)]), 0
+            while queue:
+                cy, cx = queue.popleft()
+                size += 1
+                for ny, nx in ((cy - 1, cx), (cy + 1, cx), (cy, cx - 1), (cy, cx + 1)):
+                    if 0 <= ny < height and 0 <= nx < width and lit[ny, nx] and not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        queue.append((ny, nx))
+            sizes.append(size)
+    return LayerGeometry(int(lit.sum()), edges_x, edges_y, len(sizes), max(sizes, default=0))
+
+
+def test_layer_geometry_random():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        height, width = rng.integers(1, 24, 2)
+        frame = (rng.random((height, width)) < rng.random()) * rng.integers(1, 256, (height, width))
+        frame = frame.astype(np.uint8)
+        assert layer_geometry(frame) == reference_geometry(frame)
+
+
+def test_layer_geometry_shapes():
+    frame = np.zeros((20, 20), dtype=np.uint8)
+    assert layer_geometry(frame) == LayerGeometry(0, 0, 0, 0, 0)
+
+    # a ring is one island, the diagonal neighbor is another one
+    frame[2:8, 2:8] = 255
+    frame[4:6, 4:6] = 0
+    frame[8, 8] = 255
+    assert layer_geometry(frame) == LayerGeometry(33, 18, 18, 2, 32)
+
+    # a U shape joined only at the bottom row is one island
+    frame = np.zeros((10, 10), dtype=np.uint8)
+    frame[1:9, 1] = frame[1:9, 8] = frame[8, 1:9] = 1
+    assert layer_geometry(frame).islands == 1
+
+    full = np.full((5, 7), 9, dtype=np.uint8)
+    assert layer_geometry(full) == LayerGeometry(35, 10, 14, 1, 35)
@@ -0,0 +1,131 @@
+import zlib
+
+import pytest
+
+from lib.position import PositionJournal, RECORD, RECORD_SLOTS, JOURNAL_SIZE, FLAG_MOVING
+
+
+def open_journal(filepath, default=0):
+    """
+    Open a journal of its own (PositionJournal() returns the journal of the printer).
+    """
+    journal = object.__new__(PositionJournal)
+    journal.__init__()
+    journal.open(str(filepath), default)
+    return journal
+
+
+def read_records(filepath):
+    """
+    Read the records of a journal from the file with plain file I/O.
+
+    Returns:
+        list: (sequence, position, flags, valid) of every record slot.
+    """
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    assert len(data) == JOURNAL_SIZE
+    records = []
+    for offset in RECORD_SLOTS:
+        sequence, position, flags, crc = RECORD.unpack_from(data, offset)
+        valid = sequence > 0 and crc == zlib.crc32(data[offset:offset + RECORD.size - 4])
+        records.append((sequence, position, flags, valid))
+    return records
+
+
+def newest(filepath):
+    return max(record for record in read_records(filepath) if record[3])
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / 'state' / 'position.journal'
+
+
+def test_new_journal_starts_at_default(path):
+    journal = open_journal(path, default=42)
+    assert journal.position == 42
+    assert not journal.recovered
+    assert newest(path)[1:3] == (42, 0)
+    journal.close()
+
+    journal = open_journal(path)
+    assert journal.recovered
+    assert journal.position == 42
+    journal.close()
+
+
+def test_records_alternate(path):
+    journal = open_journal(path)
+    for position in range(1, 6):
+        journal.set(position * 100)
+        records = read_records(path)
+        assert all(valid for *_, valid in records)
+        # the newest record holds the position, the other one the position before
+        assert sorted(records)[-1][1] == position * 100
+        assert sorted(records)[0][1] == (position - 1) * 100
+        assert abs(records[0][0] - records[1][0]) == 1
+    journal.close()
+
+
+def test_move_is_persisted_at_begin_and_end_only(path):
+    journal = open_journal(path)
+    journal.set(1000)
+    journal.begin()
+    sequence = newest(path)[0]
+    for _ in range(50):
+        journal.move(-10)
+    assert newest(path)[:3] == (sequence, 1000, FLAG_MOVING)
+
+    # a crash during the move leaves the start position, marked as moving
+    crashed = open_journal(path)
+    assert crashed.moving
+    assert crashed.position == 1000
+
+    journal.end()
+    assert newest(path)[1:3] == (500, 0)
+    recovered = open_journal(path)
+    assert not recovered.moving
+    assert recovered.position == 500
+    for j in (journal, crashed, recovered):
+        j.close()
+
+
+def test_unchanged_position_is_not_written(path):
+    journal = open_journal(path)
+    journal.set(7)
+    sequence = newest(path)[0]
+    journal.set(7)
+    journal.flush()
+    assert newest(path)[0] == sequence
+    journal.close()
+
+
+def test_corrupt_record_falls_back_to_the_other(path):
+    journal = open_journal(path)
+    journal.set(10)
+    journal.set(20)
+    journal.close()
+
+    # a torn write of the newest record
+    records = read_records(path)
+    offset = RECORD_SLOTS[records.index(max(records))]
+    with open(path, 'r+b') as f:
+        f.seek(offset + 8)
+        f.write(b'\xff\xff')
+
+    journal = open_journal(path)
+    assert journal.recovered
+    assert journal.position == 10
+    journal.close()
+
+
+def test_no_valid_record_starts_at_default(path):
+    open_journal(path).close()
+    with open(path, 'r+b') as f:
+        f.write(bytes(JOURNAL_SIZE))
+
+    journal = open_journal(path, default=3)
+    assert not journal.recovered
+    assert journal.position == 3
+    journal.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from lib.waveform import PULSE, SimulatedWaveformBackend, WaveformError, build_waveform, pin_mask
+
+STEP_PIN = 24
+
+
+def steps(*delays):
+    return np.array(delays, dtype=np.int64)
+
+
+def test_build_waveform():
+    wave = build_waveform(steps(1000, 2001), pin_mask([STEP_PIN]))
+    assert wave.dtype == PULSE
+    assert wave['on'].tolist() == [1 << STEP_PIN, 0, 1 << STEP_PIN, 0]
+    assert wave['off'].tolist() == [0, 1 << STEP_PIN, 0, 1 << STEP_PIN]
+    assert wave['delay'].tolist() == [500, 500, 1000, 1001]
+
+
+def test_verify_step_train():
+    rng = np.random.default_rng(0)
+    delays = rng.integers(1000, 100000, 500)
+    backend = SimulatedWaveformBackend(min_pulse_ns=500, realtime=False)
+    record = backend.verify(build_waveform(delays, pin_mask([STEP_PIN])))
+    assert record == {'pulses': 1000, 'duration': int(delays.sum()), 'edges': {STEP_PIN: 500}}
+
+
+def test_verify_several_pins():
+    wave = np.zeros(4, dtype=PULSE)
+    wave['on'] = [1 << 2, 1 << 3, 0, 0]
+    wave['off'] = [0, 0, 1 << 2, 1 << 3]
+    wave['delay'] = 1000
+    record = SimulatedWaveformBackend(min_pulse_ns=1000).verify(wave)
+    assert record['edges'] == {2: 1, 3: 1}
+
+
+def test_verify_empty_waveform():
+    record = SimulatedWaveformBackend().verify(np.zeros(0, dtype=PULSE))
+    assert record == {'pulses': 0, 'duration': 0, 'edges': {}}
+
+
+def test_verify_rejects_set_and_clear_in_one_pulse():
+    wave = build_waveform(steps(1000), pin_mask([STEP_PIN]))
+    wave['off'][0] = 1 << STEP_PIN
+    with pytest.raises(WaveformError, match="sets and clears"):
+        SimulatedWaveformBackend().verify(wave)
+
+
+def test_verify_rejects_edges_not_alternating():
+    wave = build_waveform(steps(1000, 1000), pin_mask([STEP_PIN]))
+    wave['off'][1] = 0
+    wave['on'][1] = 1 << STEP_PIN
+    with pytest.raises(WaveformError, match="do not alternate"):
+        SimulatedWaveformBackend().verify(wave)
+
+
+def test_verify_min_pulse():
+    wave = build_waveform(steps(1000, 1000), pin_mask([STEP_PIN]))
+    SimulatedWaveformBackend(min_pulse_ns=500).verify(wave)
+    with pytest.raises(WaveformError, match="shorter than 501ns"):
+        SimulatedWaveformBackend(min_pulse_ns=501).verify(wave)
+
+
+def test_send_records_history():
+    backend = SimulatedWaveformBackend(realtime=False)
+    backend.send(build_waveform(steps(1000, 1000, 1000), pin_mask([STEP_PIN])))
+    assert backend.wait() == 6
+    assert backend.history[-1]['edges'] == {STEP_PIN: 3}
+
+
+def test_send_abort():
+    backend = SimulatedWaveformBackend()
+    wave = build_waveform(np.full(1000, 10_000_000, dtype=np.int64), pin_mask([STEP_PIN]))
+    backend.send(wave, abort=lambda: True)
+    assert backend.wait() < len(wave)
+    assert not backend.busy